@@ -2,21 +2,42 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import yfinance as yf
-from datetime import datetime
+from datetime import datetime, timedelta
 import math
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import json
+import sqlite3
+import threading
+import zlib
+import sys
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+import contextlib
+import argparse
+import asyncio
+import aiohttp
+import hashlib
+import pickle
+import pyarrow as pa
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+from multiprocessing import shared_memory
 from tqdm import tqdm
 import time
 import logging
 from scipy.stats import linregress, chi2
-from scipy.linalg import solve_toeplitz
+from scipy.linalg import solve_toeplitz, cholesky, solve_triangular, cho_factor, cho_solve
+from scipy.special import stdtr
+from scipy.signal import lfilter
 import cvxpy as cp
 from arch import arch_model
-from sklearn.covariance import LedoitWolf
 from functools import lru_cache
 from sklearn.decomposition import PCA
 from statsmodels.stats.outliers_influence import variance_inflation_factor
-from sklearn.linear_model import LinearRegression, Ridge
+from sklearn.linear_model import Ridge
 from tenacity import retry, stop_after_attempt, wait_exponential, wait_fixed, retry_if_exception_type
 import random
 from pandas_datareader import data as pdr
@@ -42,7 +63,7 @@ sector_etf_map = {
 }
 # Add key factor ETFs for new features
 factor_etfs = ['QQQ', 'IWM', 'DIA', 'EEM', 'EFA', 'IVE', 'IVW', 'MDY', 'MTUM', 'RSP', 'SPY', 'QUAL', 'SIZE', 'USMV']
-etf_list = list(set(sector_etf_map.values()) | set(factor_etfs))
+etf_list = sorted(set(sector_etf_map.values()) | set(factor_etfs))
 default_weights = {
     "(Dividends + Share Buyback) / FCF": 5.0, "CapEx / (Depr + Amor)": 4.5, "Debt Ratio": 6.0,
     "Gross Profit Margin": 7.5, "Inventory Turnover": 4.5, "Net Profit Margin": 6.5,
@@ -152,26 +173,74 @@ def get_value(df, possible_keys, col_index=0):
                  return pd.to_numeric(val, errors='coerce') if val is not None else np.nan
     return np.nan
 
-# --- SVD-based PSD Matrix Correction (Section 9.5) ---
-def nearest_psd_matrix(matrix):
+# --- PSD Matrix Correction (Section 9.5) ---
+# The same covariance is repaired several times per run (weights, FMP, Mahalanobis,
+# correlation matrix), so results are cached by matrix content.
+PSD_CACHE_SIZE = 32
+PSD_EIGEN_FLOOR = 1e-10
+_psd_cache = OrderedDict()
+_psd_cache_lock = threading.Lock()
+
+def _higham_nearest_correlation(matrix, max_iter=100, tol=1e-8):
+    """
+    Higham (2002) alternating projections with Dykstra's correction: nearest matrix that is
+    both PSD and has a unit diagonal.
     """
-    Ensure a matrix is positive semi-definite using SVD for numerical stability.
+    Y = matrix.copy()
+    correction = np.zeros_like(matrix)
+    for _ in range(max_iter):
+        R = Y - correction
+        eigenvalues, eigenvectors = np.linalg.eigh(R)
+        X = (eigenvectors * np.maximum(eigenvalues, 0.0)) @ eigenvectors.T
+        correction = X - R
+        Y_next = X.copy()
+        np.fill_diagonal(Y_next, 1.0)
+        converged = np.linalg.norm(Y_next - Y, 'fro') <= tol * max(np.linalg.norm(Y, 'fro'), 1.0)
+        Y = Y_next
+        if converged: break
+    # Final clip so tiny negative eigenvalues left by the tolerance don't break Cholesky downstream
+    eigenvalues, eigenvectors = np.linalg.eigh(Y)
+    Y = (eigenvectors * np.maximum(eigenvalues, PSD_EIGEN_FLOOR)) @ eigenvectors.T
+    d = np.sqrt(np.diag(Y))
+    return Y / np.outer(d, d)
+
+def nearest_psd_matrix(matrix, method='eigen', use_cache=True):
+    """
+    Ensure a matrix is positive semi-definite.
+
+    Matrices that already pass a Cholesky test are returned (symmetrized) untouched; otherwise
+    eigenvalues of the symmetric eigendecomposition are clipped at PSD_EIGEN_FLOOR.
+    method='higham' instead returns the nearest correlation matrix (PSD with unit diagonal).
     """
     try:
-        if not isinstance(matrix, np.ndarray):
-            matrix = np.array(matrix)
+        matrix = np.array(matrix, dtype=np.float64)
         # Symmetrize the matrix
         matrix = (matrix + matrix.T) / 2
 
-        # Perform SVD
-        U, s, Vt = np.linalg.svd(matrix, full_matrices=False)
-
-        # Reconstruct with non-negative singular values
-        s = np.maximum(s, 1e-10)
-        psd_matrix = U @ np.diag(s) @ Vt
+        key = None
+        if use_cache:
+            key = (method, matrix.shape, hashlib.blake2b(np.ascontiguousarray(matrix).tobytes(), digest_size=16).hexdigest())
+            with _psd_cache_lock:
+                if key in _psd_cache:
+                    _psd_cache.move_to_end(key)
+                    return _psd_cache[key].copy()
 
+        if method == 'higham':
+            psd_matrix = _higham_nearest_correlation(matrix)
+        else:
+            try:
+                np.linalg.cholesky(matrix)
+                psd_matrix = matrix
+            except np.linalg.LinAlgError:
+                eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+                psd_matrix = (eigenvectors * np.maximum(eigenvalues, PSD_EIGEN_FLOOR)) @ eigenvectors.T
         # Symmetrize again to ensure exact symmetry after reconstruction
         psd_matrix = (psd_matrix + psd_matrix.T) / 2
+
+        if key is not None:
+            with _psd_cache_lock:
+                _psd_cache[key] = psd_matrix.copy()
+                if len(_psd_cache) > PSD_CACHE_SIZE: _psd_cache.popitem(last=False)
         return psd_matrix
     except Exception as e:
         logging.error(f"Error in PSD correction: {e}")
@@ -183,12 +252,12 @@ def nearest_psd_matrix(matrix):
 @st.cache_data
 def fetch_and_organize_deep_dive_data(_ticker_symbol):
     try:
-        ticker = yf.Ticker(_ticker_symbol)
-        info = ticker.info
-        hist_10y = ticker.history(period="10y")
-        financials = ticker.financials
-        balance_sheet = ticker.balance_sheet
-        cashflow = ticker.cashflow
+        provider = get_data_provider()
+        info = provider.info(_ticker_symbol)
+        hist_10y = provider.history(_ticker_symbol, period="10y")
+        financials = provider.statements(_ticker_symbol, "financials")
+        balance_sheet = provider.statements(_ticker_symbol, "balancesheet")
+        cashflow = provider.statements(_ticker_symbol, "cashflow")
         if not info: return {"Error": f"Could not retrieve info for {_ticker_symbol}."}
         price_data = {
             'Price': info.get('currentPrice', info.get('regularMarketPrice')), 'Change': info.get('regularMarketChange'),
@@ -260,10 +329,741 @@ def display_deep_dive_data(ticker_symbol):
             elif isinstance(content, pd.DataFrame):
                 st.dataframe(content, use_container_width=True)
 
+# --- Persistent Market-Data Store ---
+# Raw yfinance payloads are kept on disk so a process restart doesn't mean re-downloading
+# the whole universe. Frames are stored as one Parquet file per (dataset, symbol), `info`
+# as JSON, and a small SQLite index records when each entry was fetched.
+MARKET_DATA_STORE_DIR = os.environ.get("TRADFI_STORE_DIR", "market_data_store")
+DATASET_TTLS = {
+    "history": timedelta(days=1),
+    "info": timedelta(days=1),
+    "financials": timedelta(days=90),
+    "balancesheet": timedelta(days=90),
+    "cashflow": timedelta(days=90),
+    "quarterly_financials": timedelta(days=90),
+    "quarterly_balancesheet": timedelta(days=90),
+    "quarterly_cashflow": timedelta(days=90),
+}
+# Incremental refresh re-downloads only bars after the last stored date, plus a short
+# overlap window used to detect split/dividend re-adjustments of the stored series.
+INCREMENTAL_HISTORY_REFRESH = os.environ.get("TRADFI_INCREMENTAL_REFRESH", "1") != "0"
+HISTORY_OVERLAP_BARS = 5
+JSON_DATASETS = {"info", "garch_params"}
+STATEMENT_DATASETS = ["financials", "balancesheet", "cashflow", "quarterly_financials", "quarterly_balancesheet", "quarterly_cashflow"]
+
+@contextlib.contextmanager
+def sqlite_transaction(path, timeout=30):
+    """
+    One SQLite transaction: committed on success, rolled back on error, and the connection is
+    closed on exit (sqlite3's own context manager only commits, leaking the connection).
+    """
+    with contextlib.closing(sqlite3.connect(path, timeout=timeout)) as conn, conn:
+        yield conn
+
+class MarketDataStore:
+    """
+    Local, columnar cache of market data with per-dataset TTLs.
+
+    Every read goes through `load_or_fetch`, which serves fresh local copies, calls the
+    network fetcher for missing/stale entries and falls back to a stale copy when the
+    fetch fails. Pre-seeding the store with `write` makes the pipeline run fully offline.
+    """
+    def __init__(self, root=MARKET_DATA_STORE_DIR, ttls=None):
+        self.root = root
+        self.ttls = {**DATASET_TTLS, **(ttls or {})}
+        self._lock = threading.Lock()
+        self.refresh_stats = {"incremental": 0, "full": 0, "adjustment_repulls": 0, "rows_fetched": 0, "rows_saved": 0, "bytes_saved": 0}
+        os.makedirs(self.root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (dataset TEXT NOT NULL, symbol TEXT NOT NULL, "
+                "fetched_at REAL NOT NULL, n_rows INTEGER, last_date TEXT, PRIMARY KEY (dataset, symbol))"
+            )
+
+    def _connect(self):
+        return sqlite_transaction(os.path.join(self.root, "index.sqlite"))
+
+    def _path(self, dataset, symbol):
+        ext = "json" if dataset in JSON_DATASETS else "parquet"
+        safe_symbol = symbol.replace("/", "_").replace(os.sep, "_")
+        return os.path.join(self.root, dataset, f"{safe_symbol}.{ext}")
+
+    def fetched_at(self, dataset, symbol):
+        with self._connect() as conn:
+            row = conn.execute("SELECT fetched_at FROM entries WHERE dataset = ? AND symbol = ?", (dataset, symbol)).fetchone()
+        return datetime.fromtimestamp(row[0]) if row else None
+
+    def is_fresh(self, dataset, symbol, now=None):
+        fetched_at = self.fetched_at(dataset, symbol)
+        if fetched_at is None or not os.path.exists(self._path(dataset, symbol)): return False
+        ttl = self.ttls.get(dataset, timedelta(days=1))
+        return (now or datetime.now()) - fetched_at < ttl
+
+    def read(self, dataset, symbol):
+        """Returns the stored object (DataFrame, or dict for `info`), or None if absent."""
+        path = self._path(dataset, symbol)
+        if not os.path.exists(path): return None
+        try:
+            if dataset in JSON_DATASETS:
+                with open(path) as f: return json.load(f)
+            df = pd.read_parquet(path)
+            if dataset in STATEMENT_DATASETS:
+                # Statement columns are period-end dates; Parquet stores them as strings
+                df.columns = pd.to_datetime(df.columns, errors='coerce')
+            return df
+        except Exception as e:
+            logging.error(f"Corrupt store entry {dataset}/{symbol}: {e}")
+            return None
+
+    def write(self, dataset, symbol, obj, fetched_at=None):
+        path = self._path(dataset, symbol)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        n_rows, last_date = None, None
+        if dataset in JSON_DATASETS:
+            with open(tmp_path, "w") as f: json.dump(obj or {}, f, default=str)
+        else:
+            df = obj.copy() if obj is not None else pd.DataFrame()
+            if dataset in STATEMENT_DATASETS:
+                df = df.apply(pd.to_numeric, errors='coerce')
+                df.columns = [c.isoformat() if hasattr(c, 'isoformat') else str(c) for c in df.columns]
+                df.index = df.index.astype(str)
+            elif isinstance(df.index, pd.DatetimeIndex) and len(df):
+                last_date = df.index.max().isoformat()
+            n_rows = len(df)
+            df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+        fetched_ts = (fetched_at or datetime.now()).timestamp()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (dataset, symbol, fetched_at, n_rows, last_date) VALUES (?, ?, ?, ?, ?)",
+                (dataset, symbol, fetched_ts, n_rows, last_date)
+            )
+
+    def load_or_fetch(self, dataset, symbol, fetcher):
+        if self.is_fresh(dataset, symbol):
+            cached = self.read(dataset, symbol)
+            if cached is not None: return cached
+        try:
+            obj = fetcher()
+        except Exception as e:
+            stale = self.read(dataset, symbol)
+            if stale is None: raise
+            logging.warning(f"Fetch of {dataset} for {symbol} failed ({e}); serving stale copy.")
+            return stale
+        self.write(dataset, symbol, obj)
+        # Serve the stored form (numeric statements, JSON-normalized info) so cold and warm runs match
+        stored = self.read(dataset, symbol)
+        return stored if stored is not None else obj
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.refresh_stats[key] += value
+
+    def load_or_refresh_history(self, dataset, symbol, fetch_full, fetch_since, period="3y"):
+        """
+        Like `load_or_fetch`, but a stale price history is brought up to date by downloading
+        only the bars after the last stored date. The last `HISTORY_OVERLAP_BARS` stored bars
+        are re-downloaded too; if any of them (bar the possibly-partial final one) changed,
+        the vendor re-adjusted the series and this symbol alone gets a full re-pull.
+        """
+        stored = self.read(dataset, symbol)
+        if stored is not None and self.is_fresh(dataset, symbol): return stored
+        if stored is None or stored.empty or not INCREMENTAL_HISTORY_REFRESH:
+            return self._full_history_pull(dataset, symbol, fetch_full, stored)
+
+        overlap_start = stored.index[-min(HISTORY_OVERLAP_BARS, len(stored))]
+        try:
+            tail = fetch_since(overlap_start)
+        except Exception as e:
+            logging.warning(f"Incremental refresh of {symbol} failed ({e}); serving stale copy.")
+            return stored
+        if tail is None or tail.empty:
+            self.write(dataset, symbol, stored)
+            return stored
+
+        overlap_idx = stored.index[:-1].intersection(tail.index)
+        if len(overlap_idx) and not np.allclose(stored.loc[overlap_idx, 'Close'], tail.loc[overlap_idx, 'Close'], rtol=1e-6, atol=0, equal_nan=True):
+            logging.info(f"Adjustment change detected for {symbol}; re-pulling full history.")
+            self._count(adjustment_repulls=1)
+            return self._full_history_pull(dataset, symbol, fetch_full, stored)
+
+        spliced = pd.concat([stored[stored.index < tail.index[0]], tail])
+        spliced = spliced[~spliced.index.duplicated(keep='last')].sort_index()
+        offset = _period_to_offset(period)
+        if offset is not None:
+            spliced = spliced[spliced.index > spliced.index[-1] - offset]
+
+        rows_saved = max(len(spliced) - len(tail), 0)
+        bytes_per_row = spliced.memory_usage(deep=True).sum() / max(len(spliced), 1)
+        self._count(incremental=1, rows_fetched=len(tail), rows_saved=rows_saved, bytes_saved=int(rows_saved * bytes_per_row))
+        self.write(dataset, symbol, spliced)
+        return spliced
+
+    def _full_history_pull(self, dataset, symbol, fetch_full, stored):
+        try:
+            history = fetch_full()
+        except Exception as e:
+            if stored is None: raise
+            logging.warning(f"Full refresh of {symbol} failed ({e}); serving stale copy.")
+            return stored
+        self._count(full=1, rows_fetched=len(history))
+        self.write(dataset, symbol, history)
+        return history
+
+    def refresh_report(self):
+        """Summarises how much download volume incremental refreshes avoided."""
+        stats = dict(self.refresh_stats)
+        total_rows = stats["rows_fetched"] + stats["rows_saved"]
+        stats["rows_saved_pct"] = 100.0 * stats["rows_saved"] / total_rows if total_rows else 0.0
+        return stats
+
+def _period_to_offset(period):
+    """Converts a yfinance period string such as '3y', '6mo' or '60d' to a DateOffset."""
+    try:
+        if period.endswith("mo"): return pd.DateOffset(months=int(period[:-2]))
+        if period.endswith("y"): return pd.DateOffset(years=int(period[:-1]))
+        if period.endswith("d"): return pd.DateOffset(days=int(period[:-1]))
+    except ValueError: pass
+    return None
+
+_market_data_store = None
+_market_data_store_lock = threading.Lock()
+
+def get_market_data_store():
+    global _market_data_store
+    with _market_data_store_lock:
+        if _market_data_store is None:
+            namespace = get_data_provider().store_namespace
+            _market_data_store = MarketDataStore(root=os.path.join(MARKET_DATA_STORE_DIR, namespace) if namespace else MARKET_DATA_STORE_DIR)
+        return _market_data_store
+
+def _history_dataset(period):
+    return "history" if period == "3y" else f"history_{period}"
+
+def load_price_history(ticker_symbol, period="3y"):
+    """Daily auto-adjusted bars with a tz-naive index, served from the local store when fresh."""
+    provider = get_data_provider()
+    def fetch_full():
+        return provider.history(ticker_symbol, period=period)
+    def fetch_since(start):
+        return provider.history(ticker_symbol, start=start)
+    return get_market_data_store().load_or_refresh_history(_history_dataset(period), ticker_symbol, fetch_full, fetch_since, period)
+
+# --- Async Data Acquisition ---
+# Bulk price downloads go through one aiohttp session against Yahoo's chart endpoint instead of
+# one blocking yfinance call per thread. Stale symbols are prefetched concurrently into the store
+# so the thread-pool readers that follow only hit local files. The base URL can point at a local
+# stand-in server that serves canned chart responses. The chart endpoint is undocumented, so the
+# prefetch is opt-in (TRADFI_ASYNC_FETCH=1); by default every download goes through the provider.
+ASYNC_PREFETCH = os.environ.get("TRADFI_ASYNC_FETCH", "0") == "1"
+CHART_BASE_URL = os.environ.get("TRADFI_CHART_BASE_URL", "https://query2.finance.yahoo.com")
+ASYNC_FETCH_CONFIG = {
+    "rate_per_second": 8.0,     # token-bucket refill rate
+    "burst": 16,                # token-bucket capacity
+    "max_connections": 32,
+    "per_host_limit": 8,
+    "max_retries": 5,
+    "backoff_base": 0.5,        # seconds; full-jitter exponential backoff
+    "backoff_cap": 30.0,
+    "timeout": 30.0,
+}
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Async token bucket: `acquire()` waits until a token is available."""
+    def __init__(self, rate, capacity):
+        self.rate, self.capacity = float(rate), float(capacity)
+        self.tokens, self.updated = float(capacity), time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class RetryableHTTPError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status, self.retry_after = status, retry_after
+
+def _retry_after_seconds(value):
+    if not value: return None
+    try: return max(float(value), 0.0)
+    except ValueError: pass
+    try: return max((pd.Timestamp(value).tz_convert(None) - pd.Timestamp.utcnow().tz_convert(None)).total_seconds(), 0.0)
+    except Exception: return None
+
+def parse_chart_response(payload):
+    """
+    Converts a Yahoo chart-endpoint JSON payload into yfinance-style auto-adjusted daily bars
+    (Open/High/Low/Close/Volume) with a tz-naive index at the exchange's local midnight.
+    """
+    chart = payload.get("chart", {})
+    if chart.get("error"): raise ValueError(chart["error"].get("description", "chart error"))
+    result = (chart.get("result") or [None])[0]
+    if not result or not result.get("timestamp"): return pd.DataFrame(columns=PricePanel.FIELDS)
+    quote = result["indicators"]["quote"][0]
+    index = pd.to_datetime(result["timestamp"], unit="s", utc=True)
+    tz = result.get("meta", {}).get("exchangeTimezoneName")
+    if tz: index = index.tz_convert(tz)
+    index = index.normalize().tz_localize(None).astype("datetime64[ns]")
+    history = pd.DataFrame({
+        "Open": quote.get("open"), "High": quote.get("high"), "Low": quote.get("low"),
+        "Close": quote.get("close"), "Volume": quote.get("volume"),
+    }, index=index, dtype=float)
+    adjclose = (result["indicators"].get("adjclose") or [{}])[0].get("adjclose")
+    if adjclose is not None:
+        # Same back-adjustment as yfinance's auto_adjust: scale OHLC by adjclose / close
+        ratio = np.asarray(adjclose, dtype=float) / history["Close"].to_numpy()
+        for field in ["Open", "High", "Low", "Close"]: history[field] = history[field] * ratio
+    history = history.dropna(subset=["Close"])
+    return history[~history.index.duplicated(keep="last")]
+
+class AsyncHistoryFetcher:
+    """
+    Concurrent daily-history downloads with a shared connection pool, a token-bucket rate
+    limit, per-host connection caps, jittered backoff on 429/5xx and request coalescing:
+    concurrent requests for the same (symbol, period, start) share one in-flight download.
+
+    Use as `async with AsyncHistoryFetcher() as fetcher: await fetcher.fetch_many(...)`.
+    """
+    def __init__(self, base_url=None, config=None):
+        self.base_url = (base_url or CHART_BASE_URL).rstrip("/")
+        self.config = {**ASYNC_FETCH_CONFIG, **(config or {})}
+        self.stats = {"requests": 0, "retries": 0, "coalesced": 0, "failed": 0}
+        self._session = None
+        self._bucket = None
+        self._inflight = {}
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.config["max_connections"], limit_per_host=self.config["per_host_limit"], ttl_dns_cache=300)
+        self._session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.config["timeout"]),
+            headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"},
+        )
+        self._bucket = TokenBucket(self.config["rate_per_second"], self.config["burst"])
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    async def _get_json(self, url, params):
+        for attempt in range(self.config["max_retries"] + 1):
+            await self._bucket.acquire()
+            self.stats["requests"] += 1
+            try:
+                async with self._session.get(url, params=params) as response:
+                    if response.status in RETRYABLE_STATUS:
+                        raise RetryableHTTPError(response.status, _retry_after_seconds(response.headers.get("Retry-After")))
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+            except (RetryableHTTPError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.config["max_retries"]: raise
+                delay = getattr(e, "retry_after", None)
+                if delay is None:
+                    delay = random.uniform(0, min(self.config["backoff_cap"], self.config["backoff_base"] * 2 ** attempt))
+                self.stats["retries"] += 1
+                logging.info(f"Retrying {url} in {delay:.2f}s after {e}")
+                await asyncio.sleep(delay)
+
+    async def _download(self, symbol, period, start):
+        params = {"interval": "1d", "includeAdjustedClose": "true", "events": "div,split"}
+        if start is None:
+            params["range"] = period
+        else:
+            params["period1"] = int(pd.Timestamp(start).timestamp())
+            params["period2"] = int(time.time())
+        payload = await self._get_json(f"{self.base_url}/v8/finance/chart/{symbol}", params)
+        return parse_chart_response(payload)
+
+    async def fetch_history(self, symbol, period="3y", start=None):
+        key = (symbol, period, None if start is None else pd.Timestamp(start))
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(task)
+        task = asyncio.ensure_future(self._download(symbol, period, start))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def fetch_many(self, requests):
+        """
+        Args:
+            requests (dict): {symbol: start} where start is None for a full `period` pull,
+                             or (period, start) tuples.
+
+        Returns:
+            dict: {symbol: pd.DataFrame or Exception}.
+        """
+        symbols = list(requests)
+        jobs = [self.fetch_history(symbol, *spec) if isinstance(spec, tuple) else self.fetch_history(symbol, start=spec) for symbol, spec in requests.items()]
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        self.stats["failed"] += sum(isinstance(result, Exception) for result in results)
+        return dict(zip(symbols, results))
+
+def run_coroutine(coro):
+    """Runs a coroutine from sync code, including when the calling thread already has a loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+def prefetch_price_histories(symbols, period="3y"):
+    """
+    Brings every stale stored history for `symbols` up to date with one `history_many` call on
+    the active provider (a concurrent download pass for yfinance), applying the same incremental-splice rules as `load_price_history`.
+
+    Returns:
+        dict: Fetcher stats (requests, retries, coalesced, failed) plus the number of symbols refreshed.
+    """
+    store = get_market_data_store()
+    dataset = _history_dataset(period)
+    plan = {}
+    for symbol in dict.fromkeys(symbols):
+        if store.is_fresh(dataset, symbol): continue
+        stored = store.read(dataset, symbol) if INCREMENTAL_HISTORY_REFRESH else None
+        start = stored.index[-min(HISTORY_OVERLAP_BARS, len(stored))] if stored is not None and not stored.empty else None
+        plan[symbol] = (period, start)
+    if not plan: return {"refreshed": 0}
+
+    provider = get_data_provider()
+    results, stats = provider.history_many(plan)
+
+    def result_or_raise(result):
+        if isinstance(result, Exception): raise result
+        return result.copy()
+
+    for symbol, result in results.items():
+        start = plan[symbol][1]
+        # Only symbols the vendor re-adjusted need a second, full download
+        def fetch_full(symbol=symbol, result=result, start=start):
+            if start is None: return result_or_raise(result)
+            return result_or_raise(provider.history_many({symbol: (period, None)})[0][symbol])
+        def fetch_since(_, result=result):
+            return result_or_raise(result)
+        try:
+            store.load_or_refresh_history(dataset, symbol, fetch_full, fetch_since, period)
+        except Exception as e:
+            logging.error(f"Async prefetch failed for {symbol}: {e}")
+    return {**stats, "refreshed": len(plan)}
+
+# --- Data Providers ---
+# Every network read goes through the active DataProvider. YFinanceProvider is the live
+# source; FixtureProvider serves a deterministic synthetic universe (or replays one recorded
+# to disk in the MarketDataStore layout) so the pipeline can be benchmarked and
+# regression-tested offline. Selected with TRADFI_DATA_PROVIDER=yfinance | fixture | fixture:<dir>.
+STATEMENT_ATTRIBUTES = {
+    "financials": "financials", "balancesheet": "balance_sheet", "cashflow": "cashflow",
+    "quarterly_financials": "quarterly_financials", "quarterly_balancesheet": "quarterly_balance_sheet",
+    "quarterly_cashflow": "quarterly_cashflow",
+}
+
+class DataProvider:
+    """
+    Interface for market data sources. Implementations return yfinance-shaped objects:
+    auto-adjusted OHLCV frames with a tz-naive daily index, the `info` dict, and statements
+    with line items as rows and period-end dates as columns (newest first).
+    """
+    name = "base"
+    store_namespace = None  # sub-directory of the market data store; None shares the default
+
+    def history(self, symbol, period="3y", start=None):
+        raise NotImplementedError
+
+    def history_many(self, requests):
+        """
+        Args:
+            requests (dict): {symbol: (period, start)}; start is None for a full `period` pull.
+
+        Returns:
+            tuple: ({symbol: pd.DataFrame or Exception}, stats dict).
+        """
+        results = {}
+        for symbol, (period, start) in requests.items():
+            try: results[symbol] = self.history(symbol, period=period, start=start)
+            except Exception as e: results[symbol] = e
+        return results, {"requests": len(requests), "failed": sum(isinstance(r, Exception) for r in results.values())}
+
+    def info(self, symbol):
+        raise NotImplementedError
+
+    def statements(self, symbol, kind):
+        """`kind` is one of STATEMENT_DATASETS, e.g. 'financials' or 'quarterly_cashflow'."""
+        raise NotImplementedError
+
+    def intraday(self, symbol, period="60d", interval="1h"):
+        raise NotImplementedError
+
+    def universe(self):
+        """Ticker list this provider is meant to be screened on, or None to use the module's list."""
+        return None
+
+class YFinanceProvider(DataProvider):
+    name = "yfinance"
+
+    def __init__(self, chart_base_url=None):
+        self.chart_base_url = chart_base_url
+
+    def history(self, symbol, period="3y", start=None):
+        ticker = yf.Ticker(symbol)
+        if start is None: history = ticker.history(period=period, auto_adjust=True, interval="1d")
+        else: history = ticker.history(start=start, auto_adjust=True, interval="1d")
+        return history.tz_localize(None)
+
+    def history_many(self, requests):
+        async def download():
+            async with AsyncHistoryFetcher(base_url=self.chart_base_url) as fetcher:
+                return await fetcher.fetch_many(requests), fetcher.stats
+        return run_coroutine(download())
+
+    def info(self, symbol):
+        return yf.Ticker(symbol).info
+
+    def statements(self, symbol, kind):
+        return getattr(yf.Ticker(symbol), STATEMENT_ATTRIBUTES[kind])
+
+    def intraday(self, symbol, period="60d", interval="1h"):
+        return yf.Ticker(symbol).history(period=period, interval=interval, auto_adjust=True)
+
+def _symbol_seed(symbol, seed):
+    return zlib.crc32(f"{seed}:{symbol}".encode())
+
+class FixtureProvider(DataProvider):
+    """
+    Deterministic offline data. Every symbol gets a reproducible path driven by a market
+    factor, a sector factor and stochastic idiosyncratic volatility, plus fundamentals and
+    statements scaled to its simulated size. With `root`, data recorded in the MarketDataStore
+    layout (e.g. by `record`) is replayed first and synthesis only fills gaps.
+
+    Args:
+        n_tickers (int): Size of the synthetic universe returned by `universe()`.
+        seed (int): Master seed; the same seed always yields the same universe and prices.
+        end (str): Last trading day of the simulated calendar.
+        root (str): Optional directory to replay recorded data from.
+        synthesize (bool): When replaying, whether missing symbols are generated or raise.
+    """
+    name = "fixture"
+    HISTORY_YEARS = 10
+
+    def __init__(self, n_tickers=1500, seed=0, end="2025-12-31", root=None, synthesize=True):
+        self.n_tickers, self.seed, self.root, self.synthesize = n_tickers, seed, root, synthesize
+        self.store_namespace = "fixture_replay" if root else f"fixture_{seed}"
+        self.calendar = pd.bdate_range(end=pd.Timestamp(end), periods=252 * self.HISTORY_YEARS)
+        self.replay = MarketDataStore(root=root) if root else None
+        rng = np.random.default_rng(seed)
+        n_days = len(self.calendar)
+        self._market = rng.standard_t(5, n_days) * 0.0075 + 0.0003
+        self._sector_factors = {sector: rng.standard_t(5, n_days) * 0.005 for sector in sector_etf_map}
+        self._sectors = list(sector_etf_map)
+        self._etf_sector = {etf: sector for sector, etf in sector_etf_map.items()}
+
+    def universe(self):
+        return [f"FX{i:04d}" for i in range(self.n_tickers)]
+
+    def _replayed(self, dataset, symbol):
+        if self.replay is None: return None
+        data = self.replay.read(dataset, symbol)
+        if data is None and not self.synthesize: raise KeyError(f"{symbol} has no recorded {dataset}")
+        return data
+
+    def _profile(self, symbol):
+        rng = np.random.default_rng(_symbol_seed(symbol, self.seed))
+        if symbol in etf_list:
+            sector = self._etf_sector.get(symbol)
+            return rng, {"sector": sector, "beta": 1.0 if sector is None else rng.uniform(0.8, 1.2), "sector_loading": 0.0 if sector is None else 1.0,
+                         "idio_vol": 0.002, "start": 0, "shares": 1e9}
+        return rng, {
+            "sector": self._sectors[rng.integers(len(self._sectors))], "beta": rng.uniform(0.4, 1.8),
+            "sector_loading": rng.uniform(0.3, 1.2), "idio_vol": rng.uniform(0.008, 0.03),
+            # Roughly one name in twenty listed part-way through the calendar
+            "start": int(rng.integers(len(self.calendar) - 600, len(self.calendar) - 300)) if rng.random() < 0.05 else 0,
+            "shares": float(rng.uniform(5e7, 5e9)),
+        }
+
+    def _bars(self, symbol):
+        rng, profile = self._profile(symbol)
+        n_days = len(self.calendar)
+        # Log-volatility follows an AR(1) so volatility clusters
+        log_vol = lfilter([1.0], [1.0, -0.97], rng.normal(0, 0.12, n_days))
+        idio = rng.standard_t(5, n_days) * profile["idio_vol"] * np.exp(log_vol) / np.sqrt(5 / 3)
+        sector_factor = self._sector_factors[profile["sector"]] if profile["sector"] else 0.0
+        returns = profile["beta"] * self._market + profile["sector_loading"] * sector_factor + idio
+        close = rng.uniform(10, 400) * np.exp(np.cumsum(returns))
+        open_ = close * np.exp(-returns * rng.uniform(0.2, 0.6, n_days))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.006, n_days)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.006, n_days)))
+        volume = np.round(profile["shares"] * rng.uniform(0.002, 0.01) * np.exp(rng.normal(0, 0.35, n_days)))
+        bars = pd.DataFrame({"Open": open_, "High": high, "Low": low, "Close": close, "Volume": volume}, index=self.calendar)
+        return bars.iloc[profile["start"]:], profile
+
+    def history(self, symbol, period="3y", start=None):
+        recorded = self._replayed(_history_dataset(period), symbol)
+        bars = recorded if recorded is not None else self._bars(symbol)[0]
+        if start is not None: return bars[bars.index >= pd.Timestamp(start)].copy()
+        offset = _period_to_offset(period)
+        return (bars[bars.index > bars.index[-1] - offset] if offset is not None and not bars.empty else bars).copy()
+
+    def intraday(self, symbol, period="60d", interval="1h"):
+        daily = self.history(symbol, period=period)
+        if daily.empty: return daily
+        rng = np.random.default_rng(_symbol_seed(symbol, self.seed + 1))
+        hours = pd.DatetimeIndex([day + pd.Timedelta(hours=9.5 + h) for day in daily.index for h in range(7)])
+        daily_returns = np.log(daily["Close"]).diff().fillna(0).to_numpy()
+        hourly_returns = np.repeat(daily_returns / 7, 7) + rng.normal(0, 0.002, len(hours))
+        close = daily["Close"].iloc[0] * np.exp(np.cumsum(hourly_returns))
+        volume = np.repeat(daily["Volume"].to_numpy() / 7, 7)
+        return pd.DataFrame({"Open": close, "High": close * 1.001, "Low": close * 0.999, "Close": close, "Volume": volume}, index=hours)
+
+    def _fundamentals(self, symbol):
+        bars, profile = self._bars(symbol)
+        rng = np.random.default_rng(_symbol_seed(symbol, self.seed + 2))
+        price = float(bars["Close"].iloc[-1])
+        market_cap = price * profile["shares"]
+        revenue = market_cap / rng.uniform(0.8, 8.0)
+        growth = rng.normal(0.08, 0.12)
+        margins = {"gross": rng.uniform(0.2, 0.75), "operating": rng.uniform(-0.05, 0.35), "net": 0.0}
+        margins["net"] = margins["operating"] * rng.uniform(0.6, 0.85)
+        return bars, profile, rng, price, market_cap, revenue, growth, margins
+
+    def info(self, symbol):
+        recorded = self._replayed("info", symbol)
+        if recorded is not None: return recorded
+        bars, profile, rng, price, market_cap, revenue, growth, margins = self._fundamentals(symbol)
+        close = bars["Close"]
+        eps = revenue * margins["net"] / profile["shares"]
+        total_debt, total_cash = revenue * rng.uniform(0, 1.2), revenue * rng.uniform(0.05, 0.4)
+        ebitda = revenue * (margins["operating"] + 0.04)
+        return {
+            "longName": f"{symbol} Holdings Inc.", "sector": profile["sector"] or "Financial Services", "exchange": "NMS",
+            "currentPrice": price, "regularMarketPrice": price, "previousClose": float(close.iloc[-2]), "open": float(bars["Open"].iloc[-1]),
+            "dayHigh": float(bars["High"].iloc[-1]), "dayLow": float(bars["Low"].iloc[-1]),
+            "regularMarketChange": price - float(close.iloc[-2]), "regularMarketChangePercent": price / float(close.iloc[-2]) - 1,
+            "fiftyTwoWeekHigh": float(close.iloc[-252:].max()), "fiftyTwoWeekLow": float(close.iloc[-252:].min()),
+            "fiftyDayAverage": float(close.iloc[-50:].mean()), "twoHundredDayAverage": float(close.iloc[-200:].mean()),
+            "volume": float(bars["Volume"].iloc[-1]), "averageVolume": float(bars["Volume"].iloc[-90:].mean()),
+            "marketCap": market_cap, "sharesOutstanding": profile["shares"], "beta": profile["beta"],
+            "enterpriseValue": market_cap + total_debt - total_cash, "totalDebt": total_debt, "totalCash": total_cash,
+            "ebitda": ebitda, "depreciation": revenue * 0.04, "freeCashflow": revenue * margins["net"] * rng.uniform(0.7, 1.2),
+            "trailingEps": eps, "trailingPE": price / eps if eps > 0 else None, "forwardPE": price / (eps * (1 + growth)) if eps > 0 else None,
+            "priceToBook": rng.uniform(1, 12), "enterpriseToEbitda": (market_cap + total_debt - total_cash) / ebitda if ebitda > 0 else None,
+            "enterpriseToRevenue": (market_cap + total_debt - total_cash) / revenue,
+            "dividendYield": rng.choice([0.0, rng.uniform(0.2, 4.0)]), "payoutRatio": rng.uniform(0, 0.6),
+            "grossMargins": margins["gross"], "operatingMargins": margins["operating"], "profitMargins": margins["net"],
+            "returnOnAssets": margins["net"] * rng.uniform(0.3, 0.9), "returnOnEquity": margins["net"] * rng.uniform(0.8, 2.5),
+            "revenueGrowth": growth, "earningsGrowth": growth * rng.uniform(0.5, 2.0),
+            "currentRatio": rng.uniform(0.8, 3.0), "quickRatio": rng.uniform(0.5, 2.5), "debtToEquity": rng.uniform(0, 200),
+            "heldPercentInsiders": rng.uniform(0, 0.2), "heldPercentInstitutions": rng.uniform(0.3, 0.95),
+            "auditRisk": int(rng.integers(1, 11)), "boardRisk": int(rng.integers(1, 11)), "compensationRisk": int(rng.integers(1, 11)),
+            "shareHolderRightsRisk": int(rng.integers(1, 11)), "overallRisk": int(rng.integers(1, 11)),
+        }
+
+    def statements(self, symbol, kind):
+        recorded = self._replayed(kind, symbol)
+        if recorded is not None: return recorded
+        bars, profile, rng, price, market_cap, revenue, growth, margins = self._fundamentals(symbol)
+        quarterly = kind.startswith("quarterly_")
+        n_periods, step = (5, pd.DateOffset(months=3)) if quarterly else (4, pd.DateOffset(years=1))
+        # Latest period is the last one reported ~45 days before the end of the calendar
+        last_period = pd.offsets.QuarterEnd().rollback(bars.index[-1] - pd.Timedelta(days=45)) if quarterly else pd.Timestamp(bars.index[-1].year - 1, 12, 31)
+        periods = [last_period - step * k for k in range(n_periods)]
+        scale = 0.25 if quarterly else 1.0
+        per_period_growth = (1 + growth) ** (0.25 if quarterly else 1.0)
+        # Newest first, like yfinance; each older period shrinks by the growth rate plus noise
+        revenues = np.array([revenue * scale / per_period_growth ** k * rng.uniform(0.95, 1.05) for k in range(n_periods)])
+        noise = lambda: rng.uniform(0.9, 1.1, n_periods)
+        if kind.endswith("financials"):
+            gross = revenues * margins["gross"] * noise()
+            operating = revenues * margins["operating"] * noise()
+            rows = {
+                "Total Revenue": revenues, "Cost Of Revenue": revenues - gross, "Gross Profit": gross,
+                "Research And Development": gross * rng.uniform(0, 0.4) * noise(), "Operating Income": operating,
+                "EBIT": operating * noise(), "EBITDA": operating + revenues * 0.04, "Interest Expense": revenues * rng.uniform(0.002, 0.03) * noise(),
+                "Net Income": revenues * margins["net"] * noise(), "Diluted EPS": revenues * margins["net"] / profile["shares"],
+            }
+        elif kind.endswith("balancesheet"):
+            assets = revenues / scale * rng.uniform(0.8, 2.5) * noise()
+            liabilities = assets * rng.uniform(0.3, 0.8)
+            current_assets = assets * rng.uniform(0.2, 0.5)
+            rows = {
+                "Total Assets": assets, "Total Liabilities": liabilities, "Total Liabilities Net Minority Interest": liabilities,
+                "Total Stockholder Equity": assets - liabilities, "Stockholders Equity": assets - liabilities,
+                "Total Current Assets": current_assets, "Total Current Liabilities": current_assets / rng.uniform(0.8, 3.0),
+                "Inventory": current_assets * rng.uniform(0, 0.4), "Cash And Cash Equivalents": current_assets * rng.uniform(0.2, 0.6),
+                "Goodwill": assets * rng.uniform(0, 0.2), "Intangible Assets": assets * rng.uniform(0, 0.1),
+                "Long Term Debt": liabilities * rng.uniform(0.2, 0.6), "Total Debt": liabilities * rng.uniform(0.3, 0.7),
+                "Ordinary Shares Number": np.full(n_periods, profile["shares"]),
+            }
+        else:
+            operating_cf = revenues * (margins["net"] + 0.04) * noise()
+            capex = -revenues * rng.uniform(0.02, 0.1) * noise()
+            rows = {
+                "Operating Cash Flow": operating_cf, "Capital Expenditure": capex, "Free Cash Flow": operating_cf + capex,
+                "Depreciation And Amortization": revenues * 0.04 * noise(), "Dividends Paid": -np.maximum(operating_cf, 0) * rng.uniform(0, 0.3),
+                "Repurchase Of Capital Stock": -np.maximum(operating_cf, 0) * rng.uniform(0, 0.4),
+            }
+        return pd.DataFrame(rows, index=pd.DatetimeIndex(periods)).T
+
+    def record(self, symbols, root, period="3y"):
+        """Writes the synthetic data for `symbols` to `root` in MarketDataStore layout for later replay."""
+        store = MarketDataStore(root=root)
+        for symbol in symbols:
+            store.write(_history_dataset(period), symbol, self.history(symbol, period=period))
+            store.write("info", symbol, self.info(symbol))
+            for kind in STATEMENT_DATASETS: store.write(kind, symbol, self.statements(symbol, kind))
+        return root
+
+_data_provider = None
+_data_provider_lock = threading.Lock()
+
+def provider_from_spec(spec):
+    """'yfinance', 'fixture' or 'fixture:<dir>' -> DataProvider."""
+    if spec == "fixture":
+        return FixtureProvider(n_tickers=int(os.environ.get("TRADFI_FIXTURE_TICKERS", "1500")))
+    if spec.startswith("fixture:"):
+        return FixtureProvider(root=spec.split(":", 1)[1])
+    if spec != "yfinance": logging.warning(f"Unknown data provider '{spec}', using yfinance.")
+    return YFinanceProvider()
+
+def get_data_provider():
+    global _data_provider
+    with _data_provider_lock:
+        if _data_provider is None:
+            _data_provider = provider_from_spec(os.environ.get("TRADFI_DATA_PROVIDER", "yfinance"))
+        return _data_provider
+
+def set_data_provider(provider, store_root=None):
+    """
+    Switches the active provider and drops everything cached from the previous one.
+    `store_root` pins the market data store to a directory (e.g. a scratch dir for benchmarks).
+    """
+    global _data_provider, _market_data_store, _garch_estimator, _pure_return_history
+    with _data_provider_lock:
+        _data_provider = provider
+    with _market_data_store_lock:
+        _market_data_store = MarketDataStore(root=store_root) if store_root else None
+    with _pure_return_history_lock:
+        _pure_return_history = PureReturnHistory(root=os.path.join(store_root, "pure_return_history")) if store_root else None
+    with _garch_estimator_lock:
+        _garch_estimator = None
+    fetch_etf_history.cache_clear()
+    return provider
+
 # --- Advanced Metric & Data Fetching Functions ---
 @lru_cache(maxsize=None)
 def fetch_etf_history(ticker, period="3y"):
-    history = yf.Ticker(ticker).history(period=period, auto_adjust=True, interval="1d")
+    history = load_price_history(ticker, period).copy()
     if history.empty or 'Close' not in history.columns: raise ValueError(f"No valid data for {ticker}")
     history.index = history.index.tz_localize(None)
     history.dropna(subset=['Close'], inplace=True)
@@ -273,69 +1073,190 @@ def fetch_etf_history(ticker, period="3y"):
 @st.cache_data
 def fetch_all_etf_histories(_etf_list, period="3y"):
     etf_histories = {}
+    if ASYNC_PREFETCH:
+        try: logging.info(f"ETF history prefetch: {prefetch_price_histories(_etf_list, period)}")
+        except Exception as e: logging.error(f"Async ETF prefetch failed, falling back to per-symbol fetches: {e}")
     with ThreadPoolExecutor(max_workers=10) as executor:
         future_to_etf = {executor.submit(fetch_etf_history, etf, period): etf for etf in _etf_list}
         for future in tqdm(as_completed(future_to_etf), total=len(_etf_list), desc="Fetching ETF Histories"):
             etf = future_to_etf[future]
             try: etf_histories[etf] = future.result()
             except Exception as e: logging.error(f"Failed to fetch ETF history for {etf}: {e}")
-    return etf_histories
+    # Completion order is arbitrary; return request order so reruns hash identically
+    return {etf: etf_histories[etf] for etf in _etf_list if etf in etf_histories}
 
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
-def fetch_ticker_data(ticker_symbol):
-    ticker = yf.Ticker(ticker_symbol)
-    history = ticker.history(period="3y", auto_adjust=True, interval="1d").tz_localize(None)
-    info = ticker.info
-    financials = ticker.financials
-    balancesheet = ticker.balance_sheet
-    cashflow = ticker.cashflow
-    quarterly_financials = ticker.quarterly_financials
-    quarterly_balancesheet = ticker.quarterly_balance_sheet
-    quarterly_cashflow = ticker.quarterly_cashflow
-    return ticker, history, info, financials, balancesheet, cashflow, quarterly_financials, quarterly_balancesheet, quarterly_cashflow
+def fetch_ticker_data(ticker_symbol, price_panel=None):
+    store, provider = get_market_data_store(), get_data_provider()
+    history = get_price_history(ticker_symbol, price_panel=price_panel)
+    info = store.load_or_fetch("info", ticker_symbol, lambda: provider.info(ticker_symbol))
+    financials, balancesheet, cashflow, quarterly_financials, quarterly_balancesheet, quarterly_cashflow = (
+        store.load_or_fetch(kind, ticker_symbol, lambda kind=kind: provider.statements(ticker_symbol, kind)) for kind in STATEMENT_DATASETS
+    )
+    return ticker_symbol, history, info, financials, balancesheet, cashflow, quarterly_financials, quarterly_balancesheet, quarterly_cashflow
+
+# --- Shared Price Panel ---
+class PricePanel:
+    """
+    Date-indexed, float64 wide matrices (dates x symbols) of daily bars for every ticker
+    and ETF in a run. Built once, then sliced by column wherever a price history is needed,
+    so no symbol's history is downloaded or re-parsed more than once per run.
+    """
+    FIELDS = ("Open", "High", "Low", "Close", "Volume")
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.index = frames["Close"].index
+        self.symbols = frames["Close"].columns.tolist()
+
+    @classmethod
+    def from_histories(cls, histories, fields=FIELDS):
+        histories = {sym: h for sym, h in histories.items() if h is not None and not h.empty and 'Close' in h.columns}
+        frames = {}
+        for field in fields:
+            series = {sym: h[field] for sym, h in histories.items() if field in h.columns}
+            frame = pd.DataFrame(series, dtype=np.float64) if series else pd.DataFrame(dtype=np.float64)
+            frame.index = pd.DatetimeIndex(frame.index).tz_localize(None)
+            frames[field] = frame.sort_index()
+        return cls(frames)
+
+    def __contains__(self, symbol):
+        return symbol in self.frames["Close"].columns
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def field(self, field, symbols=None):
+        frame = self.frames[field]
+        return frame if symbols is None else frame.reindex(columns=list(symbols))
+
+    def closes(self, symbols=None):
+        return self.field("Close", symbols)
+
+    def volumes(self, symbols=None):
+        return self.field("Volume", symbols)
+
+    def history(self, symbol):
+        """Rebuilds the single-symbol OHLCV frame, keeping only the dates the symbol traded."""
+        if symbol not in self: return pd.DataFrame()
+        history = pd.DataFrame({field: frame[symbol] for field, frame in self.frames.items() if symbol in frame.columns})
+        return history[history['Close'].notna()]
+
+    def as_of(self, date):
+        """The panel truncated to bars on or before `date`."""
+        return PricePanel({field: frame.loc[:date] for field, frame in self.frames.items()})
+
+    def log_returns(self, symbols=None):
+        """
+        Wide log-return matrix where each column equals that symbol's own
+        `log(Close / Close.shift(1)).dropna()` placed on its trading dates.
+        """
+        closes = self.closes(symbols)
+        previous_close = closes.ffill().shift(1)
+        return np.log(closes / previous_close).where(closes.notna())
+
+    def simple_returns(self, symbols=None):
+        closes = self.closes(symbols)
+        previous_close = closes.ffill().shift(1)
+        return (closes / previous_close - 1).where(closes.notna())
+
+def weighted_column_sum(values, weights):
+    """
+    Sum of weight x column over the dates where any weighted column has a value, counting a
+    column's missing dates as 0: the wide-frame equivalent of chaining
+    `total.add(series * weight, fill_value=0)` over per-symbol series.
+    """
+    values = values[weights.index]
+    return (values * weights).sum(axis=1, min_count=1).dropna()
+
+def get_price_history(ticker_symbol, period="3y", price_panel=None):
+    """Column slice of the run's PricePanel when it holds the symbol, else a store read."""
+    if price_panel is not None and ticker_symbol in price_panel:
+        return price_panel.history(ticker_symbol)
+    return load_price_history(ticker_symbol, period)
+
+@st.cache_data
+def build_price_panel(_tickers, _etf_histories, period="3y"):
+    histories = dict(_etf_histories)
+    if ASYNC_PREFETCH:
+        try: logging.info(f"Price history prefetch: {prefetch_price_histories([t for t in _tickers if t not in histories], period)}")
+        except Exception as e: logging.error(f"Async price prefetch failed, falling back to per-symbol fetches: {e}")
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        future_to_ticker = {executor.submit(load_price_history, ticker, period): ticker for ticker in _tickers if ticker not in histories}
+        for future in tqdm(as_completed(future_to_ticker), total=len(future_to_ticker), desc="Building Price Panel"):
+            ticker = future_to_ticker[future]
+            try: histories[ticker] = future.result()
+            except Exception as e: logging.error(f"Failed to load price history for {ticker}: {e}")
+    return PricePanel.from_histories({sym: histories[sym] for sym in [*_etf_histories, *_tickers] if sym in histories})
 
 # --- START: NEWLY ADDED/MODIFIED QUANTITATIVE FUNCTIONS ---
 
+def _psd_cholesky(cov_matrix, max_tries=6):
+    """
+    Lower Cholesky factor of the PSD-corrected covariance.
+    A diagonal jitter scaled to the mean variance is added when the matrix is numerically singular.
+    """
+    cov_matrix = nearest_psd_matrix(cov_matrix)
+    jitter = 0.0
+    scale = max(np.mean(np.diag(cov_matrix)), 1e-12)
+    for attempt in range(max_tries):
+        try:
+            return cholesky(cov_matrix + jitter * np.eye(len(cov_matrix)), lower=True, check_finite=False)
+        except np.linalg.LinAlgError:
+            jitter = scale * 10.0 ** (attempt - 10)
+    raise np.linalg.LinAlgError("Covariance matrix is not positive definite even after jitter.")
+
+def calculate_mahalanobis_distances(returns, cov_matrix):
+    """
+    Daily Mahalanobis distances sqrt(r_t' Sigma^-1 r_t) for every row of `returns` at once.
+    With Sigma = L L', the squared distance is ||L^-1 r_t||^2, so one triangular solve over the
+    whole (assets x days) matrix replaces the explicit inverse and the per-day loop.
+    """
+    values = returns.values if isinstance(returns, pd.DataFrame) else np.asarray(returns)
+    L = _psd_cholesky(cov_matrix)
+    whitened = solve_triangular(L, values.T, lower=True, check_finite=False)
+    return np.sqrt(np.einsum('ij,ij->j', whitened, whitened))
+
 def calculate_mahalanobis_metrics(returns, cov_matrix, periods=252):
     """
     Calculate Mahalanobis distance and MALV for precision matrix evaluation.
     """
     try:
-        cov_matrix = nearest_psd_matrix(cov_matrix)
-        precision_matrix = np.linalg.inv(cov_matrix)
-        mahalanobis_distances = []
-        for t in range(len(returns)):
-            r_t = returns.iloc[t].values.reshape(-1, 1)
-            distance = np.sqrt(r_t.T @ precision_matrix @ r_t).item()
-            mahalanobis_distances.append(distance)
-        mahalanobis_distances = np.array(mahalanobis_distances)
+        mahalanobis_distances = calculate_mahalanobis_distances(returns, cov_matrix)
         malv = np.var(mahalanobis_distances**2)
         return malv, mahalanobis_distances
     except Exception as e:
         logging.error(f"Error in Mahalanobis calculation: {e}")
         return np.nan, []
 
+def calculate_rolling_malv(returns, cov_matrix, window=63, min_periods=None):
+    """
+    Rolling MALV (variance of squared Mahalanobis distances) over a trailing window.
+
+    Args:
+        returns (pd.DataFrame): Daily returns, columns in the same order as `cov_matrix`.
+        cov_matrix (array-like): Covariance whose precision matrix is being monitored.
+        window (int): Trailing window length in days.
+
+    Returns:
+        pd.Series: MALV per day, indexed like `returns`, on the same scale as
+                   `calculate_mahalanobis_metrics`.
+    """
+    try:
+        squared = pd.Series(calculate_mahalanobis_distances(returns, cov_matrix)**2, index=returns.index)
+        return squared.rolling(window, min_periods=min_periods or window).var(ddof=0).rename('MALV')
+    except Exception as e:
+        logging.error(f"Error in rolling MALV calculation: {e}")
+        return pd.Series(dtype=float, name='MALV')
+
 def calculate_idiosyncratic_variance(returns_df, factor_returns_df, betas):
     """
     Calculate idiosyncratic variance for each asset.
     """
     try:
-        idio_vars = {}
-        # Align returns and factors
-        common_index = returns_df.index.intersection(factor_returns_df.index)
-        returns_df_aligned = returns_df.loc[common_index]
-        factor_returns_df_aligned = factor_returns_df.loc[common_index]
-
-        for ticker in returns_df_aligned.columns:
-            X = factor_returns_df_aligned.values
-            y = returns_df_aligned[ticker].values
-
-            # Simple regression to find residuals
-            model = LinearRegression().fit(X, y)
-            residuals = y - model.predict(X)
-            idio_vars[ticker] = np.var(residuals) * 252  # Annualized
-
-        return pd.Series(idio_vars, name='IdioVariance').fillna(0)
+        # Residual variance of each name's regression on the factors (see `regress_on_factors`)
+        _, residual_var, _ = regress_on_factors(returns_df, factor_returns_df, min_obs=0)
+        return (residual_var * 252).fillna(0)  # Annualized
     except Exception as e:
         logging.error(f"Error in idiosyncratic variance calculation: {e}")
         return pd.Series(0.0, index=returns_df.columns, name='IdioVariance')
@@ -348,53 +1269,72 @@ def calculate_fmp_weights(returns_df, new_factor_returns, cov_matrix, existing_f
     Returns:
         pd.Series: A pandas Series of weights, with tickers as the index.
     """
-    try:
-        tickers = returns_df.columns
-        cov_matrix_psd = nearest_psd_matrix(cov_matrix)
-        precision_matrix = np.linalg.inv(cov_matrix_psd)
+    weights = calculate_multi_factor_fmp_weights(returns_df, pd.Series(new_factor_returns).to_frame('factor'), cov_matrix, existing_factors_returns)
+    return weights['factor'].rename(None)
 
-        # Align all data to a common time index
-        common_idx = returns_df.index.intersection(new_factor_returns.index)
-        if existing_factors_returns is not None:
-            common_idx = common_idx.intersection(existing_factors_returns.index)
-
-        aligned_returns = returns_df.loc[common_idx]
-        aligned_new_factor = new_factor_returns.loc[common_idx]
-
-        # Orthogonalize the new factor against existing factors
-        if existing_factors_returns is not None and not existing_factors_returns.empty:
-            aligned_existing_factors = existing_factors_returns.loc[common_idx]
-            model = LinearRegression().fit(aligned_existing_factors, aligned_new_factor)
-            ortho_factor_series = aligned_new_factor - pd.Series(model.predict(aligned_existing_factors), index=common_idx)
-        else:
-            ortho_factor_series = aligned_new_factor
-
-        # Estimate the betas of assets to the (orthogonalized) factor
-        betas = []
-        for ticker in aligned_returns.columns:
-            model = LinearRegression().fit(ortho_factor_series.values.reshape(-1, 1), aligned_returns[ticker].values)
-            betas.append(model.coef_[0])
-        B = np.array(betas).reshape(-1, 1)
+def calculate_multi_factor_fmp_weights(returns_df, factor_returns, cov_matrix, existing_factors_returns=None):
+    """
+    FMP weights for several factors at once: w_k = Omega^-1 b_k (b_k' Omega^-1 b_k)^-1, scaled to
+    unit gross exposure, where b_k are the assets' betas to factor k after orthogonalizing it
+    against `existing_factors_returns`.
 
-        # FMP formula: w = Omega^-1 * B * (B^T * Omega^-1 * B)^-1
-        Bt_Omega_B = B.T @ precision_matrix @ B
-        if Bt_Omega_B[0, 0] < 1e-9: # Avoid division by zero
-            return pd.Series(np.ones(len(tickers)) / len(tickers), index=tickers)
+    All factors are orthogonalized in one least-squares solve, all asset betas come from one
+    product over the returns matrix, and the covariance is Cholesky-factored once, so each extra
+    factor only adds a right-hand side.
 
-        weights = precision_matrix @ B @ np.linalg.inv(Bt_Omega_B)
-        weights = weights.flatten()
+    Args:
+        returns_df (pd.DataFrame): Asset returns (dates x tickers).
+        factor_returns (pd.DataFrame): One column per factor; each factor uses the dates it has.
+        cov_matrix (array-like): Asset covariance in `returns_df` column order.
+        existing_factors_returns (pd.DataFrame): Factors to orthogonalize against.
 
-        # Normalize weights
-        weights = weights / np.sum(np.abs(weights))
+    Returns:
+        pd.DataFrame: Weights, tickers x factors (equal weights for a factor without exposure).
+    """
+    tickers = returns_df.columns
+    equal = np.ones(len(tickers)) / len(tickers)
+    try:
+        cov_factor = cho_factor(nearest_psd_matrix(cov_matrix))
 
-        # --- FIX IS HERE ---
-        # Return a pandas Series with tickers as the index, not a raw NumPy array
-        return pd.Series(weights, index=tickers)
+        # Align all data to a common time index
+        common_idx = returns_df.index.intersection(factor_returns.index)
+        orthogonalize = existing_factors_returns is not None and not existing_factors_returns.empty
+        if orthogonalize:
+            common_idx = common_idx.intersection(existing_factors_returns.index)
+        factors = factor_returns.loc[common_idx]
+
+        # Factors observed on the same dates share one orthogonalization and beta pass
+        groups = {}
+        for name in factors.columns:
+            groups.setdefault(factors[name].notna().to_numpy().tobytes(), []).append(name)
+        B = pd.DataFrame(np.nan, index=tickers, columns=factors.columns)
+        for mask, names in groups.items():
+            rows = common_idx[np.frombuffer(mask, dtype=bool)]
+            F = factors.loc[rows, names].to_numpy(dtype=float)
+            raw_variance = F.var(axis=0)
+            if orthogonalize:
+                E = np.column_stack([np.ones(len(rows)), existing_factors_returns.loc[rows].to_numpy(dtype=float)])
+                F = F - E @ np.linalg.lstsq(E, F, rcond=None)[0]
+            # Univariate OLS slope of every asset on every factor: centered cross-products / factor variance
+            F = F - F.mean(axis=0)
+            F[:, F.var(axis=0) <= 1e-12 * raw_variance] = np.nan  # nothing left after orthogonalizing
+            R = returns_df.loc[rows].to_numpy(dtype=float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                B[names] = ((R - R.mean(axis=0)).T @ F) / (F ** 2).sum(axis=0)
+
+        # FMP formula via the Cholesky factor instead of explicit inverses
+        precision_B = cho_solve(cov_factor, B.to_numpy())
+        exposure = np.einsum('ij,ij->j', B.to_numpy(), precision_B)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weights = precision_B / exposure
+            weights = weights / np.abs(weights).sum(axis=0)
+        # Avoid division by zero: no usable exposure falls back to equal weights
+        weights[:, ~(exposure >= 1e-9)] = equal[:, None]
+        return pd.DataFrame(weights, index=tickers, columns=factor_returns.columns)
 
     except Exception as e:
         logging.error(f"Error in FMP calculation: {e}")
-        # Ensure the fallback also returns a pandas Series
-        return pd.Series(np.ones(len(returns_df.columns)) / len(returns_df.columns), index=returns_df.columns)
+        return pd.DataFrame({name: equal for name in factor_returns.columns}, index=tickers)
 
 def calculate_information_metrics(forecasted_alphas_ts, realized_returns_ts):
     """
@@ -422,8 +1362,10 @@ def calculate_information_metrics(forecasted_alphas_ts, realized_returns_ts):
         return np.nan, np.nan
 
 # --- All Individual Metric Calculation Functions ---
-def calculate_garch_volatility(returns, window=252, dist='t'):
+def calculate_garch_volatility(returns, window=252, dist='t', ticker=None):
     if returns.empty or len(returns) < window or returns.isna().all(): return np.nan
+    if ticker is not None:
+        return get_garch_estimator().estimate(ticker, returns, window=window)
     try:
         scaled_returns = returns.dropna() * 100
         if len(scaled_returns) < 5 or scaled_returns.std() < 1e-6: return np.nan
@@ -433,19 +1375,312 @@ def calculate_garch_volatility(returns, window=252, dist='t'):
         return cond_vol * np.sqrt(252)
     except Exception: return returns[-window:].std() * np.sqrt(252)
 
+# --- GARCH Volatility Subsystem ---
+# Fitted GARCH(1,1)-t parameters are cached per ticker (in the market-data store). The next
+# run either just filters the variance forward with them (few new bars) or warm-starts the
+# optimiser from them; a cold refit happens when the warm fit drifts too far.
+GARCH_FILTER_MAX_NEW_BARS = 5
+GARCH_DRIFT_THRESHOLD = 0.25
+
+# Process pools fork the interpreter. Forking the Streamlit server, which has live threads (Tornado,
+# the fetch pools, the aiohttp loop), can leave a child deadlocked on a lock held at fork time, so
+# pools are only used once a headless entry point (the CLI, benchmarks) calls `enable_process_pools`;
+# everywhere else the CPU-bound stages run in-process.
+_process_pools_enabled = False
+
+def enable_process_pools(enabled=True):
+    """Allows (or forbids) forked process pools; only call this from single-purpose headless processes."""
+    global _process_pools_enabled
+    _process_pools_enabled = bool(enabled)
+
+def process_pools_enabled():
+    return _process_pools_enabled and "fork" in multiprocessing.get_all_start_methods()
+
+def _process_pool(max_workers=None, initializer=None, initargs=()):
+    """Process pool for CPU-bound stages; fork keeps the module globals without re-importing the app."""
+    if not process_pools_enabled():
+        raise RuntimeError("process pools are only available in headless runs (see enable_process_pools)")
+    return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=multiprocessing.get_context("fork"), initializer=initializer, initargs=initargs)
+
+def _parameter_drift(new_params, old_params):
+    """Largest relative change in the variance equation (omega, alpha, beta); mu and nu barely move the vol path."""
+    new_params, old_params = np.asarray(new_params, dtype=float)[1:4], np.asarray(old_params, dtype=float)[1:4]
+    return float(np.max(np.abs(new_params - old_params) / np.maximum(np.abs(old_params), 0.05)))
+
+def _fit_garch(returns_values, dist='t', cached_params=None, new_bars=None, filter_max_new_bars=GARCH_FILTER_MAX_NEW_BARS, drift_threshold=GARCH_DRIFT_THRESHOLD):
+    """
+    Fits (or filters) a GARCH(1,1) on returns already scaled by 100.
+
+    Returns:
+        tuple: (annualized conditional vol, parameter list, mode, seconds), where mode is
+               one of 'filtered', 'warm', 'drift_refit' or 'cold'.
+    """
+    start = time.perf_counter()
+    model = arch_model(returns_values, vol='Garch', p=1, q=1, dist=dist)
+    if cached_params is not None and new_bars is not None and 0 <= new_bars <= filter_max_new_bars:
+        res, mode = model.fix(cached_params), 'filtered'
+    elif cached_params is not None:
+        res, mode = model.fit(disp='off', starting_values=np.asarray(cached_params), options={'maxiter': 500}), 'warm'
+        if _parameter_drift(res.params.values, cached_params) > drift_threshold:
+            res, mode = model.fit(disp='off', options={'maxiter': 500}), 'drift_refit'
+    else:
+        res, mode = model.fit(disp='off', options={'maxiter': 500}), 'cold'
+    cond_vol = np.asarray(res.conditional_volatility)[-1] / 100
+    return cond_vol * np.sqrt(252), [float(v) for v in res.params.values], mode, time.perf_counter() - start
+
+def _garch_task(task):
+    ticker, returns_values, dist, cached_params, new_bars = task
+    try:
+        return ticker, _fit_garch(returns_values, dist, cached_params, new_bars), None
+    except Exception as e:
+        return ticker, None, str(e)
+
+class GarchEstimator:
+    """
+    Cached, warm-started GARCH(1,1) volatility estimates for many tickers.
+
+    `estimate` handles one series in-process; `estimate_many` fans the fits out across a
+    process pool, since they are CPU-bound and serialize on the GIL in a thread pool.
+    `report()` summarises fit modes and the time saved against cold fits.
+    """
+    def __init__(self, store=None, dist='t', filter_max_new_bars=GARCH_FILTER_MAX_NEW_BARS, drift_threshold=GARCH_DRIFT_THRESHOLD):
+        self.store = store or get_market_data_store()
+        self.dist = dist
+        self.filter_max_new_bars = filter_max_new_bars
+        self.drift_threshold = drift_threshold
+        self._lock = threading.Lock()
+        self.stats = {"cold": 0, "warm": 0, "filtered": 0, "drift_refit": 0, "failed": 0, "fit_seconds": 0.0, "seconds_saved": 0.0}
+
+    def _prepare(self, ticker, returns):
+        scaled = returns.dropna() * 100
+        cached = self.store.read("garch_params", ticker)
+        cached_params, new_bars = None, None
+        if cached and cached.get("dist") == self.dist and len(cached.get("params", [])) == 5:
+            cached_params = cached["params"]
+            # New bars are counted from the last real optimisation, not the last filter pass
+            fit_date = pd.Timestamp(cached["fit_date"]) if cached.get("fit_date") else None
+            if fit_date is not None and fit_date in scaled.index:
+                new_bars = int((scaled.index > fit_date).sum())
+        return scaled, cached_params, new_bars, cached
+
+    def _record(self, ticker, scaled, result, cached):
+        vol, params, mode, seconds = result
+        cached = cached or {}
+        if mode in ('cold', 'drift_refit'):
+            cold_seconds = seconds
+        else:
+            cold_seconds = cached.get("cold_fit_seconds")
+        with self._lock:
+            self.stats[mode] += 1
+            self.stats["fit_seconds"] += seconds
+            if mode in ('filtered', 'warm') and cold_seconds:
+                self.stats["seconds_saved"] += max(cold_seconds - seconds, 0.0)
+        last_date = scaled.index[-1].isoformat() if isinstance(scaled.index, pd.DatetimeIndex) else None
+        self.store.write("garch_params", ticker, {
+            "dist": self.dist, "params": params,
+            "fit_date": cached.get("fit_date") if mode == 'filtered' else last_date,
+            "cold_fit_seconds": cold_seconds,
+        })
+        return vol
+
+    def _fallback(self, ticker, returns, window, error):
+        logging.warning(f"GARCH fit failed for {ticker}: {error}")
+        with self._lock: self.stats["failed"] += 1
+        return returns[-window:].std() * np.sqrt(252)
+
+    def estimate(self, ticker, returns, window=252):
+        if returns.empty or len(returns) < window or returns.isna().all(): return np.nan
+        scaled, cached_params, new_bars, cached = self._prepare(ticker, returns)
+        if len(scaled) < 5 or scaled.std() < 1e-6: return np.nan
+        _, result, error = _garch_task((ticker, scaled.values, self.dist, cached_params, new_bars))
+        if result is None: return self._fallback(ticker, returns, window, error)
+        return self._record(ticker, scaled, result, cached)
+
+    def plan(self, returns_by_ticker, window=252):
+        """
+        Splits series into those that get NaN outright and fit jobs.
+
+        Returns:
+            tuple: ({ticker: NaN} for skipped series, {ticker: (scaled returns, cached entry,
+                    cached params, new bars)} for series that need a fit or filter pass).
+        """
+        skipped, jobs = {}, {}
+        for ticker, returns in returns_by_ticker.items():
+            if returns is None or returns.empty or len(returns) < window or returns.isna().all():
+                skipped[ticker] = np.nan
+                continue
+            scaled, cached_params, new_bars, cached = self._prepare(ticker, returns)
+            if len(scaled) < 5 or scaled.std() < 1e-6:
+                skipped[ticker] = np.nan
+                continue
+            jobs[ticker] = (scaled, cached, cached_params, new_bars)
+        return skipped, jobs
+
+    def collect(self, ticker, job, result, error, returns, window=252):
+        if result is None: return self._fallback(ticker, returns, window, error)
+        return self._record(ticker, job[0], result, job[1])
+
+    def estimate_many(self, returns_by_ticker, window=252, max_workers=None, use_processes=True):
+        """Annualized GARCH vol for every series in `returns_by_ticker` (dict of pd.Series)."""
+        stage = run_ticker_compute_stage(returns_by_ticker, workers=max_workers, use_processes=use_processes, hurst=False, garch_estimator=self, garch_window=window)
+        return stage['GARCH_Vol'].to_dict()
+
+    def report(self):
+        return dict(self.stats)
+
+_garch_estimator = None
+_garch_estimator_lock = threading.Lock()
+
+def get_garch_estimator():
+    global _garch_estimator
+    with _garch_estimator_lock:
+        if _garch_estimator is None:
+            _garch_estimator = GarchEstimator()
+        return _garch_estimator
+
+# --- Process-Pool Compute Stage ---
+# The ticker pipeline is split into an I/O stage (threads: downloads, store reads and the
+# cheap fundamental ratios) and this CPU stage (GARCH fits and Hurst R/S), which runs in a
+# process pool in headless runs so it isn't serialized on the GIL (in-process under the app). Return series are handed to the workers
+# through one shared-memory block instead of pickling a Series per ticker.
+PIPELINE_WORKERS = int(os.environ.get("TRADFI_WORKERS", "0")) or os.cpu_count() or 1
+PIPELINE_USE_PROCESSES = os.environ.get("TRADFI_EXECUTOR", "process") == "process"
+_shared_returns = None
+
+def _attach_shared_returns(shm_name, shape):
+    global _shared_returns
+    block = shared_memory.SharedMemory(name=shm_name)
+    _shared_returns = (block, np.ndarray(shape, dtype=np.float64, buffer=block.buf))
+
+def _compute_stage_task(task):
+    """Worker body: Hurst and GARCH for a chunk of columns of the shared return matrix."""
+    column_jobs, run_hurst, dist = task
+    matrix = _shared_returns[1]
+    hurst_values = calculate_hurst_lo_modified_batch({col: matrix[:, col] for col, _ in column_jobs}) if run_hurst else {}
+    results = []
+    for col, garch_job in column_jobs:
+        values = matrix[:, col]
+        values = values[~np.isnan(values)]
+        hurst = hurst_values[col] if run_hurst else np.nan
+        garch = _garch_task((col, values * 100, dist, *garch_job))[1:] if garch_job is not None else None
+        results.append((col, hurst, garch))
+    return results
+
+def run_ticker_compute_stage(returns_by_ticker, workers=None, use_processes=None, hurst=True, garch=True, garch_estimator=None, garch_window=252):
+    """
+    Runs the CPU-bound per-ticker metrics (GARCH_Vol, Hurst_Exponent) for a universe.
+
+    Each ticker's log returns are bottom-aligned into one float64 matrix in shared memory;
+    workers attach to it once and receive only column indices plus cached GARCH parameters.
+
+    Returns:
+        pd.DataFrame: Indexed by ticker with 'GARCH_Vol' and 'Hurst_Exponent' columns.
+    """
+    workers = workers or PIPELINE_WORKERS
+    use_processes = PIPELINE_USE_PROCESSES if use_processes is None else use_processes
+    tickers_list = list(returns_by_ticker)
+    output = pd.DataFrame(np.nan, index=tickers_list, columns=['GARCH_Vol', 'Hurst_Exponent'])
+    if not tickers_list: return output
+
+    garch_jobs = {}
+    if garch:
+        garch_estimator = garch_estimator or get_garch_estimator()
+        skipped, garch_jobs = garch_estimator.plan(returns_by_ticker, window=garch_window)
+
+    lengths = [len(returns_by_ticker[t]) if returns_by_ticker[t] is not None else 0 for t in tickers_list]
+    shape = (max(max(lengths), 1), len(tickers_list))
+    block = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+    try:
+        matrix = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+        matrix[:] = np.nan
+        for col, (ticker, length) in enumerate(zip(tickers_list, lengths)):
+            if length: matrix[shape[0] - length:, col] = returns_by_ticker[ticker].to_numpy(dtype=np.float64)
+
+        column_jobs = []
+        for col, ticker in enumerate(tickers_list):
+            job = garch_jobs.get(ticker)
+            if hurst or job is not None:
+                column_jobs.append((col, (job[2], job[3]) if job is not None else None))
+        n_chunks = max(1, min(len(column_jobs), 4 * workers))
+        tasks = [(column_jobs[i::n_chunks], hurst, garch_estimator.dist if garch else 't') for i in range(n_chunks)]
+
+        chunk_results = None
+        if use_processes and workers > 1 and len(column_jobs) > 1 and process_pools_enabled():
+            try:
+                # Workers attach to the block once; tasks only carry column indices
+                with _process_pool(workers, initializer=_attach_shared_returns, initargs=(block.name, shape)) as executor:
+                    chunk_results = list(executor.map(_compute_stage_task, tasks))
+            except Exception as e:
+                logging.error(f"Compute-stage process pool failed, running in-process: {e}")
+        if chunk_results is None:
+            _attach_shared_returns(block.name, shape)
+            chunk_results = [_compute_stage_task(task) for task in tasks]
+    finally:
+        if _shared_returns is not None and _shared_returns[0].name == block.name:
+            _shared_returns[0].close()
+        block.close()
+        block.unlink()
+
+    for results in chunk_results:
+        for col, hurst_value, garch_result in results:
+            ticker = tickers_list[col]
+            output.at[ticker, 'Hurst_Exponent'] = hurst_value
+            if garch_result is not None:
+                result, error = garch_result
+                output.at[ticker, 'GARCH_Vol'] = garch_estimator.collect(ticker, garch_jobs[ticker], result, error, returns_by_ticker[ticker], garch_window)
+    return output
+
+def _synthetic_log_returns(n_tickers, n_days=756, seed=0):
+    """Reproducible GARCH-like daily log returns with a common market factor, for timing runs."""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=pd.Timestamp("2024-12-31"), periods=n_days)
+    market = rng.standard_t(5, n_days) * 0.008
+    returns = {}
+    for i in range(n_tickers):
+        vol = np.empty(n_days); shocks = rng.standard_t(5, n_days)
+        omega, alpha, beta = 2e-6, rng.uniform(0.03, 0.12), 0.85
+        var = 2e-4
+        for day in range(n_days):
+            vol[day] = np.sqrt(var)
+            var = omega + alpha * (vol[day] * shocks[day]) ** 2 + beta * var
+        returns[f"SYN{i:05d}"] = pd.Series(rng.uniform(0.5, 1.5) * market + vol * shocks * 0.6, index=index)
+    return returns
+
+def benchmark_compute_stage(n_tickers=1500, n_days=756, workers=None, store_root=None):
+    """
+    Times the CPU stage on a synthetic universe in-process versus in the process pool.
+    A throwaway store is used so every run measures cold GARCH fits.
+    """
+    import tempfile
+    returns_by_ticker = _synthetic_log_returns(n_tickers, n_days)
+    timings = {}
+    for label, use_processes in [("in_process", False), ("process_pool", True)]:
+        with tempfile.TemporaryDirectory(dir=store_root) as tmp_dir:
+            estimator = GarchEstimator(store=MarketDataStore(root=tmp_dir))
+            start = time.perf_counter()
+            run_ticker_compute_stage(returns_by_ticker, workers=workers, use_processes=use_processes, garch_estimator=estimator)
+            timings[label] = time.perf_counter() - start
+    timings["speedup"] = timings["in_process"] / timings["process_pool"] if timings["process_pool"] else np.nan
+    timings["workers"] = workers or PIPELINE_WORKERS
+    return timings
+
+def calculate_period_returns(close, periods):
+    if close.empty or len(close) < max(p for p in periods if p is not None): return {f"Return_{p}d": np.nan for p in periods}
+    returns = {}
+    for period in periods:
+        if len(close) > period:
+            returns[f"Return_{period}d"] = (close.iloc[-1] / close.iloc[-(period+1)] - 1) * 100
+        else:
+            returns[f"Return_{period}d"] = np.nan
+    return returns
+
 @lru_cache(maxsize=1024)
 def calculate_returns_cached(ticker, periods_tuple):
     periods = list(periods_tuple)
     try:
-        history = yf.Ticker(ticker).history(period="2y", auto_adjust=True)
-        if history.empty or len(history) < max(p for p in periods if p is not None): return {f"Return_{p}d": np.nan for p in periods}
-        returns = {}
-        for period in periods:
-            if len(history) > period:
-                returns[f"Return_{period}d"] = (history['Close'].iloc[-1] / history['Close'].iloc[-(period+1)] - 1) * 100
-            else:
-                returns[f"Return_{period}d"] = np.nan
-        return returns
+        # Served from the shared 3y store entry; only the trailing bars are used below
+        history = load_price_history(ticker)
+        return calculate_period_returns(history['Close'] if not history.empty else pd.Series(dtype=float), periods)
     except Exception: return {f"Return_{p}d": np.nan for p in periods}
 
 def calculate_log_log_utility(returns):
@@ -457,10 +1692,185 @@ def calculate_log_log_utility(returns):
         log_log_utility = np.mean(np.log1p(log_returns))
         return log_log_utility if np.isfinite(log_log_utility) else np.nan
     except Exception: return np.nan
+
+# --- Pure-Return History Store ---
+# Every screen's pure factor returns are kept, one Arrow IPC file per (horizon, run date), under
+# <horizon>/<YYYY-MM>/<YYYY-MM-DD>.arrow, with a SQLite index of the runs. Appending a run writes one
+# small file and one index row whatever the history length; reading the last N runs touches only
+# those N files, which are memory-mapped. This is the history `analyze_coefficient_stability` needs.
+# Each run is tagged with its cadence: backfilled month-ends and live runs on a month's last business
+# day are "monthly", other live runs "daily". Stability reads one monthly run per month, so daily
+# screens never crowd the month-end runs out of the window. Runs also record how many tickers the
+# regression saw: a live run that lost too much of the universe to fetch failures is not recorded,
+# and a later, more complete run on the same date replaces the stored one.
+PURE_RETURN_HISTORY_DIR = os.environ.get("TRADFI_PURE_RETURN_DIR", "pure_return_history")
+PURE_RETURN_HISTORY_RUNS = int(os.environ.get("TRADFI_PURE_RETURN_RUNS", "12"))
+PURE_RETURN_CADENCE = "monthly"  # cadence the stability history is read at
+# Share of the universe a live run must have processed for its pure returns to be recorded
+PURE_RETURN_MIN_COVERAGE = float(os.environ.get("TRADFI_PURE_RETURN_MIN_COVERAGE", "0.9"))
+# Fewer stored runs than this and stability falls back to `simulate_historical_pure_returns`
+PURE_RETURN_MIN_HISTORY = 3
+
+def run_cadence(run_date):
+    """Cadence tag of a run dated `run_date`: monthly on the last business day of its month, else daily."""
+    return "monthly" if pd.offsets.BMonthEnd().is_on_offset(pd.Timestamp(run_date)) else "daily"
+
+class PureReturnHistory:
+    """
+    Store of pure factor return coefficients per horizon and run date.
+
+    `append` records a run (one per day; a later run only replaces it when it covered more
+    tickers) and `load` returns the latest runs of a cadence before a date as one factors x run-dates matrix.
+    """
+    def __init__(self, root=PURE_RETURN_HISTORY_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs (horizon TEXT NOT NULL, run_date TEXT NOT NULL, path TEXT NOT NULL, "
+                "n_factors INTEGER, written_at REAL NOT NULL, cadence TEXT NOT NULL DEFAULT 'daily', n_tickers INTEGER, "
+                "PRIMARY KEY (horizon, run_date))"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(runs)")]
+            if "cadence" not in columns:
+                # Stores written before runs were tagged: month-end dates are taken as monthly runs
+                conn.execute("ALTER TABLE runs ADD COLUMN cadence TEXT NOT NULL DEFAULT 'daily'")
+                month_ends = [(d,) for (d,) in conn.execute("SELECT DISTINCT run_date FROM runs") if run_cadence(d) == "monthly"]
+                conn.executemany("UPDATE runs SET cadence = 'monthly' WHERE run_date = ?", month_ends)
+            if "n_tickers" not in columns:
+                # Unknown for older runs; any run with a known count replaces them
+                conn.execute("ALTER TABLE runs ADD COLUMN n_tickers INTEGER")
+
+    def _connect(self):
+        return sqlite_transaction(os.path.join(self.root, "index.sqlite"))
+
+    def _path(self, horizon, run_date):
+        return os.path.join(horizon, run_date[:7], f"{run_date}.arrow")
+
+    def append(self, horizon, pure_returns, run_date=None, cadence=None, n_tickers=None):
+        """
+        Stores one run's coefficients (a Series indexed by characteristic) for `horizon`, fitted on
+        `n_tickers` names. `cadence` defaults to `run_cadence(run_date)`. When `run_date` already
+        holds a run, the new one replaces it only if it covered more tickers; a monthly run that
+        doesn't still promotes the stored run to monthly.
+
+        Returns:
+            bool: False when the series is empty or the stored run on `run_date` was kept as is.
+        """
+        run_date = pd.Timestamp(run_date or datetime.now()).strftime("%Y-%m-%d")
+        cadence = cadence or run_cadence(run_date)
+        pure_returns = pure_returns.dropna() if pure_returns is not None else pd.Series(dtype=float)
+        if pure_returns.empty: return False
+        relative_path = self._path(horizon, run_date)
+        path = os.path.join(self.root, relative_path)
+        with self._lock:
+            with self._connect() as conn:
+                existing = conn.execute("SELECT cadence, n_tickers FROM runs WHERE horizon = ? AND run_date = ?", (horizon, run_date)).fetchone()
+                if existing:
+                    stored_cadence, stored_tickers = existing
+                    cadence = "monthly" if "monthly" in (cadence, stored_cadence) else "daily"
+                    if (n_tickers or 0) <= (stored_tickers or 0):
+                        if cadence == stored_cadence: return False
+                        conn.execute("UPDATE runs SET cadence = ? WHERE horizon = ? AND run_date = ?", (cadence, horizon, run_date))
+                        return True
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            table = pa.table({"factor": pa.array([str(f) for f in pure_returns.index], pa.string()),
+                              "coefficient": pa.array(pure_returns.to_numpy(dtype=float), pa.float64())})
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp_path, path)
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO runs (horizon, run_date, path, n_factors, written_at, cadence, n_tickers) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (horizon, run_date, relative_path, len(pure_returns), time.time(), cadence, n_tickers))
+        return True
+
+    def run_dates(self, horizon, cadence=None):
+        """Stored run dates for `horizon` (only those of `cadence` when given), oldest first."""
+        query, params = "SELECT run_date FROM runs WHERE horizon = ?", [horizon]
+        if cadence is not None:
+            query += " AND cadence = ?"
+            params.append(cadence)
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute(query + " ORDER BY run_date", params)]
+
+    def _read(self, relative_path):
+        with pa.memory_map(os.path.join(self.root, relative_path), "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+            return pd.Series(table.column("coefficient").to_numpy().copy(), index=table.column("factor").to_pylist())
+
+    def load(self, horizon, n_runs=PURE_RETURN_HISTORY_RUNS, before=None, cadence=PURE_RETURN_CADENCE):
+        """
+        The latest `n_runs` runs of `horizon` dated strictly before `before` (default: all), of
+        `cadence` only (None: every run). Monthly reads keep the latest run of each month.
+
+        Returns:
+            pd.DataFrame: factors x run dates (oldest first), NaN where a run lacks a factor.
+        """
+        query, params = "SELECT run_date, path FROM runs WHERE horizon = ?", [horizon]
+        if cadence is not None:
+            query += " AND cadence = ?"
+            params.append(cadence)
+        if before is not None:
+            query += " AND run_date < ?"
+            params.append(pd.Timestamp(before).strftime("%Y-%m-%d"))
+        with self._connect() as conn:
+            rows = conn.execute(query + " ORDER BY run_date DESC", params).fetchall()
+        if cadence == "monthly":
+            rows = list({run_date[:7]: (run_date, path) for run_date, path in reversed(rows)}.values())[::-1]
+        rows = rows[:n_runs]
+        runs = {}
+        for run_date, relative_path in reversed(rows):
+            try:
+                runs[run_date] = self._read(relative_path)
+            except Exception as e:
+                logging.error(f"Corrupt pure-return run {horizon}/{run_date}: {e}")
+        if not runs: return pd.DataFrame(dtype=float)
+        return pd.DataFrame(runs)
+
+_pure_return_history = None
+_pure_return_history_lock = threading.Lock()
+
+def get_pure_return_history():
+    """The history store for the active data provider (fixture runs never mix with live history)."""
+    global _pure_return_history
+    with _pure_return_history_lock:
+        if _pure_return_history is None:
+            namespace = get_data_provider().store_namespace
+            _pure_return_history = PureReturnHistory(root=os.path.join(PURE_RETURN_HISTORY_DIR, namespace) if namespace else PURE_RETURN_HISTORY_DIR)
+        return _pure_return_history
+
+def load_pure_return_history(time_horizons, before=None, store=None, n_runs=PURE_RETURN_HISTORY_RUNS):
+    """{horizon label: factors x run-dates matrix} of the stored runs before `before` (default: today)."""
+    store = store or get_pure_return_history()
+    before = before or datetime.now()
+    return {label: store.load(label, n_runs=n_runs, before=before) for label in time_horizons}
+
+def record_pure_returns(pure_returns, time_horizons, run_date=None, store=None, cadence=None, n_tickers=None, n_failed=0):
+    """
+    Appends each horizon's column of `pure_returns` (characteristics x target columns) to the
+    history store, tagged with `cadence` (default: `run_cadence(run_date)`). A run fitted on
+    `n_tickers` names while `n_failed` others failed is skipped when it covered less than
+    PURE_RETURN_MIN_COVERAGE of the universe.
+    """
+    if n_tickers is not None and n_failed and n_tickers / (n_tickers + n_failed) < PURE_RETURN_MIN_COVERAGE:
+        logging.warning(f"Pure returns not recorded: {n_failed} of {n_tickers + n_failed} tickers failed "
+                        f"(below the {PURE_RETURN_MIN_COVERAGE:.0%} coverage floor).")
+        return []
+    store = store or get_pure_return_history()
+    recorded = []
+    for label, target_column in time_horizons.items():
+        if pure_returns is not None and target_column in pure_returns.columns and store.append(label, pure_returns[target_column], run_date, cadence, n_tickers):
+            recorded.append(label)
+    return recorded
+
 def simulate_historical_pure_returns(pure_returns_today):
     """
     SIMULATES a history of past Pure Factor Return tables.
-    In a real system, you would load this from a database or CSV.
+    Only a fallback now: real runs come from the `PureReturnHistory` store once it holds
+    PURE_RETURN_MIN_HISTORY runs for the horizon.
     """
     if pure_returns_today is None:
         return []
@@ -642,7 +2052,7 @@ def calculate_volatility_adjusted_z_score(prices, period=252, ticker="Unknown",
 
     return robust_z
 
-def recalculate_relative_z_scores(top_15_df, etf_histories, period="3y", window=252, min_window=200):
+def recalculate_relative_z_scores(top_15_df, etf_histories, period="3y", window=252, min_window=200, price_panel=None):
     """
     Recalculates relative Z-scores for a list of stocks against their benchmark ETFs.
 
@@ -658,6 +2068,7 @@ def recalculate_relative_z_scores(top_15_df, etf_histories, period="3y", window=
         period (str): The historical data period to fetch (e.g., "3y").
         window (int): The maximum number of days for the relative calculation.
         min_window (int): The minimum number of overlapping days required.
+        price_panel (PricePanel, optional): Shared price panel to slice histories from.
 
     Returns:
         list: A list of calculated relative Z-scores, with np.nan for any failures.
@@ -670,8 +2081,8 @@ def recalculate_relative_z_scores(top_15_df, etf_histories, period="3y", window=
         try:
             logging.info(f"Recalculating Z-Score for {ticker}, Best_Factor: {best_factor}")
 
-            # Fetch stock history and get pre-fetched ETF history
-            history = yf.Ticker(ticker).history(period=period, auto_adjust=True, interval="1d").tz_localize(None)
+            # Slice stock history from the shared panel and get pre-fetched ETF history
+            history = get_price_history(ticker, period, price_panel)
             etf_history = etf_histories.get(best_factor)
 
             if not history.empty and etf_history is not None and not etf_history.empty:
@@ -746,53 +2157,424 @@ def calculate_lo_modified_variance(sub_series, q):
     modified_var = sample_var + 2.0 * autocovariance_sum
     return max(0.0, modified_var)
 
-def calculate_hurst_lo_modified(series, min_n=10, max_n=None, q_method='auto'):
-    if isinstance(series, pd.Series): series = series.values
-    series = series[~np.isnan(series)]
-    N = len(series)
+def _hurst_window_sizes(N, min_n=10, max_n=None):
     if max_n is None: max_n = N // 2
     max_n = min(max_n, N - 1)
     min_n = max(2, min_n)
-    if N < 20 or min_n >= max_n: return np.nan, pd.DataFrame()
+    if N < 20 or min_n >= max_n: return []
     ns = np.unique(np.geomspace(min_n, max_n, num=20, dtype=int))
-    ns = [n_val for n_val in ns if n_val >= min_n]
-    if not ns: return np.nan, pd.DataFrame()
-    rs_values, valid_ns = [], []
-    for n in ns:
+    return [int(n_val) for n_val in ns if n_val >= min_n]
+
+def _lo_modified_rs_means(series_matrix, ns, q_method='auto'):
+    """
+    Mean Lo-modified R/S per window size for equal-length series, all chunks at once.
+
+    Each window size reshapes the (tickers x N) matrix into (tickers x num_chunks x n); ranges of
+    the cumulative deviations and Bartlett-weighted autocovariances are computed along the last axis.
+    Chunks that are flat or have a non-positive modified variance are dropped, as in the scalar
+    `calculate_lo_modified_variance` path.
+
+    Returns:
+        np.ndarray: (tickers x len(ns)) mean R/S, NaN where a window had no usable chunk.
+    """
+    n_series, N = series_matrix.shape
+    rs_means = np.full((n_series, len(ns)), np.nan)
+    for k, n in enumerate(ns):
         q = 0
         if isinstance(q_method, int): q = max(0, min(q_method, n - 1))
         elif q_method == 'auto' and n > 10: q = max(0, min(int(np.floor(1.1447 * (n**(1/3)))), n - 1))
-        rs_chunk = []
         num_chunks = N // n
         if num_chunks == 0: continue
-        for i in range(num_chunks):
-            chunk = series[i*n : (i+1)*n]
-            mean = np.mean(chunk)
-            if np.allclose(chunk, mean, rtol=1e-8, atol=1e-10): continue
-            mean_adjusted = chunk - mean
-            cum_dev = np.cumsum(mean_adjusted)
-            R = np.ptp(cum_dev)
-            if pd.isna(R) or R < 0: continue
-            modified_var = calculate_lo_modified_variance(chunk, q)
-            if pd.isna(modified_var) or modified_var < 1e-12: continue
-            S_q = np.sqrt(modified_var)
-            rs = R / S_q
-            if not pd.isna(rs) and rs >= 0: rs_chunk.append(rs)
-        if rs_chunk:
-            rs_values.append(np.mean(rs_chunk))
-            valid_ns.append(n)
-    if len(valid_ns) < 3: return np.nan, pd.DataFrame()
-    results_df = pd.DataFrame({'interval': valid_ns, 'rs_mean': rs_values}).dropna()
+        chunks = series_matrix[:, :num_chunks * n].reshape(n_series, num_chunks, n)
+        means = chunks.mean(axis=2, keepdims=True)
+        mean_adjusted = chunks - means
+        flat = np.all(np.abs(mean_adjusted) <= 1e-8 + 1e-5 * np.abs(means), axis=2)
+        cum_dev = np.cumsum(mean_adjusted, axis=2)
+        R = cum_dev.max(axis=2) - cum_dev.min(axis=2)
+        modified_var = np.einsum('scm,scm->sc', mean_adjusted, mean_adjusted) / n
+        if 0 < q < n:
+            for j in range(1, q + 1):
+                autocovariance = np.einsum('scm,scm->sc', mean_adjusted[:, :, :-j], mean_adjusted[:, :, j:]) / n
+                modified_var += 2.0 * (1.0 - j / (q + 1.0)) * autocovariance
+        modified_var = np.maximum(modified_var, 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rs = R / np.sqrt(modified_var)
+        valid = ~flat & (modified_var >= 1e-12) & np.isfinite(rs) & (rs >= 0)
+        counts = valid.sum(axis=1)
+        with np.errstate(invalid='ignore'):
+            rs_means[:, k] = np.where(counts > 0, np.where(valid, rs, 0.0).sum(axis=1) / counts, np.nan)
+    return rs_means
+
+def calculate_hurst_lo_modified_batch(series_by_ticker, min_n=10, max_n=None, q_method='auto'):
+    """
+    Lo-modified Hurst exponent for many series in one call.
+
+    Series are grouped by their NaN-free length so each group shares one set of window sizes
+    and is processed as a single matrix.
+
+    Args:
+        series_by_ticker (dict): {ticker: pd.Series or np.ndarray of returns}.
+
+    Returns:
+        pd.Series: Hurst exponent per ticker (NaN where fewer than three window sizes are usable).
+    """
+    groups = {}
+    for ticker, series in series_by_ticker.items():
+        values = np.asarray(series, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        groups.setdefault(len(values), []).append((ticker, values))
+    hurst = pd.Series(np.nan, index=list(series_by_ticker), dtype=float)
+    for N, members in groups.items():
+        ns = _hurst_window_sizes(N, min_n, max_n)
+        if not ns: continue
+        rs_means = _lo_modified_rs_means(np.vstack([values for _, values in members]), ns, q_method)
+        # Row-wise OLS slope of log(R/S) on log(n) over the usable window sizes
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_rs = np.log(rs_means)
+        valid = np.isfinite(log_rs)
+        log_n = np.broadcast_to(np.log(np.asarray(ns, dtype=float)), log_rs.shape)
+        counts = valid.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x_mean = np.where(valid, log_n, 0.0).sum(axis=1) / counts
+            y_mean = np.where(valid, log_rs, 0.0).sum(axis=1) / counts
+            dx = np.where(valid, log_n - x_mean[:, None], 0.0)
+            dy = np.where(valid, log_rs - y_mean[:, None], 0.0)
+            slopes = (dx * dy).sum(axis=1) / (dx * dx).sum(axis=1)
+        slopes[counts < 3] = np.nan
+        hurst.loc[[ticker for ticker, _ in members]] = slopes
+    return hurst
+
+def calculate_hurst_lo_modified(series, min_n=10, max_n=None, q_method='auto'):
+    if isinstance(series, pd.Series): series = series.values
+    series = series[~np.isnan(series)]
+    N = len(series)
+    ns = _hurst_window_sizes(N, min_n, max_n)
+    if not ns: return np.nan, pd.DataFrame()
+    rs_means = _lo_modified_rs_means(series[np.newaxis, :].astype(np.float64), ns, q_method)[0]
+    results_df = pd.DataFrame({'interval': ns, 'rs_mean': rs_means}).dropna()
     if len(results_df) < 3: return np.nan, pd.DataFrame()
     try:
         hurst, _, _, _, _ = linregress(np.log(results_df['interval']), np.log(results_df['rs_mean']))
-        return hurst, results_df
+        return hurst, results_df.reset_index(drop=True)
     except Exception: return np.nan, pd.DataFrame()
 
+def benchmark_hurst(n_tickers=200, n_days=756, seed=0):
+    """Per-ticker time of the vectorized Hurst (single and batch calls) against the chunk-loop version."""
+    rng = np.random.default_rng(seed)
+    series = {f"SYN{i:05d}": rng.standard_t(5, n_days) * 0.01 for i in range(n_tickers)}
+
+    def chunk_loop_hurst(values, min_n=10):
+        ns = _hurst_window_sizes(len(values), min_n)
+        rs_values, valid_ns = [], []
+        for n in ns:
+            q = max(0, min(int(np.floor(1.1447 * (n**(1/3)))), n - 1)) if n > 10 else 0
+            rs_chunk = []
+            for i in range(len(values) // n):
+                chunk = values[i*n : (i+1)*n]
+                mean = np.mean(chunk)
+                if np.allclose(chunk, mean, rtol=1e-8, atol=1e-10): continue
+                R = np.ptp(np.cumsum(chunk - mean))
+                modified_var = calculate_lo_modified_variance(chunk, q)
+                if pd.isna(modified_var) or modified_var < 1e-12: continue
+                rs_chunk.append(R / np.sqrt(modified_var))
+            if rs_chunk:
+                rs_values.append(np.mean(rs_chunk)); valid_ns.append(n)
+        return linregress(np.log(valid_ns), np.log(rs_values))[0] if len(valid_ns) >= 3 else np.nan
+
+    timings = {}
+    start = time.perf_counter()
+    loop_values = {t: chunk_loop_hurst(v) for t, v in series.items()}
+    timings["chunk_loop_ms_per_ticker"] = (time.perf_counter() - start) * 1000 / n_tickers
+    start = time.perf_counter()
+    for v in series.values(): calculate_hurst_lo_modified(v)
+    timings["vectorized_ms_per_ticker"] = (time.perf_counter() - start) * 1000 / n_tickers
+    start = time.perf_counter()
+    batch_values = calculate_hurst_lo_modified_batch(series)
+    timings["batch_ms_per_ticker"] = (time.perf_counter() - start) * 1000 / n_tickers
+    timings["max_abs_diff"] = float(np.nanmax(np.abs(batch_values - pd.Series(loop_values))))
+    return timings
+
+# --- Vectorized Cross-Sectional Metric Engine ---
+# Columns filled by `calculate_time_series_metrics_batch` instead of per-ticker calls.
+BATCH_TIME_SERIES_COLUMNS = ["AR_Coeff", "Log_Log_Utility", "Log_Log_Sharpe", "Vol_Autocorr", "Stop_Loss_Impact", "Trend", "Dollar_Volume_90D", "Momentum"]
+
+def _bottom_align(values, mask=None):
+    """
+    Moves every column's valid entries to the bottom of the array, keeping their order.
+    Afterwards `values[-k:]` is each column's own last k observations, exactly as if the
+    column had been `dropna()`-ed on its own; shorter columns are NaN-padded on top.
+    """
+    if mask is None: mask = ~np.isnan(values)
+    order = np.argsort(mask, axis=0, kind='stable')
+    return np.take_along_axis(values, order, axis=0), order
+
+def _masked_pair_stats(x, y):
+    """Column-wise count, centred sums of squares and cross-products over rows where both x and y are valid."""
+    valid = ~(np.isnan(x) | np.isnan(y))
+    n = valid.sum(axis=0)
+    x0, y0 = np.where(valid, x, 0.0), np.where(valid, y, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mx, my = x0.sum(axis=0) / n, y0.sum(axis=0) / n
+        dx, dy = np.where(valid, x0 - mx, 0.0), np.where(valid, y0 - my, 0.0)
+    return n, (dx * dx).sum(axis=0), (dy * dy).sum(axis=0), (dx * dy).sum(axis=0)
+
+def calculate_time_series_metrics_batch(closes, volumes, window=252, stop_loss_level=-0.04, risk_free_rate=0.04):
+    """
+    Computes the per-ticker time-series metrics for a whole universe at once.
+
+    Column-wise NumPy equivalent of `calculate_ar_coefficient`, `calculate_log_log_sharpe`,
+    `calculate_volatility_autocorrelation`, `calculate_stop_loss_impact`,
+    `calculate_log_log_utility`, `breakout`, the 90-day dollar volume and 252-day momentum,
+    matching the scalar functions to floating-point tolerance.
+
+    Args:
+        closes (pd.DataFrame): Dates x tickers close prices (NaN where a ticker didn't trade).
+        volumes (pd.DataFrame): Dates x tickers volumes aligned with `closes`.
+
+    Returns:
+        pd.DataFrame: One row per ticker, with the metric columns in `columns` order.
+    """
+    tickers_idx = closes.columns
+    close_values = closes.to_numpy(dtype=np.float64)
+    close_mask = ~np.isnan(close_values)
+    close_c, order = _bottom_align(close_values, close_mask)
+    volume_c = np.take_along_axis(volumes.reindex(index=closes.index, columns=tickers_idx).to_numpy(dtype=np.float64), order, axis=0)
+    n_close = close_mask.sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log_ret = np.log(close_c[1:] / close_c[:-1])
+    n_ret = (~np.isnan(log_ret)).sum(axis=0)
+    out = {}
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Stop-loss impact and log-log utility use each ticker's full return history
+        below = np.where(np.isnan(log_ret), np.nan, (log_ret < stop_loss_level).astype(float))
+        out['Stop_Loss_Impact'] = np.where(n_ret > 0, np.nansum(below, axis=0) / n_ret, np.nan)
+        positive = np.where(log_ret > 0, log_ret, np.nan)
+        n_pos = (~np.isnan(positive)).sum(axis=0)
+        out['Log_Log_Utility'] = np.where(n_pos > 0, np.nansum(np.log1p(np.log1p(positive)), axis=0) / n_pos, np.nan)
+
+        recent = log_ret[-window:]
+
+        # AR(1) coefficient via the linregress formulas, kept only when p < 0.1
+        n_pairs, sxx, syy, sxy = _masked_pair_stats(recent[:-1], recent[1:])
+        slope = sxy / sxx
+        r = np.clip(sxy / np.sqrt(sxx * syy), -1.0, 1.0)
+        r = np.where((sxx == 0) | (syy == 0), 0.0, r)
+        dof = n_pairs - 2
+        t_stat = r * np.sqrt(dof / ((1.0 - r + 1e-20) * (1.0 + r + 1e-20)))
+        p_value = 2 * stdtr(dof, -np.abs(t_stat))
+        ar = np.where((p_value < 0.1) & np.isfinite(slope), slope, 0.0)
+        effective_window = np.minimum(window, n_ret)
+        out['AR_Coeff'] = np.where(effective_window < 20, np.nan, np.where(sxx == 0, 0.0, ar))
+
+        full_window = n_ret >= window
+        # Log-log Sharpe over the positive log1p-transformed returns of the last window
+        log_window = np.log1p(recent)
+        log_log = np.where(log_window > 0, np.log1p(np.where(log_window > 0, log_window, 0.0)), np.nan)
+        n_ll = (~np.isnan(log_log)).sum(axis=0)
+        ll_mean = np.nansum(log_log, axis=0) / n_ll
+        ll_std = np.sqrt(np.nansum((log_log - ll_mean) ** 2, axis=0) / (n_ll - 1))
+        ll_sharpe = (ll_mean * 252 - risk_free_rate / 252) / (ll_std * np.sqrt(252))
+        ll_sharpe = np.where((n_ll < 2) | (ll_std == 0), np.nan, ll_sharpe)
+        out['Log_Log_Sharpe'] = np.where(full_window, ll_sharpe, np.nan)
+
+        # Lag-1 autocorrelation of squared returns
+        squared = recent ** 2
+        _, sxx_sq, syy_sq, sxy_sq = _masked_pair_stats(squared[1:], squared[:-1])
+        out['Vol_Autocorr'] = np.where(full_window, sxy_sq / np.sqrt(sxx_sq * syy_sq), np.nan)
+
+    close_df = pd.DataFrame(close_c, columns=tickers_idx)
+    roll_max = close_df.rolling(20, min_periods=10).max()
+    roll_min = close_df.rolling(20, min_periods=10).min()
+    trend = 40.0 * ((close_df - (roll_max + roll_min) / 2.0) / (roll_max - roll_min))
+    trend = (trend.ewm(span=5, min_periods=2).mean() + 40.0) / 80.0
+    out['Trend'] = np.where(n_close >= 20, trend.iloc[-1].to_numpy(), np.nan)
+
+    dollar_volume = pd.DataFrame(volume_c * close_c, columns=tickers_idx).rolling(90).mean()
+    out['Dollar_Volume_90D'] = dollar_volume.iloc[-1].to_numpy() if len(dollar_volume) else np.full(len(tickers_idx), np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        momentum = (close_c[-1] / close_c[-window] - 1) * 100 if len(close_c) >= window else np.full(len(tickers_idx), np.nan)
+    out['Momentum'] = np.where(n_close > window, momentum, np.nan)
+
+    metrics = pd.DataFrame(out, index=tickers_idx)
+    return metrics[[c for c in columns if c in metrics.columns]]
+
+BATCH_FACTOR_COLUMNS = ["Beta_to_SPY", "Best_Factor", "Correlation_Score", "Relative_Z_Score"]
+
+def _etf_log_returns(etf_histories):
+    """Each ETF's own daily log returns as one wide frame, in `etf_histories` order."""
+    etf_returns = {
+        etf: np.log(history['Close'] / history['Close'].shift(1)).dropna()
+        for etf, history in etf_histories.items() if history is not None and not history.empty
+    }
+    return pd.DataFrame(etf_returns, dtype=np.float64)
+
+def calculate_etf_correlations_batch(returns, etf_returns):
+    """
+    Pairwise-complete Pearson correlations between every ticker and every ETF.
+
+    Each (ticker, ETF) pair uses only the dates where both have a return, exactly like
+    `Series.corr` on an index intersection, but the masked sums for the whole tickers x
+    ETFs block come from a handful of matrix multiplications.
+
+    Returns:
+        tuple: (correlations, overlap counts, SPY-style regression slopes of each ticker on
+                each ETF), all as tickers x ETFs DataFrames.
+    """
+    x, y = returns.to_numpy(dtype=np.float64), etf_returns.to_numpy(dtype=np.float64)
+    mx, my = (~np.isnan(x)).astype(np.float64), (~np.isnan(y)).astype(np.float64)
+    x0, y0 = np.nan_to_num(x), np.nan_to_num(y)
+    n = mx.T @ my
+    sx, sy = x0.T @ my, mx.T @ y0
+    sxx, syy, sxy = (x0 * x0).T @ my, mx.T @ (y0 * y0), x0.T @ y0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        corr = cov / np.sqrt(var_x * var_y)
+        slope = cov / var_y
+    frame = lambda values: pd.DataFrame(values, index=returns.columns, columns=etf_returns.columns)
+    return frame(corr), frame(n), frame(slope)
+
+def calculate_factor_exposures_batch(price_panel, etf_histories, tickers, sectors=None, min_overlap=90, min_beta_overlap=30, min_z_overlap=200):
+    """
+    Universe-wide `Beta_to_SPY`, `Best_Factor`, `Correlation_Score` and `Relative_Z_Score`.
+
+    Replaces the per-ticker ETF loop of `process_single_ticker`: the ETF return matrix is
+    aligned once, all correlations and SPY betas come from one masked matrix product, and
+    each ticker keeps the same `> 90` day overlap rule for correlations (`> 30` for beta).
+    """
+    returns = price_panel.log_returns(tickers)
+    etf_returns = _etf_log_returns(etf_histories)
+    common_index = returns.index.union(etf_returns.index)
+    returns, etf_returns = returns.reindex(common_index), etf_returns.reindex(common_index)
+    corr, overlap, slope = calculate_etf_correlations_batch(returns, etf_returns)
+
+    exposures = pd.DataFrame({'Beta_to_SPY': np.nan, 'Best_Factor': None, 'Correlation_Score': np.nan, 'Relative_Z_Score': np.nan}, index=returns.columns)
+    if etf_returns.empty: return exposures
+    if 'SPY' in slope.columns:
+        exposures['Beta_to_SPY'] = slope['SPY'].where(overlap['SPY'] > min_beta_overlap)
+
+    # Ties resolve to the first ETF in `etf_histories` order, as `max()` over the dict did
+    valid_corr = corr.where(overlap > min_overlap)
+    best_pos = valid_corr.abs().fillna(-1.0).to_numpy().argmax(axis=1)
+    has_corr = valid_corr.notna().any(axis=1).to_numpy()
+    best_etfs = [corr.columns[pos] if ok else None for pos, ok in zip(best_pos, has_corr)]
+    exposures['Best_Factor'] = best_etfs
+    exposures['Correlation_Score'] = np.where(has_corr, valid_corr.to_numpy()[np.arange(len(best_pos)), best_pos], np.nan)
+
+    closes = price_panel.closes(tickers)
+    for ticker, best_etf in zip(returns.columns, best_etfs):
+        if best_etf is None: continue
+        stock_close = closes[ticker].dropna()
+        etf_close = etf_histories[best_etf]['Close']
+        common_idx = stock_close.index.intersection(etf_close.index)
+        if len(common_idx) > min_z_overlap:
+            sector = sectors.get(ticker) if sectors is not None else None
+            exposures.loc[ticker, 'Relative_Z_Score'] = calculate_volatility_adjusted_z_score(stock_close[common_idx] / etf_close[common_idx], ticker=ticker, sector=sector)
+
+    return exposures
+
+# --- Statement Ratios ---
+# Statement line items and the ratios built from them, shared by `process_single_ticker` and the
+# point-in-time backfill. The line items depend only on the statements, so the backfill can reuse
+# them for every date until a newer period is published; the ratios also need price data.
+def extract_statement_fundamentals(financials, balancesheet, cashflow):
+    """Latest-period line items (plus the Piotroski F-score) from the annual statements, newest period first."""
+    f = {}
+    f['revenue'] = get_value(financials, ['Total Revenue', 'TotalRevenue'])
+    f['gross_profit'] = get_value(financials, ['Gross Profit', 'GrossProfit'])
+    f['net_income'] = get_value(financials, ['Net Income', 'NetIncome'])
+    f['operating_income'] = get_value(financials, ['Operating Income', 'OperatingIncome'])
+    f['interest_expense'] = get_value(financials, ['Interest Expense', 'InterestExpense'])
+    f['ebit'] = get_value(financials, ['Ebit', 'EBIT'])
+    f['total_assets'] = get_value(balancesheet, ['Total Assets', 'TotalAssets'])
+    f['total_liabilities'] = get_value(balancesheet, ['Total Liabilities', 'TotalLiab'])
+    f['intangibles'] = (get_value(balancesheet, ['Intangible Assets', 'IntangibleAssets']) or 0) + (get_value(balancesheet, ['Goodwill']) or 0)
+    f['total_equity'] = get_value(balancesheet, ['Total Stockholder Equity', 'TotalStockholderEquity'])
+    f['current_assets'] = get_value(balancesheet, ['Total Current Assets', 'TotalCurrentAssets'])
+    f['current_liabilities'] = get_value(balancesheet, ['Total Current Liabilities', 'TotalCurrentLiabilities'])
+    f['inventory'] = get_value(balancesheet, ['Inventory']) or 0
+    f['shares'] = get_value(balancesheet, ['Ordinary Shares Number', 'Share Issued'])
+    f['cogs'] = get_value(financials, ['Cost Of Revenue', 'CostOfRevenue'])
+    f['operating_cash_flow'] = get_value(cashflow, ['Operating Cash Flow', 'TotalCashFromOperatingActivities'])
+    f['capex'] = get_value(cashflow, ['Capital Expenditure', 'CapitalExpenditures'])
+    f['depreciation'] = get_value(cashflow, ['Depreciation And Amortization', 'Depreciation'])
+    f['dividends_paid'] = get_value(cashflow, ['Dividends Paid', 'DividendsPaid']) or 0
+    f['buybacks'] = get_value(cashflow, ['Repurchase Of Capital Stock', 'RepurchaseOfStock']) or 0
+    f['fcf'] = (f['operating_cash_flow'] if pd.notna(f['operating_cash_flow']) else 0) + (f['capex'] if pd.notna(f['capex']) else 0)
+    roa = (f['net_income'] / f['total_assets']) * 100 if f['total_assets'] and f['total_assets'] > 0 else np.nan
+    f['piotroski'] = calculate_piotroski_f_score(financials, balancesheet, cashflow, f['total_assets'], roa, f['net_income'])
+    return f
+
+def calculate_statement_ratios(fundamentals, market_cap, shares_outstanding, current_price, eps):
+    """The statement-based columns of a results row from `extract_statement_fundamentals` output and market data."""
+    revenue, gross_profit, net_income = fundamentals['revenue'], fundamentals['gross_profit'], fundamentals['net_income']
+    operating_income, interest_expense, ebit = fundamentals['operating_income'], fundamentals['interest_expense'], fundamentals['ebit']
+    total_assets, total_liabilities, intangibles = fundamentals['total_assets'], fundamentals['total_liabilities'], fundamentals['intangibles']
+    total_equity, current_assets, current_liabilities = fundamentals['total_equity'], fundamentals['current_assets'], fundamentals['current_liabilities']
+    inventory, cogs, capex, depreciation = fundamentals['inventory'], fundamentals['cogs'], fundamentals['capex'], fundamentals['depreciation']
+    dividends_paid, buybacks, fcf = fundamentals['dividends_paid'], fundamentals['buybacks'], fundamentals['fcf']
+
+    data = {}
+    data['Current_Ratio'] = current_assets / current_liabilities if current_liabilities and current_liabilities > 0 else np.nan
+    data['Quick_Ratio'] = (current_assets - inventory) / current_liabilities if current_liabilities and current_liabilities > 0 else np.nan
+    data['Debt_Ratio'] = total_liabilities / total_assets if total_assets and total_assets > 0 else np.nan
+    data['Liabilities_to_Equity'] = total_liabilities / total_equity if total_equity and total_equity > 0 else np.nan
+    data['Gross_Profit_Margin'] = (gross_profit / revenue) * 100 if revenue and revenue > 0 else np.nan
+    data['Operating_Margin'] = (operating_income / revenue) * 100 if revenue and revenue > 0 else np.nan
+    data['Net_Profit_Margin'] = (net_income / revenue) * 100 if revenue and revenue > 0 else np.nan
+    data['ROA'] = (net_income / total_assets) * 100 if total_assets and total_assets > 0 else np.nan
+    data['ROE'] = (net_income / total_equity) * 100 if total_equity and total_equity > 0 else np.nan
+    data['PS_Ratio'] = market_cap / revenue if revenue and market_cap and revenue > 0 else np.nan
+    data['FCF_Yield'] = (fcf / market_cap) * 100 if market_cap and market_cap > 0 else np.nan
+    data['Sales_Per_Share'] = revenue / shares_outstanding if shares_outstanding and shares_outstanding > 0 else np.nan
+    data['FCF_Per_Share'] = fcf / shares_outstanding if shares_outstanding and shares_outstanding > 0 else np.nan
+    data['Asset_Turnover'] = revenue / total_assets if total_assets and total_assets > 0 else np.nan
+    data['CapEx_to_DepAmor'] = abs(capex or 0) / depreciation if depreciation and depreciation > 0 else np.nan
+    data['Dividends_to_FCF'] = abs(dividends_paid) / fcf if fcf and fcf > 0 else np.nan
+    data['Interest_Coverage'] = ebit / abs(interest_expense or 1) if interest_expense is not None else np.nan
+    data['Inventory_Turnover'] = cogs / inventory if inventory and inventory > 0 else np.nan
+    data['Share_Buyback_to_FCF'] = abs(buybacks) / fcf if fcf and fcf > 0 else np.nan
+    data['Dividends_Plus_Buyback_to_FCF'] = (abs(dividends_paid) + abs(buybacks)) / fcf if fcf and fcf > 0 else np.nan
+    data['Earnings_Yield'] = (eps / current_price) * 100 if current_price and current_price > 0 else np.nan
+    data['FCF_to_Net_Income'] = fcf / net_income if net_income and net_income > 0 else np.nan
+    data['Tangible_Book_Value'] = total_assets - intangibles - total_liabilities if all(pd.notna([total_assets, intangibles, total_liabilities])) else np.nan
+    data['Return_On_Tangible_Equity'] = (net_income / data['Tangible_Book_Value']) * 100 if pd.notna(data['Tangible_Book_Value']) and data['Tangible_Book_Value'] != 0 else np.nan
+    data['Piotroski_F-Score'] = fundamentals['piotroski']
+    nopat = operating_income * (1 - 0.25) if operating_income else np.nan
+    invested_capital = total_assets - current_liabilities if all(pd.notna([total_assets, current_liabilities])) else np.nan
+    data['ROIC'] = (nopat / invested_capital) * 100 if invested_capital and invested_capital > 0 else np.nan
+    data['Cash_ROIC'] = (fcf / invested_capital) * 100 if invested_capital and invested_capital > 0 else np.nan
+    return data
+
+def calculate_composite_scores(data, net_income):
+    """Q_Score, Coverage_Score, Vision, Value_Factor and Profitability_Factor from a results row's ratios."""
+    scores = {}
+    scores['Q_Score'] = min(data.get('Quick_Ratio', 0) / 5.0, 1.0) if pd.notna(data.get('Quick_Ratio')) and data.get('Quick_Ratio') > 0 else 0.0
+    scores['Coverage_Score'] = min(data.get('Interest_Coverage', 0) / 10.0, 1.0) if pd.notna(data.get('Interest_Coverage')) and data.get('Interest_Coverage') > 0 else 0.0
+
+    vision_score = 0
+    if data.get('Sector') == 'Technology' and pd.notna(net_income) and net_income < 0: vision_score += 5
+    if pd.notna(data.get('Sales_Growth_TTM')) and data.get('Sales_Growth_TTM') > 20: vision_score += 3
+    scores['Vision'] = min(vision_score / 8.0, 1.0)
+
+    pe = data.get('PE_Ratio'); ps = data.get('PS_Ratio')
+    if pd.notna(pe) and pd.notna(ps) and (pe + ps) > 0:
+        scores['Value_Factor'] = min(1 / ((pe + ps) / 2.0), 1.0)
+    else:
+        scores['Value_Factor'] = 0.0
+
+    profit_metrics = [data.get('ROE'), data.get('ROIC'), data.get('Net_Profit_Margin')]
+    valid_profit_metrics = [m for m in profit_metrics if pd.notna(m)]
+    scores['Profitability_Factor'] = min(np.mean(valid_profit_metrics) / 100.0, 1.0) if valid_profit_metrics else 0.0
+    return scores
+
 # --- FIX: THIS IS THE COMPLETE AND CORRECTED FUNCTION. REPLACE THE EXISTING ONE. ---
-def process_single_ticker(ticker_symbol, etf_histories, sector_etf_map):
+def process_single_ticker(ticker_symbol, etf_histories, sector_etf_map, price_panel=None, batch_metrics=False):
     try:
-        _, history, info, financials, balancesheet, cashflow, _, _, _ = fetch_ticker_data(ticker_symbol)
+        _, history, info, financials, balancesheet, cashflow, _, _, _ = fetch_ticker_data(ticker_symbol, price_panel=price_panel)
 
         if history.empty or not info:
             failed_data = {col: np.nan for col in columns}
@@ -819,129 +2601,74 @@ def process_single_ticker(ticker_symbol, etf_histories, sector_etf_map):
         data['Institutional_Ownership_Ratio'] = info.get('heldPercentInstitutions', 0) * 100
         data['Audit_Risk'], data['Board_Risk'], data['Compensation_Risk'], data['Shareholder_Rights_Risk'], data['Overall_Risk'] = info.get('auditRisk'), info.get('boardRisk'), info.get('compensationRisk'), info.get('shareHolderRightsRisk'), info.get('overallRisk')
 
-        revenue = get_value(financials, ['Total Revenue', 'TotalRevenue'])
-        gross_profit = get_value(financials, ['Gross Profit', 'GrossProfit'])
+        data.update(calculate_statement_ratios(extract_statement_fundamentals(financials, balancesheet, cashflow),
+                                               data['Market_Cap'], shares_outstanding, current_price, data['EPS_Diluted']))
         net_income = get_value(financials, ['Net Income', 'NetIncome'])
-        operating_income = get_value(financials, ['Operating Income', 'OperatingIncome'])
-        interest_expense = get_value(financials, ['Interest Expense', 'InterestExpense'])
-        ebit = get_value(financials, ['Ebit', 'EBIT'])
-        total_assets = get_value(balancesheet, ['Total Assets', 'TotalAssets'])
-        total_liabilities = get_value(balancesheet, ['Total Liabilities', 'TotalLiab'])
-        intangibles = (get_value(balancesheet, ['Intangible Assets', 'IntangibleAssets']) or 0) + (get_value(balancesheet, ['Goodwill']) or 0)
-        total_equity = get_value(balancesheet, ['Total Stockholder Equity', 'TotalStockholderEquity'])
-        current_assets = get_value(balancesheet, ['Total Current Assets', 'TotalCurrentAssets'])
-        current_liabilities = get_value(balancesheet, ['Total Current Liabilities', 'TotalCurrentLiabilities'])
-        inventory = get_value(balancesheet, ['Inventory']) or 0
-        cogs = get_value(financials, ['Cost Of Revenue', 'CostOfRevenue'])
-        operating_cash_flow = get_value(cashflow, ['Operating Cash Flow', 'TotalCashFromOperatingActivities'])
-        capex = get_value(cashflow, ['Capital Expenditure', 'CapitalExpenditures'])
-        depreciation = get_value(cashflow, ['Depreciation And Amortization', 'Depreciation'])
-        dividends_paid = get_value(cashflow, ['Dividends Paid', 'DividendsPaid']) or 0
-        buybacks = get_value(cashflow, ['Repurchase Of Capital Stock', 'RepurchaseOfStock']) or 0
-        fcf = (operating_cash_flow if pd.notna(operating_cash_flow) else 0) + (capex if pd.notna(capex) else 0)
-
-        # --- Ratio Calculations ---
-        data['Current_Ratio'] = current_assets / current_liabilities if current_liabilities and current_liabilities > 0 else np.nan
-        data['Quick_Ratio'] = (current_assets - inventory) / current_liabilities if current_liabilities and current_liabilities > 0 else np.nan
-        data['Debt_Ratio'] = total_liabilities / total_assets if total_assets and total_assets > 0 else np.nan
-        data['Liabilities_to_Equity'] = total_liabilities / total_equity if total_equity and total_equity > 0 else np.nan
-        data['Gross_Profit_Margin'] = (gross_profit / revenue) * 100 if revenue and revenue > 0 else np.nan
-        data['Operating_Margin'] = (operating_income / revenue) * 100 if revenue and revenue > 0 else np.nan
-        data['Net_Profit_Margin'] = (net_income / revenue) * 100 if revenue and revenue > 0 else np.nan
-        data['ROA'] = (net_income / total_assets) * 100 if total_assets and total_assets > 0 else np.nan
-        data['ROE'] = (net_income / total_equity) * 100 if total_equity and total_equity > 0 else np.nan
-        data['PS_Ratio'] = data['Market_Cap'] / revenue if revenue and data['Market_Cap'] and revenue > 0 else np.nan
-        data['FCF_Yield'] = (fcf / data['Market_Cap']) * 100 if data['Market_Cap'] and data['Market_Cap'] > 0 else np.nan
-        data['Sales_Per_Share'] = revenue / shares_outstanding if shares_outstanding and shares_outstanding > 0 else np.nan
-        data['FCF_Per_Share'] = fcf / shares_outstanding if shares_outstanding and shares_outstanding > 0 else np.nan
-        data['Asset_Turnover'] = revenue / total_assets if total_assets and total_assets > 0 else np.nan
-        data['CapEx_to_DepAmor'] = abs(capex or 0) / depreciation if depreciation and depreciation > 0 else np.nan
-        data['Dividends_to_FCF'] = abs(dividends_paid) / fcf if fcf and fcf > 0 else np.nan
-        data['Interest_Coverage'] = ebit / abs(interest_expense or 1) if interest_expense is not None else np.nan
-        data['Inventory_Turnover'] = cogs / inventory if inventory and inventory > 0 else np.nan
-        data['Share_Buyback_to_FCF'] = abs(buybacks) / fcf if fcf and fcf > 0 else np.nan
-        data['Dividends_Plus_Buyback_to_FCF'] = (abs(dividends_paid) + abs(buybacks)) / fcf if fcf and fcf > 0 else np.nan
-        data['Earnings_Yield'] = (data['EPS_Diluted'] / current_price) * 100 if current_price and current_price > 0 else np.nan
-        data['FCF_to_Net_Income'] = fcf / net_income if net_income and net_income > 0 else np.nan
-        data['Tangible_Book_Value'] = total_assets - intangibles - total_liabilities if all(pd.notna([total_assets, intangibles, total_liabilities])) else np.nan
-        data['Return_On_Tangible_Equity'] = (net_income / data['Tangible_Book_Value']) * 100 if pd.notna(data['Tangible_Book_Value']) and data['Tangible_Book_Value'] != 0 else np.nan
         data['Earnings_Growth_Rate_5y'] = info.get('earningsGrowth', 0) * 100 if info.get('earningsGrowth') else np.nan
         data['Revenue_Growth_Rate_5y'] = info.get('revenueGrowth', 0) * 100 if info.get('revenueGrowth') else np.nan
-        data['Piotroski_F-Score'] = calculate_piotroski_f_score(financials, balancesheet, cashflow, total_assets, data['ROA'], net_income)
-        nopat = operating_income * (1 - 0.25) if operating_income else np.nan
-        invested_capital = total_assets - current_liabilities if all(pd.notna([total_assets, current_liabilities])) else np.nan
-        data['ROIC'] = (nopat / invested_capital) * 100 if invested_capital and invested_capital > 0 else np.nan
-        data['Cash_ROIC'] = (fcf / invested_capital) * 100 if invested_capital and invested_capital > 0 else np.nan
 
         # --- Time-series, Technicals, and Factor Calculations ---
         log_returns = pd.Series()
         if not history.empty and 'Close' in history.columns:
             log_returns = np.log(history['Close'] / history['Close'].shift(1)).dropna()
             if not log_returns.empty:
-                data['GARCH_Vol'] = calculate_garch_volatility(log_returns)
-                data['AR_Coeff'] = calculate_ar_coefficient(log_returns)
-                data['Log_Log_Utility'] = calculate_log_log_utility(log_returns)
-                data['Log_Log_Sharpe'] = calculate_log_log_sharpe(log_returns)
-                data['Vol_Autocorr'] = calculate_volatility_autocorrelation(log_returns)
-                data['Stop_Loss_Impact'] = calculate_stop_loss_impact(log_returns)
-                hurst, _ = calculate_hurst_lo_modified(log_returns)
-                data['Hurst_Exponent'] = hurst
-                data['Trend'] = breakout(history['Close'])
-                data['Dollar_Volume_90D'] = (history['Volume'] * history['Close']).rolling(90).mean().iloc[-1]
-                data['Momentum'] = (history['Close'].iloc[-1] / history['Close'].iloc[-252] - 1) * 100 if len(history) > 252 else np.nan
-
-                spy_hist = etf_histories.get('SPY')
-                if spy_hist is not None and not spy_hist.empty:
-                    spy_returns = np.log(spy_hist['Close'] / spy_hist['Close'].shift(1)).dropna()
-                    common_idx = log_returns.index.intersection(spy_returns.index)
-                    if len(common_idx) > 30:
-                        slope, _, _, _, _ = linregress(spy_returns[common_idx], log_returns[common_idx])
-                        data['Beta_to_SPY'] = slope
-
-                # --- THIS IS THE CRITICAL LOGIC BLOCK THAT WAS RESTORED ---
-                rolling_correlations = {}
-                for etf, etf_history in etf_histories.items():
-                    if etf_history is not None and not etf_history.empty:
-                        etf_returns = np.log(etf_history['Close'] / etf_history['Close'].shift(1)).dropna()
-                        common_idx = log_returns.index.intersection(etf_returns.index)
-                        if len(common_idx) > 90:
-                            corr = log_returns.loc[common_idx].corr(etf_returns.loc[common_idx])
-                            if pd.notna(corr): rolling_correlations[etf] = corr
-
-                if rolling_correlations:
-                    best_factor_ticker = max(rolling_correlations, key=lambda k: abs(rolling_correlations.get(k, 0)))
-                    data['Best_Factor'] = best_factor_ticker
-                    data['Correlation_Score'] = rolling_correlations.get(best_factor_ticker)
-
-                    best_etf_hist = etf_histories.get(best_factor_ticker)
-                    if best_etf_hist is not None:
-                        common_idx_z = history.index.intersection(best_etf_hist.index)
-                        if len(common_idx_z) > 200:
-                            relative_strength = history['Close'][common_idx_z] / best_etf_hist['Close'][common_idx_z]
-                            data['Relative_Z_Score'] = calculate_volatility_adjusted_z_score(relative_strength, ticker=ticker_symbol, sector=data['Sector'])
-
-        returns_perf = calculate_returns_cached(ticker_symbol, tuple([21, 63, 126, 252]))
+                # In batch mode GARCH and Hurst run in the process-pool compute stage
+                if not batch_metrics:
+                    data['GARCH_Vol'] = calculate_garch_volatility(log_returns, ticker=ticker_symbol)
+                    hurst, _ = calculate_hurst_lo_modified(log_returns)
+                    data['Hurst_Exponent'] = hurst
+                # In batch mode these columns are filled for the whole universe by process_tickers
+                if not batch_metrics:
+                    data['AR_Coeff'] = calculate_ar_coefficient(log_returns)
+                    data['Log_Log_Utility'] = calculate_log_log_utility(log_returns)
+                    data['Log_Log_Sharpe'] = calculate_log_log_sharpe(log_returns)
+                    data['Vol_Autocorr'] = calculate_volatility_autocorrelation(log_returns)
+                    data['Stop_Loss_Impact'] = calculate_stop_loss_impact(log_returns)
+                    data['Trend'] = breakout(history['Close'])
+                    data['Dollar_Volume_90D'] = (history['Volume'] * history['Close']).rolling(90).mean().iloc[-1]
+                    data['Momentum'] = (history['Close'].iloc[-1] / history['Close'].iloc[-252] - 1) * 100 if len(history) > 252 else np.nan
+
+                # In batch mode SPY beta, Best_Factor and the relative Z-score are computed universe-wide
+                if not batch_metrics:
+                    spy_hist = etf_histories.get('SPY')
+                    if spy_hist is not None and not spy_hist.empty:
+                        spy_returns = np.log(spy_hist['Close'] / spy_hist['Close'].shift(1)).dropna()
+                        common_idx = log_returns.index.intersection(spy_returns.index)
+                        if len(common_idx) > 30:
+                            slope, _, _, _, _ = linregress(spy_returns[common_idx], log_returns[common_idx])
+                            data['Beta_to_SPY'] = slope
+
+                    # --- THIS IS THE CRITICAL LOGIC BLOCK THAT WAS RESTORED ---
+                    rolling_correlations = {}
+                    for etf, etf_history in etf_histories.items():
+                        if etf_history is not None and not etf_history.empty:
+                            etf_returns = np.log(etf_history['Close'] / etf_history['Close'].shift(1)).dropna()
+                            common_idx = log_returns.index.intersection(etf_returns.index)
+                            if len(common_idx) > 90:
+                                corr = log_returns.loc[common_idx].corr(etf_returns.loc[common_idx])
+                                if pd.notna(corr): rolling_correlations[etf] = corr
+
+                    if rolling_correlations:
+                        best_factor_ticker = max(rolling_correlations, key=lambda k: abs(rolling_correlations.get(k, 0)))
+                        data['Best_Factor'] = best_factor_ticker
+                        data['Correlation_Score'] = rolling_correlations.get(best_factor_ticker)
+
+                        best_etf_hist = etf_histories.get(best_factor_ticker)
+                        if best_etf_hist is not None:
+                            common_idx_z = history.index.intersection(best_etf_hist.index)
+                            if len(common_idx_z) > 200:
+                                relative_strength = history['Close'][common_idx_z] / best_etf_hist['Close'][common_idx_z]
+                                data['Relative_Z_Score'] = calculate_volatility_adjusted_z_score(relative_strength, ticker=ticker_symbol, sector=data['Sector'])
+
+        if price_panel is not None and not history.empty:
+            returns_perf = calculate_period_returns(history['Close'], [21, 63, 126, 252])
+        else:
+            returns_perf = calculate_returns_cached(ticker_symbol, tuple([21, 63, 126, 252]))
         data.update({f"Return_{p}d": returns_perf.get(f"Return_{p}d") for p in [21, 63, 126, 252]})
         data['Growth'] = data.get('Sales_Growth_YOY')
 
         # --- RESTORED LOGIC for other scores ---
-        data['Q_Score'] = min(data.get('Quick_Ratio', 0) / 5.0, 1.0) if pd.notna(data.get('Quick_Ratio')) and data.get('Quick_Ratio') > 0 else 0.0
-        data['Coverage_Score'] = min(data.get('Interest_Coverage', 0) / 10.0, 1.0) if pd.notna(data.get('Interest_Coverage')) and data.get('Interest_Coverage') > 0 else 0.0
-
-        vision_score = 0
-        if data.get('Sector') == 'Technology' and pd.notna(net_income) and net_income < 0: vision_score += 5
-        if pd.notna(data.get('Sales_Growth_TTM')) and data.get('Sales_Growth_TTM') > 20: vision_score += 3
-        data['Vision'] = min(vision_score / 8.0, 1.0)
-
-        pe = data.get('PE_Ratio'); ps = data.get('PS_Ratio')
-        if pd.notna(pe) and pd.notna(ps) and (pe + ps) > 0:
-            data['Value_Factor'] = min(1 / ((pe + ps) / 2.0), 1.0)
-        else:
-            data['Value_Factor'] = 0.0
-
-        profit_metrics = [data.get('ROE'), data.get('ROIC'), data.get('Net_Profit_Margin')]
-        valid_profit_metrics = [m for m in profit_metrics if pd.notna(m)]
-        data['Profitability_Factor'] = min(np.mean(valid_profit_metrics) / 100.0, 1.0) if valid_profit_metrics else 0.0
+        data.update(calculate_composite_scores(data, net_income))
 
         # --- END OF RESTORED LOGIC ---
 
@@ -958,10 +2685,11 @@ def process_single_ticker(ticker_symbol, etf_histories, sector_etf_map):
 
 # --- FIX: Replaced this entire function to fix the 'inplace' warning and improve cleaning ---
 @st.cache_data
-def process_tickers(_tickers, _etf_histories, _sector_etf_map):
+def process_tickers(_tickers, _etf_histories, _sector_etf_map, _price_panel=None, workers=None):
     results, returns_dict, failed_tickers = [], {}, []
+    batch_metrics = _price_panel is not None
     with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_ticker = {executor.submit(process_single_ticker, ticker, _etf_histories, _sector_etf_map): ticker for ticker in _tickers}
+        future_to_ticker = {executor.submit(process_single_ticker, ticker, _etf_histories, _sector_etf_map, _price_panel, batch_metrics): ticker for ticker in _tickers}
         for future in tqdm(as_completed(future_to_ticker), total=len(_tickers), desc="Processing All Ticker Metrics"):
             ticker = future_to_ticker[future]
             try:
@@ -979,11 +2707,32 @@ def process_tickers(_tickers, _etf_histories, _sector_etf_map):
     if not results:
         return pd.DataFrame(columns=columns), failed_tickers, {}
 
+    # Keep the universe order rather than completion order so reruns produce identical frames
+    position = {ticker: i for i, ticker in enumerate(_tickers)}
+    results.sort(key=lambda result: position[result[0]])
+    failed_tickers.sort(key=position.get)
+    returns_dict = {ticker: returns_dict[ticker] for ticker in sorted(returns_dict, key=position.get)}
     results_df = pd.DataFrame(results, columns=columns)
 
     numeric_cols = [c for c in columns if c not in ['Ticker', 'Name', 'Sector', 'Best_Factor', 'Risk_Flag']]
     results_df[numeric_cols] = results_df[numeric_cols].apply(pd.to_numeric, errors='coerce')
 
+    if batch_metrics:
+        panel_tickers = [t for t in results_df['Ticker'] if t in _price_panel]
+        batch_df = calculate_time_series_metrics_batch(_price_panel.closes(panel_tickers), _price_panel.volumes(panel_tickers))
+        compute_df = run_ticker_compute_stage(returns_dict, workers=workers)
+        batch_df = batch_df.join(compute_df, how='outer').reindex(results_df['Ticker'])
+        for col in batch_df.columns:
+            results_df[col] = batch_df[col].to_numpy()
+        sectors = results_df.set_index('Ticker')['Sector']
+        exposures_df = calculate_factor_exposures_batch(_price_panel, _etf_histories, panel_tickers, sectors=sectors).reindex(results_df['Ticker'])
+        for col in exposures_df.columns:
+            results_df[col] = exposures_df[col].to_numpy()
+
+    return clean_results_frame(results_df), failed_tickers, returns_dict
+
+def clean_results_frame(results_df):
+    """Median-fills the numeric columns (0 when all missing) and jitters degenerate ones so the regressions stay well-posed."""
     # Corrected data cleaning loop to avoid 'inplace' on a copy
     for col in results_df.select_dtypes(include=np.number).columns:
         if results_df[col].isna().all():
@@ -994,14 +2743,71 @@ def process_tickers(_tickers, _etf_histories, _sector_etf_map):
             results_df[col] = results_df[col].fillna(median_val)
 
         if results_df[col].var() < 1e-8:
-            results_df[col] += np.random.normal(0, 0.01, len(results_df))
+            # Seeded per column so the same inputs always give the same frame (and stage-cache key)
+            results_df[col] += np.random.default_rng(zlib.crc32(col.encode())).normal(0, 0.01, len(results_df))
 
-    return results_df.infer_objects(copy=False), failed_tickers, returns_dict
+    return results_df.infer_objects(copy=False)
 
 # --- FIX: REPLACED ENTIRE FUNCTION TO BE MORE ROBUST AND PREVENT LINALGWARNING ---
 
 
-def check_multicollinearity(X, characteristics, vif_threshold=5.0):
+# --- VIF Elimination ---
+# statsmodels' `variance_inflation_factor` standardizes the columns and regresses each one on the
+# others, so VIF_i = 1 / (1 - R_i^2) = inv(R)_ii for the correlation matrix R: every VIF at once
+# is the diagonal of the inverse correlation matrix. Dropping column j updates that inverse in
+# O(k^2) (rank-one downdate) instead of re-running k regressions per step. While the matrix is
+# near-singular, VIFs come from its pseudo-inverse and only the exactly collinear columns (whose
+# VIFs tie at statsmodels' clip) are evaluated with statsmodels, so ties break identically.
+VIF_CONDITION_LIMIT = 1e10
+VIF_MAX = 1.0 / (1.0 - (1.0 - 1e-15))   # statsmodels clips R^2 at 1 - 1e-15
+VIF_MAX_EXACT_COLLINEAR = 16             # beyond this many collinear columns, treat them as tied at VIF_MAX
+
+def _column_correlations(values):
+    """Pearson correlation of the columns of `values` (n x k); columns must have non-zero variance."""
+    centered = values - values.mean(axis=0)
+    standardized = centered / np.sqrt(np.einsum('ij,ij->j', centered, centered))
+    return standardized.T @ standardized
+
+def inverse_correlation_matrix(values):
+    """Inverse of the correlation matrix of `values`, or None when it is near-singular."""
+    correlation = _column_correlations(values)
+    if not np.isfinite(correlation).all() or np.linalg.cond(correlation) > VIF_CONDITION_LIMIT: return None
+    return np.linalg.inv(correlation)
+
+def singular_correlation_vifs(values):
+    """
+    VIFs when the correlation matrix R is near-singular. A column outside R's null space has
+    VIF_i = pinv(R)_ii; columns in it are (numerically) exact linear combinations of the others
+    and are evaluated with statsmodels' `variance_inflation_factor`. When there are more than
+    VIF_MAX_EXACT_COLLINEAR of them (e.g. fewer rows than columns), statsmodels' values are
+    rounding noise around its clip, so they are all set to VIF_MAX instead.
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(_column_correlations(values))
+    null = eigenvalues < eigenvalues.max() / VIF_CONDITION_LIMIT
+    kept = eigenvectors[:, ~null]
+    vifs = np.clip(np.einsum('ij,j,ij->i', kept, 1.0 / eigenvalues[~null], kept), 1.0, VIF_MAX)
+    collinear = np.flatnonzero((np.abs(eigenvectors[:, null]) > 1e-8).any(axis=1))
+    if len(collinear) > VIF_MAX_EXACT_COLLINEAR:
+        vifs[collinear] = VIF_MAX
+        return vifs
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', category=RuntimeWarning)
+        for i in collinear:
+            vifs[i] = variance_inflation_factor(values, i)
+    return vifs
+
+def drop_from_inverse(inverse, j):
+    """Inverse of the matrix without row/column `j`, downdated from the full inverse."""
+    keep = np.arange(len(inverse)) != j
+    column = inverse[keep, j]
+    return inverse[np.ix_(keep, keep)] - np.outer(column, column) / inverse[j, j]
+
+def _statsmodels_vifs(values):
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', category=RuntimeWarning)
+        return np.array([variance_inflation_factor(values, i) for i in range(values.shape[1])])
+
+def check_multicollinearity(X, characteristics, vif_threshold=5.0, method="inverse"):
     """
     Iteratively removes features with high Variance Inflation Factor (VIF)
     to handle multicollinearity in a robust way, suppressing expected warnings.
@@ -1017,6 +2823,8 @@ def check_multicollinearity(X, characteristics, vif_threshold=5.0):
         X (pd.DataFrame): The input feature matrix.
         characteristics (list): A list of column names in X to check for VIF.
         vif_threshold (float): The threshold above which features are removed.
+        method (str): "inverse" reads all VIFs off the downdated inverse correlation matrix; "statsmodels"
+                      runs one `variance_inflation_factor` regression per column and step.
 
     Returns:
         list: A list of feature names with VIF below the threshold.
@@ -1042,45 +2850,42 @@ def check_multicollinearity(X, characteristics, vif_threshold=5.0):
         return X_vif.columns.tolist()
 
     # 3. Iteratively remove features with the highest VIF
+    features, values = X_vif.columns.tolist(), X_vif.to_numpy(dtype=float)
+    inverse = inverse_correlation_matrix(values) if method == "inverse" else None
     while True:
-        # Create a DataFrame to hold VIF values
-        vif_data = pd.DataFrame()
-        vif_data["feature"] = X_vif.columns
-
-        # Suppress the specific RuntimeWarning during VIF calculation
-        with warnings.catch_warnings():
-            warnings.filterwarnings('ignore', category=RuntimeWarning)
+        if inverse is not None:
+            vifs = np.clip(np.diag(inverse), 1.0, VIF_MAX)
+        else:
             try:
-                vif_data["VIF"] = [variance_inflation_factor(X_vif.values, i) for i in range(X_vif.shape[1])]
+                vifs = singular_correlation_vifs(values) if method == "inverse" else _statsmodels_vifs(values)
             except Exception:
                 # In case of a different error (e.g., LinAlgError), drop the last column as a safe fallback
-                if not X_vif.empty:
-                    X_vif = X_vif.iloc[:, :-1]
-                    continue
-                else:
-                    break
+                features, values = features[:-1], values[:, :-1]
+                if len(features) < 2: break
+                continue
 
-        # Find the feature with the maximum VIF
-        max_vif = vif_data['VIF'].max()
+        vif_data = pd.DataFrame({"feature": features, "VIF": vifs})
 
         # If the highest VIF is below the threshold, the process is done
-        if max_vif < vif_threshold:
+        if vif_data['VIF'].max() < vif_threshold:
             break
 
         # Otherwise, find the feature with the highest VIF and remove it
         feature_to_drop = vif_data.sort_values('VIF', ascending=False)['feature'].iloc[0]
-        X_vif = X_vif.drop(columns=[feature_to_drop])
-        
+        j = features.index(feature_to_drop)
+        features, values = features[:j] + features[j + 1:], np.delete(values, j, axis=1)
+
         # Stop if we run out of features
-        if X_vif.shape[1] < 2:
+        if len(features) < 2:
             break
-            
+        if method == "inverse":
+            inverse = drop_from_inverse(inverse, j) if inverse is not None else inverse_correlation_matrix(values)
+
     # 4. Return the list of features that passed the VIF check
-    final_characteristics = X_vif.columns.tolist()
-    return final_characteristics
+    return features
 
 # --- FIX: Replaced this entire function to correct inefficiency and bugs ---
-def calculate_portfolio_factor_correlations(weighted_df, etf_histories, period="3y", min_days=240):
+def calculate_portfolio_factor_correlations(weighted_df, etf_histories, period="3y", min_days=240, price_panel=None):
     """
     Calculates the correlation of a weighted portfolio's returns against a list of ETF returns.
     This version is robust and efficient.
@@ -1094,27 +2899,32 @@ def calculate_portfolio_factor_correlations(weighted_df, etf_histories, period="
         logging.warning("Weighted DataFrame is empty or missing 'Weight' column.")
         return correlations
 
-    for idx, row in weighted_df.iterrows():
-        ticker = row['Ticker']
-        weight = row['Weight']
-        try:
-            history = yf.Ticker(ticker).history(period=period, auto_adjust=True, interval="1d").tz_localize(None)
-            if history.empty or 'Close' not in history.columns:
-                continue
+    weights = weighted_df.set_index('Ticker')['Weight']
+    if price_panel is not None and all(ticker in price_panel for ticker in weights.index):
+        # Every name is in the panel: one wide-frame pass instead of a history per name
+        portfolio_returns = weighted_column_sum(price_panel.simple_returns(weights.index), weights)
+    else:
+        for idx, row in weighted_df.iterrows():
+            ticker = row['Ticker']
+            weight = row['Weight']
+            try:
+                history = get_price_history(ticker, period, price_panel)
+                if history.empty or 'Close' not in history.columns:
+                    continue
 
-            # Calculate returns for each asset in the portfolio
-            returns = history['Close'].pct_change(fill_method=None).dropna()
+                # Calculate returns for each asset in the portfolio
+                returns = history['Close'].pct_change(fill_method=None).dropna()
 
-            if returns.empty:
-                continue
+                if returns.empty:
+                    continue
 
-            if portfolio_returns is None:
-                portfolio_returns = returns * weight
-            else:
-                portfolio_returns = portfolio_returns.add(returns * weight, fill_value=0)
-        except Exception as e:
-            logging.error(f"Error fetching history for {ticker} in factor correlation: {e}")
-            continue
+                if portfolio_returns is None:
+                    portfolio_returns = returns * weight
+                else:
+                    portfolio_returns = portfolio_returns.add(returns * weight, fill_value=0)
+            except Exception as e:
+                logging.error(f"Error fetching history for {ticker} in factor correlation: {e}")
+                continue
 
     if portfolio_returns is None or portfolio_returns.empty:
         logging.error("Failed to compute portfolio returns for factor correlation.")
@@ -1167,6 +2977,53 @@ def calculate_portfolio_factor_correlations(weighted_df, etf_histories, period="
     return correlations.sort_values(ascending=False)
 
 # --- FIX: REPLACED ENTIRE FUNCTION TO USE PCA AND AVOID LINALGWARNING ---
+def _prepare_pure_return_features(X, characteristics, vif_threshold):
+    """Median-fills, log-compresses and de-degenerates `X` in place, then drops collinear columns (VIF)."""
+    for col in X.columns:
+        if X[col].isna().any():
+            median_val = X[col].median()
+            X[col] = X[col].fillna(median_val)
+        if X[col].min() >= 0 and X[col].quantile(0.75) > 1000: X[col] = np.log1p(X[col])
+        if X[col].var() < 1e-8: X[col] += np.random.normal(0, 1e-4, len(X))
+
+    # Use a more aggressive VIF check first
+    return check_multicollinearity(X, characteristics, vif_threshold)
+
+def _solve_pure_returns(X, Y, use_pca=True, pca_variance_threshold=0.95):
+    """
+    Ridge-on-PCA regression of every column of `Y` on the robust-scaled `X` in one multi-output solve.
+
+    Returns:
+        np.ndarray: (n_targets, n_features) coefficients in the original (unscaled) feature space, clipped to +-10.
+    """
+    scaler = RobustScaler()
+    X_scaled = scaler.fit_transform(X)
+
+    model = Ridge(alpha=1.0, solver='auto') # Use a robust solver
+
+    if use_pca:
+        # --- PCA IMPLEMENTATION ---
+        # Keep enough components to explain 95% of the variance
+        pca = PCA(n_components=pca_variance_threshold)
+        X_pca = pca.fit_transform(X_scaled)
+
+        # Regress on the uncorrelated principal components
+        model.fit(X_pca, Y)
+
+        # Transform coefficients back to the original feature space for interpretation
+        # This is the key step: model.coef_ are for PCA space, we need them for original features
+        original_space_coefs = pca.inverse_transform(model.coef_.reshape(Y.shape[1], -1))
+
+    else:
+        # Fallback to the old method if PCA is turned off
+        model.fit(X_scaled, Y)
+        original_space_coefs = model.coef_.reshape(Y.shape[1], -1)
+
+    # Unscale coefficients to be interpretable
+    scaler_scale = scaler.scale_
+    scaler_scale[scaler_scale < 1e-8] = 1e-8
+    return np.clip(original_space_coefs / scaler_scale, -10.0, 10.0)
+
 def calculate_pure_returns(df, characteristics, target='Return_252d', vif_threshold=5, use_pca=True, pca_variance_threshold=0.95):
     """
     Calculates pure factor returns using a robust cross-sectional regression.
@@ -1185,55 +3042,59 @@ def calculate_pure_returns(df, characteristics, target='Return_252d', vif_thresh
         logging.warning(f"Insufficient data for pure returns calculation: {len(y)} samples.")
         return pd.Series(dtype=float, name="PureReturns")
 
-    for col in X.columns:
-        if X[col].isna().any():
-            median_val = X[col].median()
-            X[col] = X[col].fillna(median_val)
-        if X[col].min() >= 0 and X[col].quantile(0.75) > 1000: X[col] = np.log1p(X[col])
-        if X[col].var() < 1e-8: X[col] += np.random.normal(0, 1e-4, len(X))
-
-    # Use a more aggressive VIF check first
-    final_characteristics = check_multicollinearity(X, valid_characteristics, vif_threshold)
+    final_characteristics = _prepare_pure_return_features(X, valid_characteristics, vif_threshold)
     if not final_characteristics:
         logging.warning("No valid characteristics left after VIF check.")
         return pd.Series(dtype=float, name="PureReturns")
 
-    X = X[final_characteristics]
-
-    scaler = RobustScaler()
-    X_scaled = scaler.fit_transform(X)
-
     try:
-        model = Ridge(alpha=1.0, solver='auto') # Use a robust solver
+        coefs = _solve_pure_returns(X[final_characteristics], y.to_frame(), use_pca, pca_variance_threshold)
+        return pd.Series(coefs[0], index=final_characteristics, name="PureReturns")
 
-        if use_pca:
-            # --- PCA IMPLEMENTATION ---
-            # Keep enough components to explain 95% of the variance
-            pca = PCA(n_components=pca_variance_threshold)
-            X_pca = pca.fit_transform(X_scaled)
-
-            # Regress on the uncorrelated principal components
-            model.fit(X_pca, y)
+    except Exception as e:
+        logging.error(f"Pure returns regression failed: {e}")
+        return pd.Series(dtype=float, name="PureReturns")
 
-            # Transform coefficients back to the original feature space for interpretation
-            # This is the key step: model.coef_ are for PCA space, we need them for original features
-            original_space_coefs = pca.inverse_transform(model.coef_.reshape(1, -1))[0]
+def calculate_pure_returns_multi(df, characteristics, targets, vif_threshold=5, use_pca=True, pca_variance_threshold=0.95):
+    """
+    Pure factor returns for several targets (e.g. one per horizon) at once. Targets that are valid on
+    the same rows share one pass of preprocessing (imputation, log1p, VIF, scaling, PCA) and one
+    multi-output Ridge solve; each column matches `calculate_pure_returns` for that target.
 
-        else:
-            # Fallback to the old method if PCA is turned off
-            model.fit(X_scaled, y)
-            original_space_coefs = model.coef_
+    Returns:
+        pd.DataFrame: characteristics x targets. A column is NaN where the characteristic was dropped for
+                      that target, and entirely NaN when the target has too little data.
+    """
+    targets = list(targets)
+    valid_characteristics = [col for col in characteristics if col in df.columns and pd.api.types.is_numeric_dtype(df[col])]
+    groups = {}
+    for target in targets:
+        if df.empty or target not in df.columns or df[target].isnull().all(): continue
+        valid_rows = pd.to_numeric(df[target], errors='coerce').notna()
+        groups.setdefault(valid_rows.to_numpy().tobytes(), (valid_rows, []))[1].append(target)
+
+    pure_returns = {}
+    for valid_rows, group_targets in groups.values():
+        Y = df.loc[valid_rows, group_targets].apply(pd.to_numeric, errors='coerce')
+        X = df.loc[valid_rows, valid_characteristics].copy().replace([np.inf, -np.inf], np.nan)
+        if X.empty or len(Y) < 20:
+            logging.warning(f"Insufficient data for pure returns calculation ({', '.join(group_targets)}): {len(Y)} samples.")
+            continue
 
-        # Unscale coefficients to be interpretable
-        scaler_scale = scaler.scale_
-        scaler_scale[scaler_scale < 1e-8] = 1e-8
-        unscaled_coefs = original_space_coefs / scaler_scale
+        final_characteristics = _prepare_pure_return_features(X, valid_characteristics, vif_threshold)
+        if not final_characteristics:
+            logging.warning(f"No valid characteristics left after VIF check ({', '.join(group_targets)}).")
+            continue
 
-        return pd.Series(unscaled_coefs, index=final_characteristics, name="PureReturns").clip(lower=-10.0, upper=10.0)
+        try:
+            coefs = _solve_pure_returns(X[final_characteristics], Y, use_pca, pca_variance_threshold)
+        except Exception as e:
+            logging.error(f"Pure returns regression failed ({', '.join(group_targets)}): {e}")
+            continue
+        for target, target_coefs in zip(group_targets, coefs):
+            pure_returns[target] = pd.Series(target_coefs, index=final_characteristics)
 
-    except Exception as e:
-        logging.error(f"Pure returns regression failed: {e}")
-        return pd.Series(dtype=float, name="PureReturns")
+    return pd.DataFrame(pure_returns, columns=targets, dtype=float)
 
 # --- This is the NEW function to add/replace the old one ---
 def aggregate_stability_and_set_weights(stability_results, all_metrics, reverse_metric_map):
@@ -1298,18 +3159,189 @@ def aggregate_stability_and_set_weights(stability_results, all_metrics, reverse_
 
     return final_weights_dict, agg_df
 
+# --- Rolling Ledoit-Wolf Covariance ---
+# calculate_correlation_matrix used to rebuild a DataFrame from the returns dict and refit
+# sklearn's LedoitWolf on every call. RollingCovariance aligns the universe's returns once and
+# keeps the window's column sums and cross-product matrix X'X; a new day or a different window
+# only adds and drops the rows that changed (O(N^2) per row), and the Ledoit-Wolf target and
+# shrinkage for any subset of names follow from those sums plus one pass over the window rows.
+COVARIANCE_REFRESH_ROWS = int(os.environ.get("TRADFI_COVARIANCE_REFRESH_ROWS", "1000"))  # rows added/dropped before the sums are rebuilt
+COVARIANCE_ENGINE_CACHE = 2  # engines kept in memory, by content of the returns
+
+def align_returns_matrix(returns):
+    """(index, tickers, values) of a returns dict or wide frame, on the sorted union of dates (NaN where missing)."""
+    if isinstance(returns, pd.DataFrame):
+        return returns.index, list(returns.columns), returns.to_numpy(dtype=float)
+    tickers = list(returns)
+    if not tickers:
+        return pd.Index([]), tickers, np.empty((0, 0))
+    series = [returns[t] for t in tickers]
+    stamps = [s.index.to_numpy() for s in series]
+    dates = np.sort(pd.unique(np.concatenate(stamps)))
+    values = np.full((len(dates), len(tickers)), np.nan)
+    for j, s in enumerate(series):
+        values[np.searchsorted(dates, stamps[j]), j] = s.to_numpy(dtype=float)
+    return pd.Index(dates), tickers, values
+
+class RollingCovariance:
+    """
+    Ledoit-Wolf covariance over the trailing `window` rows of an aligned return matrix, from
+    running sums. Missing returns count as 0.0 and names with no observation in the window are
+    left out, as in the DataFrame version this replaces; results match sklearn's LedoitWolf fit
+    on the same rows.
+    """
+    def __init__(self, index, tickers, values, window=90):
+        self.index = pd.Index(index)
+        self.tickers = list(tickers)
+        self._column = {t: j for j, t in enumerate(self.tickers)}
+        values = np.array(values, dtype=float).reshape(len(self.index), len(self.tickers))
+        self._observed = np.isfinite(values)
+        values[~self._observed] = 0.0
+        self._values = values
+        self._lock = threading.Lock()
+        self._recompute(window)
+
+    @classmethod
+    def from_returns(cls, returns, window=90):
+        return cls(*align_returns_matrix(returns), window=window)
+
+    @property
+    def window(self):
+        return self._end - self._start
+
+    def _recompute(self, window):
+        self._end = len(self._values)
+        self._start = max(self._end - max(int(window), 0), 0)
+        rows = self._values[self._start:self._end]
+        self._sum = rows.sum(axis=0)
+        self._cross = rows.T @ rows
+        self._count = self._observed[self._start:self._end].sum(axis=0)
+        self._moved = 0
+
+    def _shift(self, start, end, sign):
+        """Adds (sign=1) or removes (sign=-1) rows [start, end) from the running sums."""
+        rows = self._values[start:end]
+        self._sum += sign * rows.sum(axis=0)
+        self._cross += sign * (rows.T @ rows)
+        self._count += sign * self._observed[start:end].sum(axis=0)
+        self._moved += end - start
+
+    def _set_window(self, window):
+        start = max(self._end - max(int(window), 0), 0)
+        moved = abs(start - self._start)
+        if moved >= self._end - start or self._moved + moved > COVARIANCE_REFRESH_ROWS:
+            # Cheaper (or, after many updates, more accurate) to sum the new window from scratch
+            self._recompute(window)
+        elif start < self._start:
+            self._shift(start, self._start, 1)
+        elif start > self._start:
+            self._shift(self._start, start, -1)
+        self._start = start
+
+    def extend(self, index, values):
+        """Appends later days (rows of values, one column per ticker) and rolls the window forward."""
+        rows = np.array(values, dtype=float).reshape(-1, len(self.tickers))
+        observed = np.isfinite(rows)
+        rows[~observed] = 0.0
+        with self._lock:
+            window = self.window
+            self.index = self.index.append(pd.Index(index))
+            self._values = np.vstack([self._values, rows])
+            self._observed = np.vstack([self._observed, observed])
+            end = len(self._values)
+            self._shift(self._end, end, 1)
+            self._end = end
+            self._set_window(window)
+
+    def append(self, date, returns):
+        """Adds one day of returns (mapping or Series by ticker; missing names count as 0.0)."""
+        self.extend([date], pd.Series(returns, dtype=float).reindex(self.tickers).to_numpy()[None, :])
+
+    def continues(self, index, tickers, values):
+        """True if (index, tickers, values) is this engine's matrix followed by later days only."""
+        n = len(self.index)
+        if list(tickers) != self.tickers or len(index) < n or not pd.Index(index[:n]).equals(self.index):
+            return False
+        head = np.asarray(values[:n], dtype=float)
+        observed = np.isfinite(head)
+        return np.array_equal(observed, self._observed) and np.array_equal(np.where(observed, head, 0.0), self._values)
+
+    def observed_tickers(self, tickers, window):
+        """The `tickers` with at least one return in the trailing `window` rows."""
+        with self._lock:
+            self._set_window(window)
+            return [t for t in tickers if t in self._column and self._count[self._column[t]] > 0]
+
+    def ledoit_wolf(self, tickers, window=None):
+        """
+        Daily Ledoit-Wolf covariance of `tickers` over the trailing `window` rows (default: the current window).
+
+        Returns:
+            tuple: (covariance ndarray in `tickers` order, shrinkage intensity)
+        """
+        with self._lock:
+            if window is not None:
+                self._set_window(window)
+            cols = np.array([self._column[t] for t in tickers], dtype=int)
+            n, p = self.window, len(cols)
+            mean = self._sum[cols] / n
+            emp_cov = self._cross[np.ix_(cols, cols)] / n - np.outer(mean, mean)
+            centered = self._values[self._start:self._end, cols] - mean
+        # As sklearn's ledoit_wolf_shrinkage: target mu*I with mu = tr(S)/p, intensity beta/delta
+        trace = np.trace(emp_cov)
+        mu = trace / p
+        delta_ = np.sum(emp_cov ** 2)
+        beta_ = np.sum(np.sum(centered ** 2, axis=1) ** 2) / n
+        beta = (beta_ - delta_) / (p * n)
+        delta = (delta_ - 2.0 * mu * trace + p * mu ** 2) / p
+        beta = min(beta, delta)
+        shrinkage = 0.0 if beta == 0 else beta / delta
+        covariance = (1.0 - shrinkage) * emp_cov
+        covariance.flat[::p + 1] += shrinkage * mu
+        return covariance, shrinkage
+
+_covariance_engines = OrderedDict()  # content hash of the returns -> RollingCovariance
+_covariance_engines_lock = threading.Lock()
+
+def get_covariance_engine(returns, window=90):
+    """
+    RollingCovariance for a returns dict or wide frame, shared by content. When the returns only
+    add days to the most recently used engine's matrix, that engine is rolled forward instead of rebuilt.
+    """
+    key = content_hash(returns)
+    with _covariance_engines_lock:
+        engine = _covariance_engines.get(key)
+        if engine is not None:
+            _covariance_engines.move_to_end(key)
+            return engine
+        index, tickers, values = align_returns_matrix(returns)
+        latest_key, latest = next(reversed(_covariance_engines.items()), (None, None))
+        if latest is not None and latest.continues(index, tickers, values):
+            del _covariance_engines[latest_key]
+            n = len(latest.index)
+            latest.extend(index[n:], values[n:])
+            engine = latest
+        else:
+            engine = RollingCovariance(index, tickers, values, window)
+        _covariance_engines[key] = engine
+        while len(_covariance_engines) > COVARIANCE_ENGINE_CACHE:
+            _covariance_engines.popitem(last=False)
+        return engine
+
 # --- FIX: QUANTITATIVE ENHANCEMENT - USE LEDOIT-WOLF AND FIX `inplace` ---
 def calculate_correlation_matrix(tickers, returns_dict, window=90):
     """
     Calculates a robust, positive semi-definite correlation and covariance matrix.
 
     This function uses the Ledoit-Wolf shrinkage estimator for covariance, which is
-    well-suited for financial data (many assets, fewer time periods). It then
-    derives the correlation matrix and ensures it is positive semi-definite (PSD).
+    well-suited for financial data (many assets, fewer time periods), served from the
+    shared RollingCovariance engine for `returns_dict`. It then derives the correlation
+    matrix and ensures it is positive semi-definite (PSD).
 
     Args:
         tickers (list): The complete list of tickers for the final matrix shape.
-        returns_dict (dict): A dictionary where keys are tickers and values are pd.Series of returns.
+        returns_dict (dict): A dictionary where keys are tickers and values are pd.Series of returns,
+            or the equivalent wide DataFrame (dates x tickers).
         window (int): The number of recent trading days to use for the calculation.
 
     Returns:
@@ -1318,23 +3350,15 @@ def calculate_correlation_matrix(tickers, returns_dict, window=90):
             - pd.DataFrame: The annualized covariance matrix.
     """
     n = len(tickers)
-    if n == 0 or not returns_dict:
+    if n == 0 or len(returns_dict) == 0:
         # Return empty dataframes if there's nothing to process
         return pd.DataFrame(), pd.DataFrame()
 
-    # Create a DataFrame from the pre-calculated returns
-    returns_df = pd.DataFrame(returns_dict).reindex(columns=tickers)
-
-    # Take the recent window of returns
-    aligned_returns = returns_df.tail(window)
+    # Aligned returns and running window sums, shared across calls on the same returns
+    engine = get_covariance_engine(returns_dict, window)
 
-    # --- FIX: Replaced 'inplace=True' with direct reassignment for safety and clarity ---
-    # Drop columns (stocks) that have no data at all in the window
-    aligned_returns = aligned_returns.dropna(axis=1, how='all')
-    # Fill any remaining gaps (e.g., a single missing day) with 0.0
-    aligned_returns = aligned_returns.fillna(0.0)
-
-    valid_tickers = aligned_returns.columns.tolist()
+    # Drop stocks that have no data at all in the window (remaining gaps count as 0.0)
+    valid_tickers = engine.observed_tickers(tickers, window)
     if len(valid_tickers) < 2:
         # Not enough data to compute a matrix, return identity matrices
         identity = pd.DataFrame(np.eye(n), index=tickers, columns=tickers)
@@ -1342,11 +3366,10 @@ def calculate_correlation_matrix(tickers, returns_dict, window=90):
 
     try:
         # Use Ledoit-Wolf shrinkage to get a well-conditioned covariance matrix
-        lw = LedoitWolf()
-        lw.fit(aligned_returns)
+        lw_covariance, _ = engine.ledoit_wolf(valid_tickers, window)
 
         # Annualize the covariance matrix (daily variance * 252)
-        cov_matrix_values = lw.covariance_ * 252
+        cov_matrix_values = lw_covariance * 252
 
         # Build the full-sized covariance matrix, handling tickers that were dropped
         cov_matrix_full = pd.DataFrame(np.eye(n) * np.mean(np.diag(cov_matrix_values)), index=tickers, columns=tickers)
@@ -1362,7 +3385,7 @@ def calculate_correlation_matrix(tickers, returns_dict, window=90):
         corr_matrix_full.loc[valid_tickers, valid_tickers] = corr_matrix_values
 
         # Ensure the final correlation matrix is positive semi-definite (PSD) for stability
-        final_corr = pd.DataFrame(nearest_psd_matrix(corr_matrix_full.values), index=tickers, columns=tickers)
+        final_corr = pd.DataFrame(nearest_psd_matrix(corr_matrix_full.values, method='higham'), index=tickers, columns=tickers)
 
     except Exception as e:
         logging.error(f"Ledoit-Wolf estimation failed: {e}. Falling back to identity matrix.")
@@ -1371,10 +3394,368 @@ def calculate_correlation_matrix(tickers, returns_dict, window=90):
 
     return final_corr, cov_matrix_full
 
+# --- Factor Risk Model ---
+# A dense covariance of the whole screened universe (1,500 x 1,500) is too large to fit and to
+# optimize against. FactorRiskModel regresses every name on the ETF factor returns (etf_list:
+# style and sector ETFs) and keeps the covariance as loadings B (N x K), factor covariance F
+# (K x K) and specific variances d, i.e. B F B' + diag(d); products and portfolio variance cost
+# O(N*K) and the N x N matrix is never formed. The screen itself optimizes the top names against
+# their dense covariance, so the model is not a pipeline stage: build it on demand with
+# `build_factor_risk_model` and hand it to `calculate_weights` / `efficient_frontier`.
+RISK_MODEL_FACTORS = etf_list
+RISK_MODEL_WINDOW = int(os.environ.get("TRADFI_RISK_MODEL_WINDOW", "252"))  # trailing days the loadings are fitted on
+RISK_MODEL_MIN_OBS = 60  # below this many days a name gets zero loadings and its plain variance
+
+def regress_on_factors(returns, factor_returns, min_obs=RISK_MODEL_MIN_OBS):
+    """
+    OLS (with intercept) of every column of `returns` on `factor_returns`, each name over its own
+    observed days, solved for all names at once from per-name normal equations.
+
+    Returns:
+        tuple: (loadings DataFrame names x factors, daily residual variance Series (ddof=0),
+               observations per name). Names with fewer than max(min_obs, K + 2) days get zero
+               loadings, so their residual variance is their plain variance.
+    """
+    common = returns.index.intersection(factor_returns.index)
+    factors = factor_returns.loc[common].to_numpy(dtype=float)
+    complete = np.isfinite(factors).all(axis=1)
+    X = np.column_stack([np.ones(complete.sum()), factors[complete]])
+    Y = returns.loc[common].to_numpy(dtype=float)[complete]
+    observed = np.isfinite(Y)
+    Y = np.where(observed, Y, 0.0)
+    n_obs = observed.sum(axis=0)
+    k = X.shape[1]
+
+    # Per-name X'X over that name's days is mask' (X outer X): one (N x T) @ (T x k^2) product
+    gram = (observed.T.astype(float) @ (X[:, :, None] * X[:, None, :]).reshape(len(X), -1)).reshape(-1, k, k)
+    moment = Y.T @ X
+    coef = np.zeros((Y.shape[1], k))
+    fitted = n_obs >= max(min_obs, k + 1)
+    if fitted.any():
+        coef[fitted] = (np.linalg.pinv(gram[fitted], hermitian=True) @ moment[fitted][:, :, None])[:, :, 0]
+    coef[~fitted, 0] = Y[:, ~fitted].sum(axis=0) / np.maximum(n_obs[~fitted], 1)
+
+    residuals = np.where(observed, Y - X @ coef.T, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        residual_var = (residuals ** 2).sum(axis=0) / n_obs
+    columns = returns.columns
+    return (pd.DataFrame(coef[:, 1:], index=columns, columns=factor_returns.columns),
+            pd.Series(residual_var, index=columns, name='IdioVariance'), pd.Series(n_obs, index=columns))
+
+class FactorRiskModel:
+    """
+    Annualized covariance B F B' + diag(d) of N names on K factors, held as loadings B (N x K),
+    factor covariance F (K x K) and specific variances d (N). `covariance()` forms the dense
+    matrix and is meant for small subsets only.
+    """
+    def __init__(self, loadings, factor_cov, specific_var):
+        self.tickers = list(loadings.index)
+        self.factors = list(loadings.columns)
+        self.loadings = loadings.to_numpy(dtype=float)
+        self.factor_cov = pd.DataFrame(factor_cov).loc[self.factors, self.factors].to_numpy(dtype=float)
+        self.specific_var = pd.Series(specific_var).reindex(self.tickers).to_numpy(dtype=float)
+        self._position = {t: i for i, t in enumerate(self.tickers)}
+
+    @classmethod
+    def fit(cls, returns, factor_returns, window=RISK_MODEL_WINDOW, min_obs=RISK_MODEL_MIN_OBS):
+        """
+        Fits the model on the last `window` days the factors were all observed.
+
+        Args:
+            returns (pd.DataFrame): Daily returns, dates x tickers (NaN where a name has no data).
+            factor_returns (pd.DataFrame): Daily factor returns, dates x factors.
+        """
+        factor_returns = factor_returns.replace([np.inf, -np.inf], np.nan).dropna()
+        factor_returns = factor_returns.loc[factor_returns.index.intersection(returns.index)].tail(window)
+        loadings, residual_var, _ = regress_on_factors(returns.replace([np.inf, -np.inf], np.nan), factor_returns, min_obs)
+        specific_var = residual_var * 252
+        specific_var = specific_var.fillna(specific_var.median() if specific_var.notna().any() else 0.0)
+        return cls(loadings, factor_returns.cov() * 252, specific_var)
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def subset(self, tickers):
+        """The model restricted to `tickers` (in that order)."""
+        rows = [self._position[t] for t in tickers]
+        return FactorRiskModel(pd.DataFrame(self.loadings[rows], index=list(tickers), columns=self.factors),
+                               pd.DataFrame(self.factor_cov, index=self.factors, columns=self.factors),
+                               pd.Series(self.specific_var[rows], index=list(tickers)))
+
+    def factor_root(self):
+        """N x K matrix L with L L' = B F B' (F's negative eigenvalues, if any, clipped to 0)."""
+        eigvals, eigvecs = np.linalg.eigh(self.factor_cov)
+        return self.loadings @ (eigvecs * np.sqrt(np.clip(eigvals, 0.0, None)))
+
+    def matvec(self, w):
+        """Covariance times `w` (a vector or N x m matrix) in O(N*K)."""
+        w = np.asarray(w, dtype=float)
+        spec = self.specific_var if w.ndim == 1 else self.specific_var[:, None]
+        return self.loadings @ (self.factor_cov @ (self.loadings.T @ w)) + spec * w
+
+    def variance(self, w):
+        """Annualized portfolio variance w' (B F B' + diag(d)) w."""
+        w = np.asarray(w, dtype=float)
+        exposure = self.loadings.T @ w
+        return float(exposure @ self.factor_cov @ exposure + self.specific_var @ w ** 2)
+
+    def volatility(self, w):
+        return math.sqrt(max(self.variance(w), 0.0))
+
+    def variance_expression(self, w):
+        """The portfolio variance of cvxpy variable `w` as sums of squares (no N x N quad_form)."""
+        return cp.sum_squares(self.factor_root().T @ w) + cp.sum_squares(cp.multiply(np.sqrt(self.specific_var), w))
+
+    def covariance(self, tickers=None):
+        """Dense covariance DataFrame of `tickers` (default: all names)."""
+        model = self if tickers is None else self.subset(tickers)
+        dense = model.loadings @ model.factor_cov @ model.loadings.T + np.diag(model.specific_var)
+        return pd.DataFrame(dense, index=model.tickers, columns=model.tickers)
+
+def build_factor_risk_model(returns_dict, etf_histories, tickers=None, window=RISK_MODEL_WINDOW):
+    """
+    FactorRiskModel of `tickers` (default: every name in `returns_dict`, a dict of return series or
+    the wide frame) on the daily returns of the RISK_MODEL_FACTORS ETFs available in `etf_histories`.
+    """
+    index, names, values = align_returns_matrix(returns_dict)
+    returns = pd.DataFrame(values, index=index, columns=names)
+    if tickers is not None:
+        returns = returns.reindex(columns=list(tickers))
+    factor_returns = pd.DataFrame({etf: etf_histories[etf]['Close'].pct_change() for etf in RISK_MODEL_FACTORS
+                                   if etf in etf_histories and not etf_histories[etf].empty})
+    return FactorRiskModel.fit(returns, factor_returns, window=window)
+
+# --- Portfolio Optimizer ---
+# calculate_weights used to build a fresh cp.Problem, and re-canonicalize its quad_form, on every
+# call. PortfolioOptimizer compiles the long-only problem once per universe and method with DPP
+# parameters (expected returns, the risk factor scaled by sqrt(gamma), the weight cap), so a
+# re-solve only substitutes parameter values and SCS warm-starts from the previous solution.
+# The risk term is ||sqrt(gamma) L'w||^2 + ||sqrt(gamma d) * w||^2 for Sigma = L L' + diag(d):
+# L is a FactorRiskModel's factor root, or the square root of a dense covariance with d = 0.
+OPTIMIZER_CACHE_SIZE = 8  # compiled problems kept, by (universe, method, rank)
+OPTIMIZER_SOLVER = cp.SCS
+LOG_LOG_SHARPE_GAMMA = 0.5  # Risk aversion parameter
+LOG_LOG_SHARPE_MAX_WEIGHT = 0.15  # Max 15% in any single stock
+FRONTIER_GAMMAS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+FRONTIER_CAPS = [0.10, 0.15, 0.25, 0.40]
+FRONTIER_WORKERS = int(os.environ.get("TRADFI_FRONTIER_WORKERS", "1"))
+
+def covariance_root(cov_matrix):
+    """N x N matrix L with L L' equal to the PSD-corrected `cov_matrix`."""
+    eigvals, eigvecs = np.linalg.eigh(nearest_psd_matrix(cov_matrix))
+    return eigvecs * np.sqrt(np.clip(eigvals, 0.0, None))
+
+class PortfolioOptimizer:
+    """
+    Long-only weight problem over one universe, compiled once and re-solved for new inputs.
+
+    method='log_log_sharpe': maximize mu'w - gamma w'(L L' + diag(d))w
+        s.t. sum(w) = 1, 0 <= w <= cap, for a risk factor L with `rank` columns.
+    method='alpha_orthogonal': maximize mu'w s.t. sum(w) = 1, w >= 0, B'w = 0 for `rank` exposures B.
+
+    `stats` keeps the one-off compile (canonicalization) time apart from the per-solve parameter
+    updates and the solver's own time.
+    """
+    def __init__(self, tickers, method="log_log_sharpe", rank=1):
+        self.tickers, self.method, self.rank = list(tickers), method, rank
+        n = len(self.tickers)
+        self.w = cp.Variable(n)
+        self.mu = cp.Parameter(n)
+        constraints = [cp.sum(self.w) == 1, self.w >= 0]
+        if method == "log_log_sharpe":
+            self.risk_factor = cp.Parameter((rank, n))  # sqrt(gamma) L'
+            self.specific = cp.Parameter(n, nonneg=True)  # sqrt(gamma d)
+            self.cap = cp.Parameter(nonneg=True)
+            risk = cp.sum_squares(self.risk_factor @ self.w) + cp.sum_squares(cp.multiply(self.specific, self.w))
+            objective = cp.Maximize(self.mu @ self.w - risk)
+            constraints.append(self.w <= self.cap)
+        elif method == "alpha_orthogonal":
+            self.exposures = cp.Parameter((rank, n))
+            objective = cp.Maximize(self.mu @ self.w)
+            constraints.append(self.exposures @ self.w == 0)
+        else:
+            raise ValueError(f"Unknown optimizer method: {method}")
+        self.problem = cp.Problem(objective, constraints)
+        self._lock = threading.Lock()
+        self.stats = {"compile_s": 0.0, "solves": 0, "update_s": 0.0, "solve_s": 0.0, "failed": 0}
+
+    def _solve(self):
+        """Solves with the current parameter values; normalized weights, or None if the solve failed."""
+        first = self.stats["solves"] == 0
+        try:
+            self.problem.solve(solver=OPTIMIZER_SOLVER, warm_start=True)
+        finally:
+            self.stats["compile_s" if first else "update_s"] += self.problem.compilation_time or 0.0
+            self.stats["solves"] += 1
+        if self.problem.solver_stats is not None:
+            self.stats["solve_s"] += self.problem.solver_stats.solve_time or 0.0
+        w = self.w.value
+        if w is None or w.sum() <= 1e-6:
+            self.stats["failed"] += 1
+            return None
+        return pd.Series(w / np.sum(w), index=self.tickers)
+
+    def solve(self, mu, risk_root=None, specific_var=None, gamma=LOG_LOG_SHARPE_GAMMA, cap=LOG_LOG_SHARPE_MAX_WEIGHT, exposures=None):
+        """
+        Weights for one set of inputs.
+
+        Args:
+            mu (array-like): Expected (annualized) returns, in `tickers` order.
+            risk_root (array-like): N x rank factor L of the covariance (log_log_sharpe).
+            specific_var (array-like): Specific variances d (log_log_sharpe; default 0).
+            gamma (float): Risk aversion.
+            cap (float): Maximum weight per name (log_log_sharpe).
+            exposures (array-like): N x rank exposures that must net to zero (alpha_orthogonal).
+
+        Returns:
+            pd.Series or None: Weights summing to 1, or None if the solver found no solution.
+        """
+        with self._lock:
+            self.mu.value = np.asarray(mu, dtype=float)
+            if self.method == "log_log_sharpe":
+                self.risk_factor.value = math.sqrt(gamma) * np.asarray(risk_root, dtype=float).T
+                specific_var = np.zeros(len(self.tickers)) if specific_var is None else np.asarray(specific_var, dtype=float)
+                self.specific.value = np.sqrt(gamma * np.clip(specific_var, 0.0, None))
+                self.cap.value = cap
+            else:
+                self.exposures.value = np.asarray(exposures, dtype=float).T
+            return self._solve()
+
+    def sweep(self, mu, risk_root, specific_var=None, gammas=FRONTIER_GAMMAS, cap=LOG_LOG_SHARPE_MAX_WEIGHT):
+        """
+        Weights along the efficient frontier: one warm-started solve per risk aversion in `gammas`.
+
+        Returns:
+            pd.DataFrame: gammas x tickers (NaN rows where a solve failed).
+        """
+        rows = {}
+        for gamma in gammas:
+            weights = self.solve(mu, risk_root, specific_var, gamma=gamma, cap=cap)
+            rows[gamma] = weights if weights is not None else pd.Series(np.nan, index=self.tickers)
+        return pd.DataFrame(rows).T.rename_axis('gamma')
+
+    def report(self):
+        return {"method": self.method, "n_assets": len(self.tickers), "rank": self.rank, **self.stats}
+
+_portfolio_optimizers = OrderedDict()  # (tickers, method, rank) -> PortfolioOptimizer
+_portfolio_optimizers_lock = threading.Lock()
+
+def get_portfolio_optimizer(tickers, method="log_log_sharpe", rank=1):
+    """The compiled PortfolioOptimizer for this universe and method (LRU of OPTIMIZER_CACHE_SIZE)."""
+    key = (tuple(tickers), method, int(rank))
+    with _portfolio_optimizers_lock:
+        optimizer = _portfolio_optimizers.get(key)
+        if optimizer is None:
+            optimizer = _portfolio_optimizers[key] = PortfolioOptimizer(tickers, method, int(rank))
+            while len(_portfolio_optimizers) > OPTIMIZER_CACHE_SIZE:
+                _portfolio_optimizers.popitem(last=False)
+        else:
+            _portfolio_optimizers.move_to_end(key)
+        return optimizer
+
+def optimizer_report():
+    """Compile and solve times of the cached optimizers, one row per compiled problem."""
+    with _portfolio_optimizers_lock:
+        return pd.DataFrame([optimizer.report() for optimizer in _portfolio_optimizers.values()])
+
+def log_log_sharpe_inputs(returns_df, cov_matrix=None, risk_model=None):
+    """
+    (expected annualized returns, risk factor L, specific variances d or None) for the
+    log_log_sharpe problem: from a FactorRiskModel when given, else from the dense `cov_matrix`
+    (default: the sample covariance of `returns_df`).
+    """
+    mu = (returns_df.mean() * 252).fillna(0.0)  # names without returns in the window expect nothing
+    if risk_model is not None:
+        model = risk_model.subset(returns_df.columns)
+        return mu, model.factor_root(), model.specific_var
+    if cov_matrix is None:
+        cov_matrix = returns_df.cov() * 252
+    return mu, covariance_root(cov_matrix), None
+
+# --- Efficient Frontier ---
+# Trying other risk aversions or position caps used to mean editing calculate_weights. The
+# frontier solves the log_log_sharpe problem over a gamma x cap grid in one call: the risk factor
+# is computed once, each cap's gammas run as one warm-started sweep on the cached compiled
+# problem, and return, volatility, Sharpe and turnover come from one vectorized pass over the
+# grid's weights. With workers > 1 the caps are split across forked processes.
+def _init_frontier_worker(inputs):
+    global _frontier_inputs
+    _frontier_inputs = inputs
+
+def _frontier_task(caps):
+    """Worker body: one gamma sweep per cap on the process's compiled optimizer."""
+    tickers, mu, risk_root, specific_var, gammas = _frontier_inputs
+    optimizer = get_portfolio_optimizer(tickers, "log_log_sharpe", risk_root.shape[1])
+    return [(cap, optimizer.sweep(mu, risk_root, specific_var, gammas, cap)) for cap in caps]
+
+def efficient_frontier(returns_df, cov_matrix=None, risk_model=None, gammas=FRONTIER_GAMMAS, caps=FRONTIER_CAPS,
+                       current_weights=None, risk_free_rate=0.04, workers=FRONTIER_WORKERS):
+    """
+    log_log_sharpe weights and their risk/return for every (gamma, cap) pair.
+
+    Args:
+        returns_df (pd.DataFrame): Daily returns of the universe (dates x tickers).
+        cov_matrix (array-like): Dense annualized covariance, used when there is no `risk_model`.
+        risk_model (FactorRiskModel): Factor covariance covering the tickers.
+        current_weights (pd.Series): Holdings turnover is measured against (NaN without).
+        workers (int): Processes to spread the caps over (1 solves in-process).
+
+    Returns:
+        tuple: (frontier DataFrame with gamma, cap, expected_return, volatility, sharpe, turnover,
+               max_weight and n_holdings per grid point; weights DataFrame indexed by (gamma, cap)).
+               Grid points the solver could not satisfy (e.g. cap * N < 1) have NaN weights.
+    """
+    tickers = list(returns_df.columns)
+    mu, risk_root, specific_var = log_log_sharpe_inputs(returns_df, cov_matrix, risk_model)
+    inputs = (tickers, mu.values, risk_root, specific_var, list(gammas))
+    chunks = [list(chunk) for chunk in np.array_split(np.array(caps, dtype=float), max(min(workers or 1, len(caps)), 1))]
+    chunk_results = None
+    if len(chunks) > 1 and process_pools_enabled():
+        try:
+            with _process_pool(len(chunks), initializer=_init_frontier_worker, initargs=(inputs,)) as executor:
+                chunk_results = list(executor.map(_frontier_task, chunks))
+        except Exception as e:
+            logging.error(f"Frontier process pool failed, running in-process: {e}")
+    if chunk_results is None:
+        _init_frontier_worker(inputs)
+        chunk_results = [_frontier_task(chunk) for chunk in chunks]
+
+    weights = pd.concat([sweep.set_index(pd.MultiIndex.from_product([sweep.index, [cap]], names=['gamma', 'cap']))
+                         for results in chunk_results for cap, sweep in results]).sort_index()
+    W = weights.to_numpy()
+    variance = ((W @ risk_root) ** 2).sum(axis=1)
+    if specific_var is not None:
+        variance += (W ** 2) @ specific_var
+    frontier = weights.index.to_frame(index=False)
+    frontier['expected_return'] = W @ mu.values
+    frontier['volatility'] = np.sqrt(variance)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frontier['sharpe'] = (frontier['expected_return'] - risk_free_rate) / frontier['volatility']
+    frontier['max_weight'] = W.max(axis=1)
+    frontier['n_holdings'] = (W > 1e-4).sum(axis=1)
+    return frontier_turnover(frontier, weights, current_weights), weights
+
+def frontier_turnover(frontier, weights, current_weights=None):
+    """`frontier` with its turnover column set: half the absolute weight change from `current_weights` (NaN without)."""
+    frontier = frontier.copy()
+    turnover = np.full(len(frontier), np.nan)
+    if current_weights is not None:
+        current = pd.Series(current_weights, dtype=float).reindex(weights.columns).fillna(0.0).to_numpy()
+        turnover = 0.5 * np.abs(weights.to_numpy() - current).sum(axis=1)  # NaN where the point has no weights
+    if 'turnover' in frontier:
+        frontier['turnover'] = turnover
+    else:
+        frontier.insert(frontier.columns.get_loc('sharpe') + 1, 'turnover', turnover)
+    return frontier
+
 # --- FIX: QUANTITATIVE ENHANCEMENT - ADD DIVERSIFICATION CONSTRAINT ---
-def calculate_weights(returns_df, method="equal", cov_matrix=None, factor_returns=None, betas=None):
+def calculate_weights(returns_df, method="equal", cov_matrix=None, factor_returns=None, betas=None, risk_model=None,
+                      gamma=LOG_LOG_SHARPE_GAMMA, max_weight=LOG_LOG_SHARPE_MAX_WEIGHT):
     """
     Calculate portfolio weights with various methods, including FMP and Alpha-Orthogonal.
+    With a FactorRiskModel covering the names, `log_log_sharpe` penalizes the model's variance
+    instead of a dense `cov_matrix`, so it scales to the full universe. `gamma` (risk aversion)
+    and `max_weight` (per-name cap) apply to `log_log_sharpe`; see `efficient_frontier` for a grid.
     """
     n_assets = len(returns_df.columns)
     tickers = returns_df.columns
@@ -1389,31 +3770,10 @@ def calculate_weights(returns_df, method="equal", cov_matrix=None, factor_return
             return inv_vols / inv_vols.sum()
 
         elif method == "log_log_sharpe":
-            mu = returns_df.mean() * 252
-            if cov_matrix is None:
-                cov_matrix = returns_df.cov() * 252
-            cov_matrix = nearest_psd_matrix(cov_matrix)
-            w = cp.Variable(n_assets)
-
-            # --- FIX: Add risk aversion and weight constraints ---
-            gamma = cp.Parameter(nonneg=True, value=0.5) # Risk aversion parameter
-            max_weight = 0.15 # Max 15% in any single stock
-
-            objective = cp.Maximize(mu.values @ w - gamma * cp.quad_form(w, cov_matrix))
-            constraints = [
-                cp.sum(w) == 1,
-                w >= 0,
-                w <= max_weight # Diversification constraint
-            ]
-            # --- END FIX ---
-
-            problem = cp.Problem(objective, constraints)
-            problem.solve(solver=cp.SCS)
-
-            if w.value is not None and w.value.sum() > 1e-6:
-                 return pd.Series(w.value / np.sum(w.value), index=tickers)
-            else:
-                 return pd.Series(np.ones(n_assets) / n_assets, index=tickers)
+            mu, risk_root, specific_var = log_log_sharpe_inputs(returns_df, cov_matrix, risk_model)
+            optimizer = get_portfolio_optimizer(tickers, "log_log_sharpe", risk_root.shape[1])
+            weights = optimizer.solve(mu.values, risk_root, specific_var, gamma=gamma, cap=max_weight)
+            return weights if weights is not None else pd.Series(np.ones(n_assets) / n_assets, index=tickers)
 
 
         elif method == "fmp":
@@ -1427,16 +3787,9 @@ def calculate_weights(returns_df, method="equal", cov_matrix=None, factor_return
                 raise ValueError("Betas and returns required for alpha_orthogonal.")
 
             alpha = returns_df.mean() * 252
-            w = cp.Variable(n_assets)
-            objective = cp.Maximize(alpha.values @ w)
-            constraints = [cp.sum(w) == 1, w >= 0, betas.values.T @ w == 0]
-            problem = cp.Problem(objective, constraints)
-            problem.solve(solver=cp.SCS)
-
-            if w.value is not None and w.value.sum() > 1e-6:
-                return pd.Series(w.value / np.sum(w.value), index=tickers)
-            else:
-                return pd.Series(np.ones(n_assets) / n_assets, index=tickers)
+            optimizer = get_portfolio_optimizer(tickers, "alpha_orthogonal", betas.shape[1])
+            weights = optimizer.solve(alpha.values, exposures=betas.values)
+            return weights if weights is not None else pd.Series(np.ones(n_assets) / n_assets, index=tickers)
 
         else:
             raise ValueError(f"Unknown weighting method: {method}")
@@ -1525,6 +3878,11 @@ def get_daily_risk_range(history):
     pct_change = (last_close - prev_close) / prev_close * 100
     return risk_low, risk_high, last_close, pct_change
 
+@st.cache_data(ttl=900)
+def fetch_intraday_history(ticker_symbol, period="60d", interval="1h"):
+    """Intraday bars, cached for 15 minutes so dashboard reruns don't refetch them."""
+    return get_data_provider().intraday(ticker_symbol, period=period, interval=interval)
+
 def display_momentum_bar(ticker_symbol, history):
     st.subheader("Dual-Scale Momentum (14-Day | 14-Hour)")
     rsi_14d = 50.0
@@ -1540,7 +3898,7 @@ def display_momentum_bar(ticker_symbol, history):
 
     rsi_14h, has_hourly = 50.0, False
     try:
-        hourly_hist = yf.Ticker(ticker_symbol).history(period="60d", interval="1h", auto_adjust=True)
+        hourly_hist = fetch_intraday_history(ticker_symbol, period="60d", interval="1h")
         if not hourly_hist.empty and len(hourly_hist) >= 15:
             delta_h = hourly_hist['Close'].diff()
             gain_h = (delta_h.where(delta_h > 0, 0)).rolling(window=14).mean()
@@ -1562,19 +3920,23 @@ def display_momentum_bar(ticker_symbol, history):
         col2.info("Hourly data not available.")
 
     bar_color = "#04AA6D" if rsi_14d > 50 else "#FA3F46"
-    fig = go.Figure()
-    fig.add_trace(go.Bar(y=['RSI'], x=[rsi_14d], orientation='h', marker_color=bar_color, marker_line_width=0, width=0.5, hoverinfo='none'))
-    fig.add_shape(type="line", x0=50, y0=-0.5, x1=50, y1=0.5, line=dict(color="rgba(255, 255, 255, 0.3)", width=1))
-    fig.add_shape(type="line", x0=35, y0=-0.5, x1=35, y1=0.5, line=dict(color="rgba(255, 255, 255, 0.3)", width=1, dash="dash"))
-    fig.add_shape(type="line", x0=65, y0=-0.5, x1=65, y1=0.5, line=dict(color="rgba(255, 255, 255, 0.3)", width=1, dash="dash"))
+    # Shapes go into the layout in one pass; per-call add_shape/update_layout validation dominated reruns
+    shapes = [
+        dict(type="line", x0=50, y0=-0.5, x1=50, y1=0.5, line=dict(color="rgba(255, 255, 255, 0.3)", width=1)),
+        dict(type="line", x0=35, y0=-0.5, x1=35, y1=0.5, line=dict(color="rgba(255, 255, 255, 0.3)", width=1, dash="dash")),
+        dict(type="line", x0=65, y0=-0.5, x1=65, y1=0.5, line=dict(color="rgba(255, 255, 255, 0.3)", width=1, dash="dash")),
+    ]
     if has_hourly:
-        fig.add_shape(type="line", x0=rsi_14h, y0=-0.5, x1=rsi_14h, y1=0.5, line=dict(color="white", width=3))
-    fig.update_layout(xaxis=dict(range=[0, 100], showticklabels=False, showgrid=False, zeroline=False), yaxis=dict(showticklabels=False, showgrid=False, zeroline=False), showlegend=False, plot_bgcolor='rgba(68, 68, 68, 0.5)', paper_bgcolor='rgba(0,0,0,0)', height=40, margin=dict(l=0, r=0, t=0, b=0))
+        shapes.append(dict(type="line", x0=rsi_14h, y0=-0.5, x1=rsi_14h, y1=0.5, line=dict(color="white", width=3)))
+    fig = go.Figure(
+        go.Bar(y=['RSI'], x=[rsi_14d], orientation='h', marker_color=bar_color, marker_line_width=0, width=0.5, hoverinfo='none'),
+        layout=dict(shapes=shapes, xaxis=dict(range=[0, 100], showticklabels=False, showgrid=False, zeroline=False), yaxis=dict(showticklabels=False, showgrid=False, zeroline=False), showlegend=False, plot_bgcolor='rgba(68, 68, 68, 0.5)', paper_bgcolor='rgba(0,0,0,0)', height=40, margin=dict(l=0, r=0, t=0, b=0)),
+    )
     st.plotly_chart(fig, use_container_width=True)
     st.caption("Bar shows 14-day trend; white marker shows 14-hour pressure; dashed lines at RSI 35 and 65.")
 # --- START: Individual Stock Dashboard & Financials Functions ---
 
-def calculate_portfolio_relative_z_score(weighted_df, etf_histories, best_etf, period="3y", window=252, min_window=200):
+def calculate_portfolio_relative_z_score(weighted_df, etf_histories, best_etf, period="3y", window=252, min_window=200, price_panel=None):
     """Calculates the relative Z-score of the entire portfolio against its best-correlated ETF."""
     portfolio_prices = None
 
@@ -1584,26 +3946,33 @@ def calculate_portfolio_relative_z_score(weighted_df, etf_histories, best_etf, p
         return np.nan, best_etf
 
     # Create a weighted, rebased price series for the portfolio
-    for idx, row in weighted_df.iterrows():
-        ticker = row['Ticker']
-        weight = row['Weight']
-        try:
-            history = yf.Ticker(ticker).history(period=period, auto_adjust=True, interval="1d").tz_localize(None)
-            if history.empty or 'Close' not in history.columns or len(history) < 2:
-                continue
+    weights = weighted_df.set_index('Ticker')['Weight']
+    if price_panel is not None and all(ticker in price_panel for ticker in weights.index):
+        closes = price_panel.closes(weights.index)
+        closes = closes.loc[:, closes.count() >= 2]
+        if not closes.empty:
+            portfolio_prices = weighted_column_sum(100 * closes / closes.bfill().iloc[0], weights.reindex(closes.columns))
+    else:
+        for idx, row in weighted_df.iterrows():
+            ticker = row['Ticker']
+            weight = row['Weight']
+            try:
+                history = get_price_history(ticker, period, price_panel)
+                if history.empty or 'Close' not in history.columns or len(history) < 2:
+                    continue
 
-            # Rebase the price series to start at 100 to normalize scales
-            rebased_prices = 100 * (history['Close'] / history['Close'].iloc[0])
+                # Rebase the price series to start at 100 to normalize scales
+                rebased_prices = 100 * (history['Close'] / history['Close'].iloc[0])
 
-            if portfolio_prices is None:
-                portfolio_prices = rebased_prices * weight
-            else:
-                # Align and add the weighted series
-                portfolio_prices = portfolio_prices.add(rebased_prices * weight, fill_value=0)
+                if portfolio_prices is None:
+                    portfolio_prices = rebased_prices * weight
+                else:
+                    # Align and add the weighted series
+                    portfolio_prices = portfolio_prices.add(rebased_prices * weight, fill_value=0)
 
-        except Exception as e:
-            logging.error(f"Error getting history for {ticker} in portfolio Z-score calc: {e}")
-            continue
+            except Exception as e:
+                logging.error(f"Error getting history for {ticker} in portfolio Z-score calc: {e}")
+                continue
 
     if portfolio_prices is None or portfolio_prices.empty:
         logging.error("Failed to construct portfolio price series for Z-score calculation.")
@@ -1702,11 +4071,11 @@ def display_signal_sigma_checklist(stock_data, daily_history):
 
 def valuation_wizard(ticker_symbol, revenue_growth_rate, gross_margin_rate, op_ex_as_percent_of_sales, share_count_growth_rate, ev_to_ebitda_multiple, tax_rate):
     try:
-        ticker = yf.Ticker(ticker_symbol)
-        info = ticker.info
-        financials = ticker.financials
-        balance_sheet = ticker.balance_sheet
-        cashflow = ticker.cashflow
+        provider = get_data_provider()
+        info = provider.info(ticker_symbol)
+        financials = provider.statements(ticker_symbol, "financials")
+        balance_sheet = provider.statements(ticker_symbol, "balancesheet")
+        cashflow = provider.statements(ticker_symbol, "cashflow")
         last_revenue = financials.loc['Total Revenue'].iloc[0] if 'Total Revenue' in financials.index else 0
         last_ebitda = info.get('ebitda') or (financials.loc['EBIT'].iloc[0] + cashflow.loc['Depreciation And Amortization'].iloc[0])
         last_interest_expense = financials.loc['Interest Expense'].iloc[0] if 'Interest Expense' in financials.index else 0
@@ -1745,13 +4114,16 @@ def valuation_wizard(ticker_symbol, revenue_growth_rate, gross_margin_rate, op_e
     except Exception as e:
         return np.nan, np.nan, f"An error occurred: {e}"
 
+@st.cache_data(ttl=3600)
+def fetch_valuation_inputs(ticker_symbol):
+    """3y history, income statement and info for the valuation wizard, cached for an hour."""
+    provider = get_data_provider()
+    return provider.history(ticker_symbol, period="3y"), provider.statements(ticker_symbol, "financials"), provider.info(ticker_symbol)
+
 def display_valuation_wizard(ticker_symbol):
     st.subheader("Valuation Wizard (5-Year Forecast)")
     try:
-        ticker = yf.Ticker(ticker_symbol)
-        history = ticker.history(period="3y")
-        financials = ticker.financials
-        info = ticker.info
+        history, financials, info = fetch_valuation_inputs(ticker_symbol)
         rev_g = (financials.loc['Total Revenue'].pct_change(periods=-1).mean()) * 100 if 'Total Revenue' in financials.index else 5.0
         gm = (financials.loc['Gross Profit'].iloc[0] / financials.loc['Total Revenue'].iloc[0]) * 100 if 'Gross Profit' in financials.index and 'Total Revenue' in financials.index and financials.loc['Total Revenue'].iloc[0] > 0 else 50.0
         op_inc = financials.loc['Operating Income'].iloc[0] if 'Operating Income' in financials.index else 0
@@ -1794,14 +4166,17 @@ def display_valuation_wizard(ticker_symbol):
 def get_correlated_stocks(selected_ticker, returns_dict, results_df, top_n=10):
     """
     Finds other tickers most correlated with the selected ticker. This version is
-    robust against missing or non-overlapping return data.
+    robust against missing or non-overlapping return data. `returns_dict` may also be
+    the wide returns frame (dates x tickers).
     """
-    if selected_ticker not in returns_dict or len(returns_dict) < 2:
+    is_frame = isinstance(returns_dict, pd.DataFrame)
+    n_tickers = returns_dict.shape[1] if is_frame else len(returns_dict)
+    if selected_ticker not in returns_dict or n_tickers < 2:
         logging.warning(f"Correlation check failed: {selected_ticker} not in returns_dict or not enough tickers.")
         return pd.DataFrame()
 
     try:
-        all_returns_df = pd.concat(returns_dict, axis=1)
+        all_returns_df = returns_dict if is_frame else pd.concat(returns_dict, axis=1)
     except Exception as e:
         logging.error(f"Failed to concat returns_dict: {e}")
         return pd.DataFrame()
@@ -1819,12 +4194,11 @@ def get_correlated_stocks(selected_ticker, returns_dict, results_df, top_n=10):
         logging.warning(f"{selected_ticker} has no valid return data in the last 90 days.")
         return pd.DataFrame()
 
-    corr_matrix = recent_returns_final.corr()
-
-    if selected_ticker not in corr_matrix:
-        return pd.DataFrame()
-
-    correlations_to_selected = corr_matrix[selected_ticker].drop(selected_ticker, errors='ignore')
+    # Only the selected ticker's column of the correlation matrix is needed (the window has no gaps left)
+    demeaned = recent_returns_final.to_numpy() - recent_returns_final.to_numpy().mean(axis=0)
+    target = demeaned[:, recent_returns_final.columns.get_loc(selected_ticker)]
+    correlations = demeaned.T @ target / (np.linalg.norm(demeaned, axis=0) * np.linalg.norm(target))
+    correlations_to_selected = pd.Series(correlations, index=recent_returns_final.columns, name=selected_ticker).drop(selected_ticker, errors='ignore')
 
     if correlations_to_selected.empty:
         logging.warning(f"No other valid stocks to correlate with {selected_ticker}.")
@@ -1849,11 +4223,11 @@ def get_correlated_stocks(selected_ticker, returns_dict, results_df, top_n=10):
     return corr_df.head(top_n)
 
 # --- FIX: Corrected the call to `get_correlated_stocks` ---
-def display_stock_dashboard(ticker_symbol, results_df, returns_dict, etf_histories):
+def display_stock_dashboard(ticker_symbol, results_df, returns_dict, etf_histories, price_panel=None):
     """Orchestrator function to display the entire individual stock dashboard."""
     st.header(f"🔬 Detailed Dashboard for {ticker_symbol}")
     try:
-        daily_history = yf.Ticker(ticker_symbol).history(period="3y", auto_adjust=True, interval="1d")
+        daily_history = get_price_history(ticker_symbol, price_panel=price_panel)
         if daily_history.empty:
             st.warning("Could not fetch detailed daily history for this ticker.")
             return
@@ -1917,17 +4291,834 @@ def display_stock_dashboard(ticker_symbol, results_df, returns_dict, etf_histori
             st.divider()
             display_valuation_wizard(ticker_symbol)
 
+# --- Stage Graph ---
+# The screen as a DAG of named stages with declared inputs. A stage's cache key is a hash of
+# its name, parameters, the module source and its inputs' content hashes, so a stage re-runs
+# only when something it depends on changed. Outputs are kept in a StageCache (in-memory LRU
+# over an on-disk pickle store with LRU eviction) and every run leaves a hit/miss report.
+STAGE_CACHE_DIR = os.environ.get("TRADFI_STAGE_CACHE_DIR", "stage_cache")
+STAGE_CACHE_MAX_MB = float(os.environ.get("TRADFI_STAGE_CACHE_MB", "512"))
+STAGE_CACHE_MEMORY_ITEMS = 128
+
+def _hash_into(h, obj):
+    if isinstance(obj, pd.DataFrame):
+        h.update(b"DataFrame")
+        _hash_into(h, [str(c) for c in obj.columns])
+        _hash_into(h, [str(d) for d in obj.dtypes])
+        _hash_into(h, obj.index)
+        dtypes = set(obj.dtypes)
+        if len(dtypes) == 1 and isinstance(next(iter(dtypes)), np.dtype) and next(iter(dtypes)).kind in "biuf":
+            h.update(np.ascontiguousarray(obj.to_numpy()).tobytes())
+        elif len(obj.columns):
+            h.update(pd.util.hash_pandas_object(obj, index=False).to_numpy().tobytes())
+    elif isinstance(obj, pd.Series):
+        h.update(b"Series")
+        _hash_into(h, str(obj.name))
+        _hash_into(h, str(obj.dtype))
+        _hash_into(h, obj.index)
+        if isinstance(obj.dtype, np.dtype) and obj.dtype.kind in "biuf": h.update(np.ascontiguousarray(obj.to_numpy()).tobytes())
+        else: h.update(pd.util.hash_pandas_object(obj, index=False).to_numpy().tobytes())
+    elif isinstance(obj, pd.Index):
+        h.update(f"Index:{obj.dtype}:{len(obj)}".encode())
+        if isinstance(obj, pd.DatetimeIndex): h.update(obj.asi8.tobytes())
+        elif isinstance(obj.dtype, np.dtype) and obj.dtype.kind in "biuf": h.update(np.ascontiguousarray(obj.to_numpy()).tobytes())
+        else: h.update(pd.util.hash_pandas_object(obj).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(f"ndarray:{obj.dtype}:{obj.shape}".encode())
+        h.update(pickle.dumps(obj, protocol=4) if obj.dtype.hasobject else np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        h.update(f"dict:{len(obj)}".encode())
+        for key in sorted(obj, key=repr):
+            _hash_into(h, key)
+            _hash_into(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"{type(obj).__name__}:{len(obj)}".encode())
+        for item in obj: _hash_into(h, item)
+    elif isinstance(obj, PricePanel):
+        h.update(b"PricePanel")
+        _hash_into(h, obj.frames)
+    elif obj is None or isinstance(obj, (str, bytes, int, float, bool, np.generic)):
+        h.update(f"{type(obj).__name__}:{obj!r}".encode())
+    else:
+        h.update(pickle.dumps(obj, protocol=4))
+
+def content_hash(obj):
+    """Hex digest of a value's content (frames by index, columns, dtypes and values; containers recursively)."""
+    h = hashlib.blake2b(digest_size=16)
+    _hash_into(h, obj)
+    return h.hexdigest()
+
+@lru_cache(maxsize=1)
+def _code_fingerprint():
+    """Hash of this module's source; any code change invalidates every cached stage output."""
+    try:
+        with open(os.path.abspath(__file__), "rb") as f:
+            return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    except OSError:
+        return "unknown"
+
+class StageCache:
+    """
+    Content-addressed store of stage outputs keyed by stage key.
+
+    Recent entries stay in memory (LRU, `memory_items`). With a `root`, every output is also
+    pickled to `root/<key>.pkl` and indexed in SQLite; once the files exceed `max_bytes` the
+    least recently used entries are deleted. `root=None` keeps the cache in memory only.
+    """
+    def __init__(self, root=STAGE_CACHE_DIR, max_bytes=STAGE_CACHE_MAX_MB * 2**20, memory_items=STAGE_CACHE_MEMORY_ITEMS):
+        self.root, self.max_bytes, self.memory_items = root, max_bytes, memory_items
+        self._memory = OrderedDict()   # key -> (output_hash, value)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        if self.root:
+            os.makedirs(self.root, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, stage TEXT NOT NULL, output_hash TEXT NOT NULL, "
+                    "n_bytes INTEGER NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+                )
+
+    def _connect(self):
+        return sqlite_transaction(os.path.join(self.root, "index.sqlite"))
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.pkl")
+
+    def _remember(self, key, output_hash, value):
+        with self._lock:
+            self._memory[key] = (output_hash, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items: self._memory.popitem(last=False)
+
+    def lookup(self, key):
+        """(output_hash, "memory" | "disk") for a cached key, or None on a miss."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key][0], "memory"
+        if not self.root: return None
+        with self._connect() as conn:
+            row = conn.execute("SELECT output_hash FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or not os.path.exists(self._path(key)): return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0], "disk"
+
+    def load(self, key):
+        """The cached value for `key`; raises KeyError if it is gone."""
+        with self._lock:
+            if key in self._memory: return self._memory[key][1]
+        if not self.root: raise KeyError(key)
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT output_hash FROM entries WHERE key = ?", (key,)).fetchone()
+            with open(self._path(key), "rb") as f:
+                value = pickle.load(f)
+        except Exception as e:
+            raise KeyError(key) from e
+        if row is None: raise KeyError(key)
+        self._remember(key, row[0], value)
+        return value
+
+    def store(self, key, stage, output_hash, value):
+        """Caches `value`; returns the bytes written to disk (0 when memory-only or unpicklable)."""
+        self._remember(key, output_hash, value)
+        if not self.root: return 0
+        try:
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logging.warning(f"Stage '{stage}' output is not picklable; caching it in memory only: {e}")
+            return 0
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f: f.write(payload)
+        os.replace(tmp_path, path)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries (key, stage, output_hash, n_bytes, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                         (key, stage, output_hash, len(payload), now, now))
+        self._evict()
+        return len(payload)
+
+    def _evict(self):
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(n_bytes), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes: return
+            for key, n_bytes in conn.execute("SELECT key, n_bytes FROM entries ORDER BY last_used").fetchall():
+                if total <= self.max_bytes: break
+                try: os.remove(self._path(key))
+                except FileNotFoundError: pass
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= n_bytes
+                self.evictions += 1
+
+    def stats(self):
+        """Entry counts and sizes of both tiers plus the number of disk evictions so far."""
+        stats = {"memory_entries": len(self._memory), "disk_entries": 0, "disk_mb": 0.0, "evictions": self.evictions}
+        if self.root:
+            with self._connect() as conn:
+                n, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(n_bytes), 0) FROM entries").fetchone()
+            stats["disk_entries"], stats["disk_mb"] = n, total / 2**20
+        return stats
+
+    def clear(self):
+        with self._lock: self._memory.clear()
+        if not self.root: return
+        with self._connect() as conn:
+            for (key,) in conn.execute("SELECT key FROM entries").fetchall():
+                try: os.remove(self._path(key))
+                except FileNotFoundError: pass
+            conn.execute("DELETE FROM entries")
+
+class Stage:
+    """A named graph node: `func(*input_values, **params)`, timed by a profiler under `profile_as` (default: its name)."""
+    def __init__(self, name, func, inputs=(), params=None, profile_as=None):
+        self.name, self.func, self.inputs = name, func, tuple(inputs)
+        self.params, self.profile_as = params or {}, profile_as or name
+
+class StageGraph:
+    """
+    DAG of Stages. `run` resolves only the ancestors of the requested targets, in topological
+    order; names supplied in `sources` are taken as given and cut the graph above them.
+    A cached stage is resolved from its key and output hash alone and is loaded only when a
+    target or a re-running downstream stage needs its value. `last_report` holds the
+    per-stage status (source / hit / miss), seconds, key and output hash of the latest run and
+    `last_hashes` the hash of every value it resolved (reusable as `source_hashes`).
+    """
+    def __init__(self, stages=()):
+        self.stages = {}
+        self.last_report = pd.DataFrame(columns=["stage", "status", "seconds", "key", "output", "bytes"])
+        self.last_hashes = {}
+        for stage in stages: self.add(stage)
+
+    def add(self, stage):
+        if stage.name in self.stages: raise ValueError(f"Duplicate stage '{stage.name}'")
+        self.stages[stage.name] = stage
+        return stage
+
+    def _plan(self, targets, sources):
+        """(source names, stage names in topological order) needed for `targets`."""
+        order, needed_sources, state = [], [], {}
+        def visit(name):
+            if state.get(name) == "done": return
+            if state.get(name) == "visiting": raise ValueError(f"Cycle in stage graph at '{name}'")
+            if name in sources:
+                needed_sources.append(name)
+            elif name in self.stages:
+                state[name] = "visiting"
+                for dependency in self.stages[name].inputs: visit(dependency)
+                order.append(name)
+            else:
+                raise KeyError(f"'{name}' is neither a stage nor a provided source")
+            state[name] = "done"
+        for target in targets: visit(target)
+        return needed_sources, order
+
+    def run(self, targets, sources, cache=None, source_hashes=None, profiler=None):
+        """
+        Args:
+            targets (list): Stage (or source) names to return.
+            sources (dict): Input values by name; may also pre-empt stages (e.g. loaded from a snapshot).
+            cache (StageCache): Output cache; a fresh memory-only cache when None.
+            source_hashes (dict): Precomputed hashes for sources (e.g. "snapshot:<id>:<name>");
+                                  the rest are content-hashed.
+            profiler (StageProfiler): Times re-run stages under their `profile_as` name.
+
+        Returns:
+            dict: {target: value}.
+        """
+        cache = cache if cache is not None else StageCache(root=None)
+        source_hashes = source_hashes or {}
+        needed_sources, order = self._plan(targets, sources)
+        values, hashes, keys, rows = {}, {}, {}, {}
+        for name in needed_sources:
+            start = time.perf_counter()
+            values[name] = sources[name]
+            hashes[name] = source_hashes.get(name) or content_hash(sources[name])
+            rows[name] = {"stage": name, "status": "source", "seconds": time.perf_counter() - start, "key": "", "output": hashes[name][:12], "bytes": 0}
+
+        def compute(name):
+            stage = self.stages[name]
+            args = [value_of(dependency) for dependency in stage.inputs]
+            start = time.perf_counter()
+            with profiler.stage(stage.profile_as) if profiler is not None else contextlib.nullcontext():
+                value = stage.func(*args, **stage.params)
+            output_hash = content_hash(value)
+            n_bytes = cache.store(keys[name], name, output_hash, value)
+            return value, output_hash, time.perf_counter() - start, n_bytes
+
+        def value_of(name):
+            if name not in values:
+                start = time.perf_counter()
+                try:
+                    values[name] = cache.load(keys[name])
+                    rows[name]["seconds"] += time.perf_counter() - start
+                except KeyError:
+                    # Evicted between lookup and load: recompute (same inputs, so the same key)
+                    values[name], hashes[name], seconds, n_bytes = compute(name)
+                    rows[name].update(status="miss", seconds=seconds, output=hashes[name][:12], bytes=n_bytes)
+            return values[name]
+
+        for name in order:
+            stage = self.stages[name]
+            start = time.perf_counter()
+            keys[name] = content_hash([_code_fingerprint(), name, stage.params, [hashes[d] for d in stage.inputs]])
+            hit = cache.lookup(keys[name])
+            if hit is not None:
+                hashes[name], tier = hit
+                rows[name] = {"stage": name, "status": f"hit ({tier})", "seconds": time.perf_counter() - start, "key": keys[name][:12], "output": hashes[name][:12], "bytes": 0}
+            else:
+                values[name], hashes[name], seconds, n_bytes = compute(name)
+                rows[name] = {"stage": name, "status": "miss", "seconds": seconds, "key": keys[name][:12], "output": hashes[name][:12], "bytes": n_bytes}
+        results = {target: value_of(target) for target in targets}
+        self.last_report = pd.DataFrame([rows[name] for name in [*needed_sources, *order]])
+        self.last_hashes = hashes
+        return results
+
+@st.cache_resource
+def get_stage_cache():
+    """The on-disk stage cache (STAGE_CACHE_DIR), shared by the CLI and every dashboard session."""
+    return StageCache()
+
 ################################################################################
 # SECTION 2: MAIN APPLICATION LOGIC
 ################################################################################
 # --- FIX: THIS ENTIRE `main` FUNCTION HAS BEEN REWRITTEN FOR CORRECTNESS AND LOGIC ---
+# --- Screening Pipeline ---
+# The screen behind the dashboard, as plain functions so the Streamlit app, the headless CLI
+# and the benchmark suite all run exactly the same steps.
+TIME_HORIZONS = {"1M": "Return_21d", "3M": "Return_63d", "6M": "Return_126d", "12M": "Return_252d"}
+WEIGHTING_METHODS = {"Equal Weight": "equal", "Inverse Volatility": "inv_vol", "Log Log Sharpe Optimized": "log_log_sharpe",
+                     "Factor-Mimicking (Momentum)": "fmp", "Alpha Orthogonal": "alpha_orthogonal"}
+FMP_FACTORS = {"Value (IVE)": "IVE", "Growth (IVW)": "IVW", "Quality (QUAL)": "QUAL", "Vision (Synthetic)": "VISION_SYNTHETIC"}
+PORTFOLIO_SIZE = 15
+
+def _pipeline_stage(profiler, name):
+    return profiler.stage(name) if profiler is not None else contextlib.nullcontext()
+
+def stability_metric_columns(results_df):
+    """Numeric characteristic columns used as regressors (no returns, identifiers or scores)."""
+    return [c for c in results_df.columns if pd.api.types.is_numeric_dtype(results_df[c]) and 'Return' not in c and c not in ['Ticker', 'Name', 'Score']]
+
+def calculate_horizon_pure_returns(results_df, time_horizons=TIME_HORIZONS):
+    """Today's pure factor returns for every horizon in one shared solve (characteristics x target columns)."""
+    targets = [target_column for target_column in time_horizons.values() if target_column in results_df.columns]
+    return calculate_pure_returns_multi(results_df, stability_metric_columns(results_df), targets)
+
+def calculate_horizon_stability(pure_returns, target_column, history=None):
+    """
+    Coefficient stability of one horizon's pure returns over its stored `history` (factors x past
+    runs, see `PureReturnHistory.load`) plus today; None when there are no pure returns. With fewer
+    than PURE_RETURN_MIN_HISTORY stored runs the history is simulated instead.
+    """
+    if pure_returns is None or target_column not in pure_returns.columns: return None
+    pure_returns_today = pure_returns[target_column].dropna().rename("PureReturns")
+    if pure_returns_today.empty: return None
+    n_runs = 0 if history is None else history.shape[1]
+    if n_runs < PURE_RETURN_MIN_HISTORY:
+        logging.warning(f"Only {n_runs} stored pure-return runs for {target_column}; simulating the history.")
+        return analyze_coefficient_stability(simulate_historical_pure_returns(pure_returns_today))
+    history = history.reindex(pure_returns_today.index)
+    return analyze_coefficient_stability([history[run_date] for run_date in history.columns] + [pure_returns_today])
+
+def aggregate_factor_weights(stability_results):
+    """(auto_weights dict, rationale_df, stability_results) from the per-horizon stability tables."""
+    auto_weights, rationale_df = aggregate_stability_and_set_weights(stability_results, list(default_weights.keys()), REVERSE_METRIC_NAME_MAP)
+    return auto_weights, rationale_df, stability_results
+
+def derive_stability_weights(results_df, time_horizons=TIME_HORIZONS, history=None):
+    """
+    Pure factor returns per horizon -> coefficient stability -> automatic factor weights.
+    `history` maps horizon labels to stored runs (see `load_pure_return_history`).
+
+    Returns:
+        tuple: (auto_weights dict, rationale_df, {horizon: stability_df}).
+    """
+    stability_results = {}
+    pure_returns = calculate_horizon_pure_returns(results_df, time_horizons)
+    for horizon_label, target_column in time_horizons.items():
+        stability = calculate_horizon_stability(pure_returns, target_column, (history or {}).get(horizon_label))
+        if stability is not None: stability_results[horizon_label] = stability
+    return aggregate_factor_weights(stability_results)
+
+def score_results(results_df, user_weights, rationale_df, portfolio_size=PORTFOLIO_SIZE):
+    """Writes the composite 'Score' into `results_df` and returns the top `portfolio_size` rows."""
+    raw_score = pd.Series(0.0, index=results_df.index)
+    for long_name, weight in user_weights.items():
+        if weight > 0:
+            short_name = REVERSE_METRIC_NAME_MAP.get(long_name)
+            if short_name in results_df.columns and short_name in rationale_df.index:
+                rank_series = results_df[short_name].rank(pct=True)
+                # Use the SIGN of the AGGREGATED sharpe coefficient to determine if lower is better
+                if rationale_df.loc[short_name, 'avg_sharpe_coeff'] < 0:
+                    rank_series = 1 - rank_series
+                raw_score += rank_series.fillna(0.5) * weight
+
+    def z_score(series): return (series - series.mean()) / (series.std() if series.std() > 0 else 1)
+    results_df['Score'] = z_score(raw_score)
+    return results_df.sort_values('Score', ascending=False).head(portfolio_size).copy()
+
+def align_portfolio_returns(top_df, returns_dict, etf_histories):
+    """
+    Daily returns of the top-ranked names and the MTUM momentum factor on their common dates
+    (inf/NaN as 0). `returns_dict` may also be the wide returns frame.
+
+    Returns:
+        tuple: (aligned_returns DataFrame, aligned_momentum Series).
+    """
+    top_tickers = top_df['Ticker'].tolist()
+    portfolio_returns_df = pd.DataFrame({t: returns_dict[t] for t in top_tickers if t in returns_dict}).reindex(columns=top_tickers).dropna(how='all')
+    momentum_factor_returns = etf_histories['MTUM']['Close'].pct_change().dropna()
+    common_idx = portfolio_returns_df.index.intersection(momentum_factor_returns.index)
+    aligned_returns = portfolio_returns_df.loc[common_idx].replace([np.inf, -np.inf], np.nan).fillna(0.0)
+    aligned_momentum = momentum_factor_returns.loc[common_idx].replace([np.inf, -np.inf], np.nan).fillna(0.0)
+    return aligned_returns, aligned_momentum
+
+def calculate_portfolio_covariance(top_df, returns_dict, corr_window=90):
+    """Shrunk covariance of the top-ranked names over the last `corr_window` days, in ranking order."""
+    top_tickers = top_df['Ticker'].tolist()
+    _, cov_matrix = calculate_correlation_matrix(top_tickers, returns_dict, window=corr_window)
+    return cov_matrix.loc[top_tickers, top_tickers]
+
+def calculate_momentum_betas(aligned_returns, aligned_momentum):
+    """Per-name OLS beta to the momentum factor, all names in one pass (1.0 where the fit fails)."""
+    betas = pd.DataFrame(1.0, index=aligned_returns.columns.tolist(), columns=['Momentum_Beta'])
+    if aligned_returns.empty: return betas
+    momentum = aligned_momentum.to_numpy(dtype=float)
+    momentum = momentum - momentum.mean()
+    returns = aligned_returns.to_numpy(dtype=float)
+    variance = momentum @ momentum
+    slopes = momentum @ (returns - returns.mean(axis=0)) / variance if variance > 0 else np.zeros(returns.shape[1])
+    betas['Momentum_Beta'] = np.where(np.isfinite(slopes), slopes, 1.0)
+    return betas
+
+def calculate_fmp_portfolios(aligned_returns, aligned_momentum, cov_matrix, etf_histories, factors=None):
+    """
+    FMP weights (tickers x factor ETF) for every FMP_FACTORS ETF available in `etf_histories`,
+    orthogonalized against momentum, from one `calculate_multi_factor_fmp_weights` call.
+    """
+    factors = [f for f in (factors or FMP_FACTORS.values()) if f in etf_histories]
+    if not factors: return pd.DataFrame(index=aligned_returns.columns)
+    factor_returns = pd.DataFrame({f: etf_histories[f]['Close'].pct_change() for f in factors})
+    return calculate_multi_factor_fmp_weights(aligned_returns, factor_returns, cov_matrix, existing_factors_returns=aligned_momentum.to_frame())
+
+def prepare_portfolio_inputs(top_df, returns_dict, etf_histories, corr_window=90, cov_matrix=None):
+    """
+    Covariance, aligned returns, momentum factor and momentum betas for the top-ranked names.
+    `returns_dict` may also be the wide returns frame; a precomputed `cov_matrix` (e.g. from a
+    snapshot written with the same `corr_window`) skips `calculate_correlation_matrix`.
+    """
+    top_tickers = top_df['Ticker'].tolist()
+    aligned_returns, aligned_momentum = align_portfolio_returns(top_df, returns_dict, etf_histories)
+    cov_matrix = calculate_portfolio_covariance(top_df, returns_dict, corr_window) if cov_matrix is None else cov_matrix.loc[top_tickers, top_tickers]
+    return {"cov_matrix": cov_matrix, "aligned_returns": aligned_returns, "aligned_momentum": aligned_momentum,
+            "betas": calculate_momentum_betas(aligned_returns, aligned_momentum)}
+
+def calculate_portfolio_weights(inputs, top_df, etf_histories, weighting_method="Equal Weight", new_factor="None"):
+    """
+    Weights for the chosen method, or FMP weights when `new_factor` is set (taken from
+    inputs["fmp_weights"] when present, see `calculate_fmp_portfolios`).
+
+    Returns:
+        dict: `inputs` plus p_weights (None if the FMP factor is unavailable), weights_df and
+              weight_column ('Weight' or 'FMP Weight').
+    """
+    cov_matrix, aligned_returns, aligned_momentum = inputs["cov_matrix"], inputs["aligned_returns"], inputs["aligned_momentum"]
+    p_weights, weight_column = None, 'Weight'
+    if new_factor != "None":
+        weight_column = 'FMP Weight'
+        key = FMP_FACTORS.get(new_factor)
+        fmp_weights = inputs.get("fmp_weights")
+        if fmp_weights is None and key in etf_histories:
+            fmp_weights = calculate_fmp_portfolios(aligned_returns, aligned_momentum, cov_matrix, etf_histories, [key])
+        if fmp_weights is not None and key in fmp_weights:
+            p_weights = fmp_weights[key].rename(None)
+    else:
+        method = WEIGHTING_METHODS.get(weighting_method, "equal")
+        if method == "fmp": p_weights = calculate_weights(aligned_returns, method="fmp", cov_matrix=cov_matrix, factor_returns=aligned_momentum)
+        elif method == "alpha_orthogonal": p_weights = calculate_weights(aligned_returns, method="alpha_orthogonal", betas=inputs["betas"])
+        else: p_weights = calculate_weights(aligned_returns, method=method, cov_matrix=cov_matrix)
+
+    weights_df = pd.DataFrame(columns=['Ticker', weight_column, 'Name'])
+    if p_weights is not None:
+        weights_df = p_weights.reset_index()
+        weights_df.columns = ['Ticker', weight_column]
+        weights_df = pd.merge(weights_df, top_df[['Ticker', 'Name']], on='Ticker', how='left')
+    return {**inputs, "p_weights": p_weights, "weights_df": weights_df, "weight_column": weight_column}
+
+def build_portfolio(top_df, returns_dict, etf_histories, weighting_method="Equal Weight", new_factor="None", corr_window=90, profiler=None):
+    """`prepare_portfolio_inputs` followed by `calculate_portfolio_weights`."""
+    with _pipeline_stage(profiler, "calculate_correlation_matrix"):
+        inputs = prepare_portfolio_inputs(top_df, returns_dict, etf_histories, corr_window)
+    with _pipeline_stage(profiler, "calculate_weights"):
+        return calculate_portfolio_weights(inputs, top_df, etf_histories, weighting_method, new_factor)
+
+def _portfolio_weight_frame(portfolio):
+    return portfolio["weights_df"][['Ticker', portfolio["weight_column"]]].rename(columns={portfolio["weight_column"]: 'Weight'})
+
+def calculate_portfolio_benchmark(portfolio, etf_histories, price_panel=None):
+    """(best-correlated ETF, correlation); ('SPY', NaN) if none qualifies, (None, NaN) without weights."""
+    if portfolio["weights_df"].empty: return None, np.nan
+    corrs = calculate_portfolio_factor_correlations(_portfolio_weight_frame(portfolio), etf_histories, price_panel=price_panel)
+    return (corrs.index[0], corrs.iloc[0]) if not corrs.empty else ('SPY', np.nan)
+
+def calculate_portfolio_z_score(portfolio, best_etf, etf_histories, price_panel=None):
+    """Relative z-score of the weighted portfolio against `best_etf` (NaN without weights)."""
+    if portfolio["weights_df"].empty or best_etf is None: return np.nan
+    relative_z, _ = calculate_portfolio_relative_z_score(_portfolio_weight_frame(portfolio), etf_histories, best_etf, price_panel=price_panel)
+    return relative_z
+
+def calculate_portfolio_quality(portfolio, top_df):
+    """(MALV, IC, IR) of the weighted portfolio; NaN when it has no weights."""
+    p_weights = portfolio["p_weights"]
+    if p_weights is None or p_weights.empty: return np.nan, np.nan, np.nan
+    aligned_returns = portfolio["aligned_returns"]
+    aligned_w = p_weights.reindex(aligned_returns.columns).fillna(0)
+    final_returns = (aligned_returns * aligned_w).sum(axis=1)
+    scores = top_df.set_index('Ticker').reindex(aligned_returns.columns)['Score'].fillna(0)
+    alpha_weights = scores / scores.sum() if scores.sum() != 0 else pd.Series(1/len(scores), index=scores.index)
+    lagged_forecast_ts = (aligned_returns * alpha_weights).sum(axis=1).shift(1)
+    malv, _ = calculate_mahalanobis_metrics(aligned_returns, portfolio["cov_matrix"])
+    ic, ir = calculate_information_metrics(lagged_forecast_ts, final_returns)
+    return malv, ic, ir
+
+def assemble_portfolio_metrics(benchmark, relative_z, quality):
+    best_etf, best_corr = benchmark
+    malv, ic, ir = quality
+    return {"best_etf": best_etf, "best_corr": best_corr, "relative_z": relative_z, "malv": malv, "ic": ic, "ir": ir}
+
+def calculate_portfolio_metrics(portfolio, top_df, etf_histories, price_panel=None):
+    """Best-matching ETF, relative z-score, MALV, IC and IR of the built portfolio (NaN when unavailable)."""
+    benchmark = calculate_portfolio_benchmark(portfolio, etf_histories, price_panel)
+    relative_z = calculate_portfolio_z_score(portfolio, benchmark[0], etf_histories, price_panel)
+    return assemble_portfolio_metrics(benchmark, relative_z, calculate_portfolio_quality(portfolio, top_df))
+
+def calculate_portfolio_rolling_malv(portfolio):
+    """63-day rolling MALV of the weighted portfolio (empty without weights)."""
+    if portfolio["p_weights"] is None or portfolio["p_weights"].empty: return pd.Series(dtype=float)
+    return calculate_rolling_malv(portfolio["aligned_returns"], portfolio["cov_matrix"]).dropna()
+
+def _score_stage(results_df, factor_weights):
+    scored_df = results_df.copy()
+    auto_weights, rationale_df, _ = factor_weights
+    return {"results_df": scored_df, "top_df": score_results(scored_df, auto_weights, rationale_df)}
+
+def _portfolio_stage(scoring, portfolio_returns, cov_matrix, betas, fmp_weights, etf_histories, weighting_method, new_factor):
+    aligned_returns, aligned_momentum = portfolio_returns
+    inputs = {"cov_matrix": cov_matrix, "aligned_returns": aligned_returns, "aligned_momentum": aligned_momentum, "betas": betas, "fmp_weights": fmp_weights}
+    return calculate_portfolio_weights(inputs, scoring["top_df"], etf_histories, weighting_method, new_factor)
+
+def build_screening_graph(time_horizons=TIME_HORIZONS):
+    """
+    The screen after `process_tickers` as a StageGraph. Sources: results_df, returns_dict,
+    etf_histories, price_panel, pure_return_history (see `load_pure_return_history`),
+    weighting_method, new_factor and corr_window. Stages are profiled
+    under the benchmark's stage names (calculate_pure_returns, factor_weighting, ...).
+    """
+    def collect_stability(*stabilities):
+        return aggregate_factor_weights({label: s for label, s in zip(time_horizons, stabilities) if s is not None})
+
+    def horizon_stability(pure_returns, pure_return_history, target_column, horizon):
+        return calculate_horizon_stability(pure_returns, target_column, pure_return_history.get(horizon))
+
+    graph = StageGraph()
+    graph.add(Stage("pure_returns", calculate_horizon_pure_returns, ["results_df"], params={"time_horizons": dict(time_horizons)}, profile_as="calculate_pure_returns"))
+    for label, target_column in time_horizons.items():
+        graph.add(Stage(f"stability_{label}", horizon_stability, ["pure_returns", "pure_return_history"], params={"target_column": target_column, "horizon": label},
+                        profile_as="calculate_pure_returns"))
+    graph.add(Stage("factor_weights", collect_stability, [f"stability_{label}" for label in time_horizons], profile_as="calculate_pure_returns"))
+    graph.add(Stage("scoring", _score_stage, ["results_df", "factor_weights"], profile_as="factor_weighting"))
+    graph.add(Stage("portfolio_returns", lambda scoring, returns_dict, etf_histories: align_portfolio_returns(scoring["top_df"], returns_dict, etf_histories),
+                    ["scoring", "returns_dict", "etf_histories"], profile_as="calculate_correlation_matrix"))
+    graph.add(Stage("covariance", lambda scoring, returns_dict, corr_window: calculate_portfolio_covariance(scoring["top_df"], returns_dict, corr_window),
+                    ["scoring", "returns_dict", "corr_window"], profile_as="calculate_correlation_matrix"))
+    graph.add(Stage("betas", lambda portfolio_returns: calculate_momentum_betas(*portfolio_returns), ["portfolio_returns"], profile_as="calculate_weights"))
+    graph.add(Stage("fmp_weights", lambda portfolio_returns, cov_matrix, etf_histories: calculate_fmp_portfolios(*portfolio_returns, cov_matrix, etf_histories),
+                    ["portfolio_returns", "covariance", "etf_histories"], profile_as="calculate_weights"))
+    graph.add(Stage("portfolio", _portfolio_stage, ["scoring", "portfolio_returns", "covariance", "betas", "fmp_weights", "etf_histories", "weighting_method", "new_factor"],
+                    profile_as="calculate_weights"))
+    graph.add(Stage("frontier_grid", lambda portfolio_returns, cov_matrix: efficient_frontier(portfolio_returns[0], cov_matrix),
+                    ["portfolio_returns", "covariance"], profile_as="calculate_weights"))
+    graph.add(Stage("frontier", lambda grid, portfolio: (frontier_turnover(grid[0], grid[1], portfolio["p_weights"]), grid[1]),
+                    ["frontier_grid", "portfolio"], profile_as="calculate_weights"))
+    graph.add(Stage("portfolio_correlation", calculate_portfolio_benchmark, ["portfolio", "etf_histories", "price_panel"], profile_as="portfolio_metrics"))
+    graph.add(Stage("z_score", lambda portfolio, benchmark, etf_histories, price_panel: calculate_portfolio_z_score(portfolio, benchmark[0], etf_histories, price_panel),
+                    ["portfolio", "portfolio_correlation", "etf_histories", "price_panel"], profile_as="portfolio_metrics"))
+    graph.add(Stage("portfolio_quality", lambda portfolio, scoring: calculate_portfolio_quality(portfolio, scoring["top_df"]), ["portfolio", "scoring"], profile_as="portfolio_metrics"))
+    graph.add(Stage("metrics", assemble_portfolio_metrics, ["portfolio_correlation", "z_score", "portfolio_quality"], profile_as="portfolio_metrics"))
+    graph.add(Stage("rolling_malv", calculate_portfolio_rolling_malv, ["portfolio"]))
+    return graph
+
+def format_stage_report(report, cache=None):
+    """Printable stage report (status, seconds, key and output hash per stage) plus cache totals."""
+    lines = [report.to_string(index=False, formatters={"seconds": "{:.3f}".format})]
+    counts = report["status"].str.split(" ").str[0].value_counts()
+    lines.append(f"hits: {counts.get('hit', 0)}, misses: {counts.get('miss', 0)}, sources: {counts.get('source', 0)}")
+    if cache is not None: lines.append(f"cache: {cache.stats()}")
+    return "\n".join(lines)
+
+def run_screening_pipeline(universe=None, weighting_method="Equal Weight", new_factor="None", corr_window=90, workers=None, profiler=None, stage_cache=None):
+    """
+    Runs the full screen without Streamlit: fetch -> metrics -> stability weighting -> scoring ->
+    top-15 portfolio -> portfolio metrics. `profiler` (a StageProfiler) times each stage. Everything
+    after `process_tickers` runs through `build_screening_graph` against `stage_cache`
+    (default: the on-disk `get_stage_cache()`), so unchanged stages are served from cache.
+    Stability is measured against the runs in `get_pure_return_history()`, and today's pure
+    returns are appended to it.
+
+    Returns:
+        dict: results_df, failed_tickers, returns_dict, etf_histories, price_panel, auto_weights,
+              rationale_df, stability_results, top_df, portfolio (see `calculate_portfolio_weights`),
+              metrics, frontier (see `efficient_frontier`) and stage_report (see `StageGraph`).
+    """
+    universe = universe or get_data_provider().universe() or tickers
+    with _pipeline_stage(profiler, "fetch_etf_histories"):
+        etf_histories = fetch_all_etf_histories(etf_list)
+    with _pipeline_stage(profiler, "build_price_panel"):
+        price_panel = build_price_panel(universe, etf_histories)
+    with _pipeline_stage(profiler, "process_tickers"):
+        results_df, failed_tickers, returns_dict = process_tickers(universe, etf_histories, sector_etf_map, price_panel, workers=workers)
+    if results_df.empty: raise RuntimeError("No tickers could be processed.")
+
+    graph = build_screening_graph()
+    sources = {"results_df": results_df, "returns_dict": returns_dict, "etf_histories": etf_histories, "price_panel": price_panel,
+               "pure_return_history": load_pure_return_history(TIME_HORIZONS),
+               "weighting_method": weighting_method, "new_factor": new_factor, "corr_window": corr_window}
+    stage_cache = stage_cache if stage_cache is not None else get_stage_cache()
+    screened = graph.run(["pure_returns", "factor_weights", "scoring"], sources, cache=stage_cache, profiler=profiler)
+    record_pure_returns(screened["pure_returns"], TIME_HORIZONS, n_tickers=len(results_df), n_failed=len(failed_tickers))
+    auto_weights, rationale_df, stability_results = screened["factor_weights"]
+    if screened["scoring"]["top_df"].empty: raise RuntimeError("No stocks for portfolio construction.")
+    screening_report = graph.last_report
+    built = graph.run(["portfolio", "metrics", "frontier"], {**sources, **screened}, cache=stage_cache, source_hashes=graph.last_hashes, profiler=profiler)
+    return {
+        "results_df": screened["scoring"]["results_df"], "failed_tickers": failed_tickers, "returns_dict": returns_dict,
+        "etf_histories": etf_histories, "price_panel": price_panel, "auto_weights": auto_weights,
+        "rationale_df": rationale_df, "stability_results": stability_results, "top_df": screened["scoring"]["top_df"],
+        "portfolio": built["portfolio"], "metrics": built["metrics"], "frontier": built["frontier"][0],
+        "stage_report": pd.concat([screening_report, graph.last_report], ignore_index=True).drop_duplicates("stage"),
+    }
+
+# --- Point-in-Time Backfill ---
+# Rebuilds the screen's cross-section at past month-ends from stored data only (bars up to each
+# date and the statement periods already published by then) and runs the pure-return regression
+# at each date, so the history store holds genuine monthly runs instead of simulated ones.
+# Month-ends are split into contiguous chunks, one per worker process; a worker reuses a ticker's
+# statement line items until a newer period is published, which covers most adjacent dates.
+# Statements missing from the store are fetched through the provider first; tickers without any
+# are left out, and a month-end where too few names have published statements is not recorded
+# (its ratio columns would be constant and the regression would fit noise).
+BACKFILL_MONTHS = int(os.environ.get("TRADFI_BACKFILL_MONTHS", "24"))
+# Share of a month-end's cross-section that must have published statements for the run to be recorded
+BACKFILL_MIN_STATEMENT_COVERAGE = float(os.environ.get("TRADFI_BACKFILL_MIN_COVERAGE", "0.5"))
+# Days from a fiscal period end until its annual statements can be assumed public (10-K deadline)
+STATEMENT_PUBLICATION_LAG = pd.Timedelta(days=int(os.environ.get("TRADFI_STATEMENT_LAG_DAYS", "90")))
+RETURN_PERIODS = [21, 63, 126, 252]
+_backfill_inputs = None
+
+def backfill_dates(index, months=BACKFILL_MONTHS, min_bars=253):
+    """Last trading day of each of the latest `months` closed months in `index` with at least `min_bars` bars up to it."""
+    index = pd.DatetimeIndex(index).sort_values()
+    if len(index) == 0: return []
+    positions = pd.Series(np.arange(len(index)), index=index)
+    # The latest month is still open; today's live run covers it
+    month_ends = positions.groupby(index.to_period("M")).max().iloc[:-1]
+    month_ends = month_ends[month_ends >= min_bars - 1]
+    return [index[position] for position in month_ends.iloc[-months:]]
+
+def statements_as_of(statement, as_of, lag=STATEMENT_PUBLICATION_LAG):
+    """The periods of a statement frame (columns are period ends) published by `as_of`, newest first."""
+    if statement is None or statement.empty: return pd.DataFrame()
+    periods = pd.to_datetime(statement.columns, errors='coerce')
+    published = statement.loc[:, np.asarray(periods.notna() & (periods + lag <= pd.Timestamp(as_of)))]
+    return published.iloc[:, np.argsort(pd.to_datetime(published.columns))[::-1]]
+
+def statement_publication_dates(statements, lag=STATEMENT_PUBLICATION_LAG):
+    """{ticker: one sorted array of publication dates per statement}, to count published periods without slicing."""
+    calendar = {}
+    for ticker, frames in statements.items():
+        calendar[ticker] = tuple(np.sort(np.asarray(pd.to_datetime(frame.columns, errors='coerce').dropna() + lag, dtype="datetime64[ns]"))
+                                 if frame is not None and not frame.empty else np.array([], dtype="datetime64[ns]") for frame in frames)
+    return calendar
+
+def build_point_in_time_cross_section(as_of, price_panel, etf_histories, statements, profiles, fundamentals_cache=None, publication_dates=None):
+    """
+    The results table the screen would have produced at `as_of`, limited to what is knowable then.
+
+    Price-based columns come from the bars up to `as_of`; statement ratios use only periods published
+    by `as_of` (see `statements_as_of`), with market cap, P/E and earnings yield priced at that date.
+    Columns that only exist in today's `info` snapshot (ownership, governance risk, analyst growth)
+    and GARCH_Vol are left out rather than back-filled with today's values, and so are characteristics
+    with no variation at `as_of` (e.g. every ratio before any statement is published).
+
+    Args:
+        as_of (pd.Timestamp): Cross-section date.
+        price_panel (PricePanel): Bars for the universe and ETFs.
+        etf_histories (dict): ETF bars.
+        statements (dict): {ticker: (financials, balancesheet, cashflow)} as stored.
+        profiles (dict): {ticker: {"Name", "Sector", "shares"}} from the stored `info`.
+        fundamentals_cache (dict): {(ticker, published period counts): line items}, reused across dates.
+        publication_dates (dict): `statement_publication_dates(statements)`, computed when None.
+
+    Returns:
+        pd.DataFrame: One row per ticker with history at `as_of`, cleaned like `process_tickers` output.
+    """
+    as_of = pd.Timestamp(as_of)
+    fundamentals_cache = fundamentals_cache if fundamentals_cache is not None else {}
+    publication_dates = publication_dates if publication_dates is not None else statement_publication_dates(statements)
+    as_of_ns = np.datetime64(as_of, "ns")
+    panel = price_panel.as_of(as_of)
+    etf_histories = {etf: history.loc[:as_of] for etf, history in etf_histories.items() if history is not None and not history.empty}
+    closes = panel.closes([t for t in profiles if t in panel])
+    closes = closes.loc[:, closes.notna().any()]
+    tickers_list = closes.columns.tolist()
+    if not tickers_list: return pd.DataFrame()
+    last_close = closes.ffill().iloc[-1]
+
+    rows = []
+    for ticker in tickers_list:
+        key = (ticker, *(int(np.searchsorted(dates, as_of_ns, side="right")) for dates in publication_dates.get(ticker, ())))
+        fundamentals = fundamentals_cache.get(key)
+        if fundamentals is None:
+            published = (statements_as_of(statement, as_of) for statement in statements.get(ticker, (None, None, None)))
+            fundamentals = fundamentals_cache[key] = extract_statement_fundamentals(*published)
+        profile, price = profiles[ticker], last_close[ticker]
+        shares = fundamentals['shares'] if pd.notna(fundamentals['shares']) else profile.get('shares')
+        market_cap = price * shares if shares and pd.notna(price) else np.nan
+        eps = fundamentals['net_income'] / shares if shares and pd.notna(fundamentals['net_income']) else np.nan
+        data = {'Ticker': ticker, 'Name': profile.get('Name'), 'Sector': profile.get('Sector'), 'Market_Cap': market_cap,
+                'EPS_Diluted': eps, 'PE_Ratio': price / eps if eps > 0 else np.nan}
+        data.update(calculate_statement_ratios(fundamentals, market_cap, shares, price, eps))
+        data.update(calculate_period_returns(closes[ticker].dropna(), RETURN_PERIODS))
+        data.update(calculate_composite_scores(data, fundamentals['net_income']))
+        rows.append(data)
+    results_df = pd.DataFrame(rows)
+
+    log_returns = panel.log_returns(tickers_list)
+    batch_df = calculate_time_series_metrics_batch(closes, panel.volumes(tickers_list))
+    batch_df['Hurst_Exponent'] = calculate_hurst_lo_modified_batch({t: log_returns[t].dropna().to_numpy() for t in tickers_list})
+    sectors = results_df.set_index('Ticker')['Sector']
+    batch_df = batch_df.join(calculate_factor_exposures_batch(panel, etf_histories, tickers_list, sectors=sectors)).reindex(results_df['Ticker'])
+    for col in batch_df.columns:
+        results_df[col] = batch_df[col].to_numpy()
+
+    numeric_cols = [c for c in results_df.columns if c not in ['Ticker', 'Name', 'Sector', 'Best_Factor']]
+    results_df[numeric_cols] = results_df[numeric_cols].apply(pd.to_numeric, errors='coerce')
+    # Constant (or all-missing) columns carry no cross-sectional information; dropped here rather
+    # than jittered by clean_results_frame, which would feed noise into the regression
+    results_df = results_df.drop(columns=[c for c in numeric_cols if results_df[c].nunique() <= 1])
+    return clean_results_frame(results_df[[c for c in columns if c in results_df.columns]])
+
+def statement_coverage(tickers_list, publication_dates, as_of):
+    """Share of `tickers_list` with at least one statement period published by `as_of`."""
+    if not len(tickers_list): return 0.0
+    as_of_ns = np.datetime64(pd.Timestamp(as_of), "ns")
+    covered = sum(any(len(dates) and dates[0] <= as_of_ns for dates in publication_dates.get(t, ())) for t in tickers_list)
+    return covered / len(tickers_list)
+
+def _init_backfill_worker(inputs):
+    global _backfill_inputs
+    _backfill_inputs = inputs
+
+def _backfill_task(dates):
+    """Worker body: pure returns for a chunk of consecutive month-ends, sharing one fundamentals cache."""
+    price_panel, etf_histories, statements, profiles, time_horizons = _backfill_inputs
+    fundamentals_cache, results = {}, []
+    publication_dates = statement_publication_dates(statements)
+    for as_of in dates:
+        start = time.perf_counter()
+        try:
+            cross_section = build_point_in_time_cross_section(as_of, price_panel, etf_histories, statements, profiles, fundamentals_cache, publication_dates)
+            coverage = statement_coverage(cross_section['Ticker'] if not cross_section.empty else [], publication_dates, as_of)
+            if coverage < BACKFILL_MIN_STATEMENT_COVERAGE:
+                raise ValueError(f"only {coverage:.0%} of the cross-section has published statements")
+            targets = [target for target in time_horizons.values() if target in cross_section.columns]
+            pure_returns = calculate_pure_returns_multi(cross_section, stability_metric_columns(cross_section), targets)
+            results.append((as_of, pure_returns, len(cross_section), None, time.perf_counter() - start))
+        except Exception as e:
+            results.append((as_of, None, 0, str(e), time.perf_counter() - start))
+    return results
+
+def load_backfill_fundamentals(ticker_symbol):
+    """(financials, balancesheet, cashflow) and `info` for a ticker, from the store or fetched through the provider."""
+    store, provider = get_market_data_store(), get_data_provider()
+    frames = tuple(store.load_or_fetch(kind, ticker_symbol, lambda kind=kind: provider.statements(ticker_symbol, kind))
+                   for kind in ("financials", "balancesheet", "cashflow"))
+    return frames, store.load_or_fetch("info", ticker_symbol, lambda: provider.info(ticker_symbol)) or {}
+
+def backfill_pure_returns(universe=None, months=BACKFILL_MONTHS, time_horizons=TIME_HORIZONS, workers=None, store=None):
+    """
+    Fills the pure-return history with point-in-time runs at the last `months` month-ends, computed
+    in parallel across a process pool from the stored prices and statements. Month-ends already in
+    the store for every horizon are skipped, so an interrupted backfill can simply be re-run.
+    The universe is today's, so delisted names are missing from the past cross-sections. Statements
+    not yet in the market-data store are fetched through the provider; tickers with none are skipped
+    with a warning, and month-ends below BACKFILL_MIN_STATEMENT_COVERAGE are reported, not recorded.
+
+    Returns:
+        pd.DataFrame: One row per month-end computed: as_of, n_tickers, recorded horizons, seconds, error.
+    """
+    store = store or get_pure_return_history()
+    workers = workers or PIPELINE_WORKERS
+    universe = universe or get_data_provider().universe() or tickers
+    etf_histories = fetch_all_etf_histories(etf_list)
+    price_panel = build_price_panel(universe, etf_histories)
+
+    statements, profiles = {}, {}
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        future_to_ticker = {executor.submit(load_backfill_fundamentals, t): t for t in universe}
+        for future in tqdm(as_completed(future_to_ticker), total=len(universe), desc="Loading Statements"):
+            t = future_to_ticker[future]
+            try: frames, info = future.result()
+            except Exception as e:
+                logging.error(f"Failed to load statements for {t}: {e}")
+                continue
+            if all(frame is None or frame.empty for frame in frames): continue
+            statements[t] = frames
+            profiles[t] = {"Name": info.get('longName', 'N/A'), "Sector": info.get('sector', 'Unknown'), "shares": info.get('sharesOutstanding')}
+    missing = [t for t in universe if t not in profiles]
+    if missing:
+        logging.warning(f"Backfill skips {len(missing)} tickers without statements: {', '.join(missing[:20])}{' ...' if len(missing) > 20 else ''}")
+    if not profiles: raise RuntimeError("No statements available for the backfill universe.")
+
+    stored = {label: set(store.run_dates(label, cadence="monthly")) for label in time_horizons}
+    dates = [d for d in backfill_dates(price_panel.index, months) if any(d.strftime("%Y-%m-%d") not in stored[label] for label in time_horizons)]
+    if not dates: return pd.DataFrame(columns=["as_of", "n_tickers", "recorded", "seconds", "error"])
+
+    chunks = [list(chunk) for chunk in np.array_split(np.array(dates, dtype=object), min(workers, len(dates)))]
+    inputs = (price_panel, etf_histories, statements, profiles, dict(time_horizons))
+    chunk_results = None
+    if workers > 1 and len(chunks) > 1 and process_pools_enabled():
+        try:
+            # Forked workers inherit the inputs; tasks only carry their dates
+            with _process_pool(workers, initializer=_init_backfill_worker, initargs=(inputs,)) as executor:
+                chunk_results = list(executor.map(_backfill_task, chunks))
+        except Exception as e:
+            logging.error(f"Backfill process pool failed, running in-process: {e}")
+    if chunk_results is None:
+        _init_backfill_worker(inputs)
+        chunk_results = [_backfill_task(chunk) for chunk in chunks]
+
+    summary = []
+    for as_of, pure_returns, n_tickers, error, seconds in (result for results in chunk_results for result in results):
+        recorded = record_pure_returns(pure_returns, time_horizons, run_date=as_of, store=store, cadence="monthly", n_tickers=n_tickers) if error is None else []
+        if error is not None: logging.error(f"Backfill at {as_of:%Y-%m-%d} failed: {error}")
+        summary.append({"as_of": as_of, "n_tickers": n_tickers, "recorded": ", ".join(recorded), "seconds": seconds, "error": error})
+    return pd.DataFrame(summary)
+
 def main():
     st.title("Quantitative Portfolio Analysis")
     st.sidebar.header("Controls")
     if st.sidebar.button("Clear Cache & Re-run All", type="primary"):
         st.cache_data.clear()
+        get_stage_cache().clear()
         st.rerun()
 
+    st.sidebar.subheader("Data Source")
+    snapshot_ids = list_screening_snapshots()[::-1]
+    data_source = st.sidebar.selectbox("Screening Run", [*snapshot_ids, LIVE_DATA_SOURCE],
+                                       help="A snapshot written by `tradfiIIresearch.py screen` (newest first), or a full live recompute.")
+
     st.sidebar.subheader("Portfolio Construction")
     weighting_method_ui = st.sidebar.selectbox(
         "Portfolio Weighting Method",
@@ -1939,52 +5130,67 @@ def main():
     )
     corr_window = st.sidebar.slider("Correlation Window (days)", min_value=30, max_value=180, value=90, step=30)
 
-    # --- Data Fetching and Processing ---
-    with st.spinner("Fetching ETF histories..."):
-        etf_histories = fetch_all_etf_histories(etf_list)
-    st.success("ETF histories loaded.")
-
-    with st.spinner(f"Processing {len(tickers)} tickers... This may take several minutes."):
-        results_df, failed_tickers, returns_dict = process_tickers(tickers, etf_histories, sector_etf_map)
+    time_horizons = TIME_HORIZONS
+    graph, stage_cache = build_screening_graph(time_horizons), get_stage_cache()
+
+    if data_source != LIVE_DATA_SOURCE:
+        # --- Snapshot: everything up to the top-15 names comes from the batch run ---
+        snapshot = get_screening_snapshot(data_source)
+        results_df, failed_tickers, returns_dict = snapshot["results_df"], snapshot["failed_tickers"], snapshot["returns_df"]
+        etf_histories, price_panel = snapshot["etf_histories"], snapshot["price_panel"]
+        sources = {
+            "results_df": results_df, "returns_dict": returns_dict, "etf_histories": etf_histories, "price_panel": price_panel,
+            "factor_weights": (snapshot["auto_weights"], snapshot["rationale_df"], snapshot["stability_results"]),
+            "scoring": {"results_df": results_df, "top_df": snapshot["top_df"]},
+        }
+        if snapshot["manifest"].get("parameters", {}).get("corr_window") == corr_window and snapshot["cov_matrix"] is not None:
+            top_tickers = snapshot["top_df"]['Ticker'].tolist()
+            sources["covariance"] = snapshot["cov_matrix"].loc[top_tickers, top_tickers]
+        # Snapshots are immutable, so their id stands in for the content hash
+        source_hashes = {name: f"snapshot:{data_source}:{name}" for name in sources}
+        st.caption(f"Snapshot `{data_source}` ({snapshot['manifest'].get('provider')}, created {snapshot['manifest'].get('created')}): {len(results_df)} tickers.")
+    else:
+        # --- Data Fetching and Processing ---
+        universe = get_data_provider().universe() or tickers
+        with st.spinner("Fetching ETF histories..."):
+            etf_histories = fetch_all_etf_histories(etf_list)
+        st.success("ETF histories loaded.")
+
+        with st.spinner("Building shared price panel..."):
+            price_panel = build_price_panel(universe, etf_histories)
+
+        with st.spinner(f"Processing {len(universe)} tickers... This may take several minutes."):
+            results_df, failed_tickers, returns_dict = process_tickers(universe, etf_histories, sector_etf_map, price_panel)
+
+        if results_df.empty:
+            st.error("Fatal Error: No tickers could be processed.")
+            st.stop()
+        st.success(f"Successfully processed {len(results_df)} tickers.")
+        logging.info(f"Price history refresh: {get_market_data_store().refresh_report()}")
+        logging.info(f"GARCH estimation: {get_garch_estimator().report()}")
+        sources = {"results_df": results_df, "returns_dict": returns_dict, "etf_histories": etf_histories, "price_panel": price_panel,
+                   "pure_return_history": load_pure_return_history(time_horizons)}
+        source_hashes = {}
+
+    sources.update(weighting_method=weighting_method_ui, new_factor=new_factor, corr_window=corr_window)
+    # --- NEW: AUTOMATIC WEIGHTING BASED ON MULTI-HORIZON COEFFICIENT STABILITY, THEN SCORING ---
+    with st.spinner("Analyzing factor stability across multiple time horizons..."):
+        live = data_source == LIVE_DATA_SOURCE
+        screened = graph.run(["factor_weights", "scoring", *(["pure_returns"] if live else [])], sources, cache=stage_cache, source_hashes=source_hashes)
+        if live: record_pure_returns(screened["pure_returns"], time_horizons, n_tickers=len(sources["results_df"]), n_failed=len(failed_tickers))
+    auto_weights, rationale_df, stability_results = screened["factor_weights"]
+    results_df, top_15_df = screened["scoring"]["results_df"], screened["scoring"]["top_df"]
+    screening_report = graph.last_report
 
-    if results_df.empty:
-        st.error("Fatal Error: No tickers could be processed.")
-        st.stop()
-    st.success(f"Successfully processed {len(results_df)} tickers.")
     if failed_tickers:
         st.expander("Show Failed Tickers").warning(f"{len(failed_tickers)} tickers failed: {', '.join(failed_tickers)}")
 
-    # --- NEW: AUTOMATIC WEIGHTING BASED ON MULTI-HORIZON COEFFICIENT STABILITY ---
     st.sidebar.subheader("Automatic Factor Weighting")
-    with st.spinner("Analyzing factor stability across multiple time horizons..."):
-        # 1. Define the time horizons to test
-        time_horizons = {
-            "1M": "Return_21d",
-            "3M": "Return_63d",
-            "6M": "Return_126d",
-            "12M": "Return_252d",
-        }
-
-        valid_metric_cols = [c for c in results_df.columns if pd.api.types.is_numeric_dtype(results_df[c]) and 'Return' not in c and c not in ['Ticker', 'Name', 'Score']]
-        stability_results = {}
-
-        # 2. Loop through each horizon, calculate pure returns, simulate history, and analyze stability
-        for horizon_label, target_column in time_horizons.items():
-            if target_column in results_df.columns:
-                pure_returns_today = calculate_pure_returns(results_df, valid_metric_cols, target=target_column)
-                if not pure_returns_today.empty:
-                    historical_pure_returns = simulate_historical_pure_returns(pure_returns_today)
-                    stability_df = analyze_coefficient_stability(historical_pure_returns)
-                    stability_results[horizon_label] = stability_df
-
-        # 3. Aggregate the stability results from all horizons to find the most consistent factors
-        all_possible_metrics = list(default_weights.keys())
-        auto_weights, rationale_df = aggregate_stability_and_set_weights(
-            stability_results, all_possible_metrics, REVERSE_METRIC_NAME_MAP
-        )
-
     with st.sidebar.expander("View Factor Stability Rationale", expanded=True):
         st.write("Weights are driven by a factor's **average performance** and **consistency** across 1, 3, 6, and 12-month return horizons. Higher scores are better.")
+        if "pure_return_history" in sources:
+            stored_runs = ", ".join(f"{label}: {frame.shape[1]}" for label, frame in sources["pure_return_history"].items())
+            st.caption(f"Stored coefficient runs per horizon ({stored_runs}); below {PURE_RETURN_MIN_HISTORY} the history is simulated.")
         st.dataframe(
             rationale_df[['avg_sharpe_coeff', 'consistency_score', 'horizons_present', 'Final_Weight']].loc[rationale_df['Final_Weight'] > 0.1].sort_values('Final_Weight', ascending=False),
             column_config={
@@ -1994,114 +5200,66 @@ def main():
                 "Final_Weight": st.column_config.NumberColumn("Weight %", format="%.2f")
             }
         )
-
-    user_weights = auto_weights
     # --- END OF AUTOMATION BLOCK ---
 
-    # --- Scoring Block ---
-    raw_score = pd.Series(0.0, index=results_df.index)
-    for long_name, weight in user_weights.items():
-        if weight > 0:
-            short_name = REVERSE_METRIC_NAME_MAP.get(long_name)
-            if short_name in results_df.columns and short_name in rationale_df.index:
-                rank_series = results_df[short_name].rank(pct=True)
-
-                # *** CRITICAL FIX ***
-                # Use the SIGN of the AGGREGATED sharpe coefficient to determine if lower is better
-                if rationale_df.loc[short_name, 'avg_sharpe_coeff'] < 0:
-                    rank_series = 1 - rank_series # Invert the rank for factors that are better when low (e.g., P/E ratio)
-
-                raw_score += rank_series.fillna(0.5) * weight
-
-    def z_score(series): return (series - series.mean()) / (series.std() if series.std() > 0 else 1)
-    results_df['Score'] = z_score(raw_score)
-    top_15_df = results_df.sort_values('Score', ascending=False).head(15).copy()
     top_15_tickers = top_15_df['Ticker'].tolist()
 
-    # --- The rest of the main function remains unchanged ---
-
     st.header("📈 Portfolio Overview")
     if not top_15_tickers:
         st.warning("No stocks for portfolio construction.")
         st.stop()
 
-    portfolio_returns_df = pd.DataFrame(returns_dict).reindex(columns=top_15_tickers).dropna(how='all')
-    _, cov_matrix = calculate_correlation_matrix(top_15_tickers, returns_dict, window=corr_window)
-    cov_matrix = cov_matrix.loc[top_15_tickers, top_15_tickers]
-
-    momentum_factor_returns = etf_histories['MTUM']['Close'].pct_change().dropna()
-    common_idx = portfolio_returns_df.index.intersection(momentum_factor_returns.index)
-    aligned_returns = portfolio_returns_df.loc[common_idx].copy()
-    aligned_momentum = momentum_factor_returns.loc[common_idx].copy()
-    
-    # --- FIX: Replace inf/-inf and fillna without inplace ---
-    aligned_returns = aligned_returns.replace([np.inf, -np.inf], np.nan).fillna(0.0)
-    aligned_momentum = aligned_momentum.replace([np.inf, -np.inf], np.nan).fillna(0.0)
-
-    betas = pd.DataFrame(index=top_15_tickers, columns=['Momentum_Beta'])
-    for ticker in top_15_tickers:
-        try:
-            model = LinearRegression().fit(aligned_momentum.values.reshape(-1, 1), aligned_returns[ticker].values)
-            betas.loc[ticker, 'Momentum_Beta'] = model.coef_[0]
-        except Exception: betas.loc[ticker, 'Momentum_Beta'] = 1.0
-
+    built = graph.run(["portfolio", "metrics", "rolling_malv", "frontier"], {**sources, **screened}, cache=stage_cache,
+                      source_hashes={**source_hashes, **graph.last_hashes})
+    portfolio, metrics, rolling_malv = built["portfolio"], built["metrics"], built["rolling_malv"]
+    frontier, _ = built["frontier"]
+    weights_df = portfolio["weights_df"]
     if new_factor != "None":
         st.subheader(f"FMP for: {new_factor}")
-        factor_map = {"Value (IVE)": "IVE", "Growth (IVW)": "IVW", "Quality (QUAL)": "QUAL", "Vision (Synthetic)": "VISION_SYNTHETIC"}
-        key = factor_map.get(new_factor)
-        if key in etf_histories:
-            factor_ts = etf_histories[key]['Close'].pct_change().dropna()
-            p_weights = calculate_fmp_weights(aligned_returns, factor_ts, cov_matrix, existing_factors_returns=aligned_momentum.to_frame())
-
-            weights_df = p_weights.reset_index()
-            weights_df.columns = ['Ticker', 'FMP Weight']
-            weights_df = pd.merge(weights_df, top_15_df[['Ticker', 'Name']], on='Ticker', how='left')
-            display_cols = ['Ticker', 'Name', 'FMP Weight']
-            st.dataframe(
-                weights_df.sort_values("FMP Weight", key=abs, ascending=False)[display_cols],
-                use_container_width=True
-            )
+        if portfolio["p_weights"] is not None:
+            st.dataframe(weights_df.sort_values("FMP Weight", key=abs, ascending=False)[['Ticker', 'Name', 'FMP Weight']], use_container_width=True)
     else:
         st.subheader(f"Portfolio Weights ({weighting_method_ui})")
-        method_map = {"Equal Weight": "equal", "Inverse Volatility": "inv_vol", "Log Log Sharpe Optimized": "log_log_sharpe"}
-        if weighting_method_ui == "Factor-Mimicking (Momentum)": p_weights = calculate_weights(aligned_returns, method="fmp", cov_matrix=cov_matrix, factor_returns=aligned_momentum)
-        elif weighting_method_ui == "Alpha Orthogonal": p_weights = calculate_weights(aligned_returns, method="alpha_orthogonal", betas=betas)
-        else: p_weights = calculate_weights(aligned_returns, method=method_map.get(weighting_method_ui, "equal"), cov_matrix=cov_matrix)
+        st.dataframe(weights_df.sort_values("Weight", ascending=False)[['Ticker', 'Name', 'Weight']], use_container_width=True)
 
-        weights_df = p_weights.reset_index()
-        weights_df.columns = ['Ticker', 'Weight']
-        weights_df = pd.merge(weights_df, top_15_df[['Ticker', 'Name']], on='Ticker', how='left')
-        display_cols = ['Ticker', 'Name', 'Weight']
-        st.dataframe(
-            weights_df.sort_values("Weight", ascending=False)[display_cols],
-            use_container_width=True
-        )
+    if metrics["best_etf"] is not None:
+        st.write(f"**Top-Correlated ETF:** `{metrics['best_etf']}` (Correlation: {metrics['best_corr']:.4f})")
+        st.write(f"**Portfolio Relative Z-Score vs {metrics['best_etf']}:** {metrics['relative_z']:.4f}")
 
-    weighted_df_calc = pd.DataFrame()
-    if 'weights_df' in locals():
-        if 'Weight' in weights_df.columns: weighted_df_calc = weights_df[['Ticker', 'Weight']].copy()
-        elif 'FMP Weight' in weights_df.columns: weighted_df_calc = weights_df[['Ticker', 'FMP Weight']].rename(columns={'FMP Weight': 'Weight'}).copy()
-
-    if not weighted_df_calc.empty:
-        corrs = calculate_portfolio_factor_correlations(weighted_df_calc, etf_histories)
-        best_etf, best_corr = (corrs.index[0], corrs.iloc[0]) if not corrs.empty else ('SPY', np.nan)
-        z, _ = calculate_portfolio_relative_z_score(weighted_df_calc, etf_histories, best_etf)
-        st.write(f"**Top-Correlated ETF:** `{best_etf}` (Correlation: {best_corr:.4f})")
-        st.write(f"**Portfolio Relative Z-Score vs {best_etf}:** {z:.4f}")
-
-    if 'p_weights' in locals() and p_weights is not None and not p_weights.empty:
-        aligned_w = p_weights.reindex(aligned_returns.columns).fillna(0)
-        final_returns = (aligned_returns * aligned_w).sum(axis=1)
-        scores = top_15_df.set_index('Ticker').reindex(aligned_returns.columns)['Score'].fillna(0)
-        alpha_weights = scores / scores.sum() if scores.sum() != 0 else pd.Series(1/len(scores), index=scores.index)
-        forecast_ts_unlagged = (aligned_returns * alpha_weights).sum(axis=1)
-        lagged_forecast_ts = forecast_ts_unlagged.shift(1)
-        malv, _ = calculate_mahalanobis_metrics(aligned_returns, cov_matrix)
-        ic, ir = calculate_information_metrics(lagged_forecast_ts, final_returns)
+    if portfolio["p_weights"] is not None and not portfolio["p_weights"].empty:
         col1, col2, col3 = st.columns(3)
-        col1.metric("Precision Matrix Quality (MALV)", f"{malv:.4f}", help=f"Expected: {2/len(top_15_tickers):.4f}")
-        col2.metric("Information Coefficient (IC)", f"{ic:.4f}", help="Lagged correlation of alpha vs returns.")
-        col3.metric("Information Ratio (IR)", f"{ir:.4f}", help="Risk-adjusted return (Sharpe).")
+        col1.metric("Precision Matrix Quality (MALV)", f"{metrics['malv']:.4f}", help=f"Expected: {2/len(top_15_tickers):.4f}")
+        col2.metric("Information Coefficient (IC)", f"{metrics['ic']:.4f}", help="Lagged correlation of alpha vs returns.")
+        col3.metric("Information Ratio (IR)", f"{metrics['ir']:.4f}", help="Risk-adjusted return (Sharpe).")
+        if not rolling_malv.empty:
+            with st.expander("Rolling Precision Matrix Quality (63-day MALV)"):
+                fig = go.Figure(go.Scatter(x=rolling_malv.index, y=rolling_malv.values, mode='lines', name='MALV'))
+                fig.update_layout(height=300, margin=dict(l=0, r=0, t=10, b=0))
+                st.plotly_chart(fig, use_container_width=True)
+
+    solved = frontier.dropna(subset=['volatility'])
+    if not solved.empty:
+        with st.expander("Efficient Frontier (Log Log Sharpe: risk aversion x position cap)"):
+            fig = go.Figure([go.Scatter(x=points['volatility'], y=points['expected_return'], mode='lines+markers', name=f"cap {cap:.0%}",
+                                        customdata=points[['gamma', 'sharpe']].values,
+                                        hovertemplate="gamma %{customdata[0]}<br>vol %{x:.2%}<br>return %{y:.2%}<br>Sharpe %{customdata[1]:.2f}<extra></extra>")
+                             for cap, points in solved.groupby('cap')])
+            fig.update_layout(height=350, margin=dict(l=0, r=0, t=10, b=0), xaxis_title="Volatility", yaxis_title="Expected Return",
+                              xaxis_tickformat=".0%", yaxis_tickformat=".0%")
+            st.plotly_chart(fig, use_container_width=True)
+            st.caption(f"Current settings: gamma {LOG_LOG_SHARPE_GAMMA}, cap {LOG_LOG_SHARPE_MAX_WEIGHT:.0%}. Turnover is measured against the weights above.")
+            st.dataframe(solved, use_container_width=True, hide_index=True,
+                         column_config={c: st.column_config.NumberColumn(format="%.4f") for c in ['expected_return', 'volatility', 'sharpe', 'turnover', 'max_weight']})
+
+    with st.expander("Pipeline Stage Report"):
+        stage_report = pd.concat([screening_report, graph.last_report], ignore_index=True).drop_duplicates("stage")
+        st.dataframe(stage_report, use_container_width=True, hide_index=True,
+                     column_config={"seconds": st.column_config.NumberColumn("Seconds", format="%.3f")})
+        st.caption(f"Stage cache: {stage_cache.stats()}")
+        optimizers = optimizer_report()
+        if not optimizers.empty:
+            st.caption("Portfolio optimizers (compile = one-off canonicalization; update = parameter substitution on re-solves)")
+            st.dataframe(optimizers, use_container_width=True, hide_index=True)
 
     # --- Detailed Report Tabs ---
     st.header("📊 Detailed Reports")
@@ -2119,7 +5277,7 @@ def main():
     tab1, tab2, tab3 = st.tabs(["🔬 Stock Dashboard & Financials", "🎛️ Factor Analysis", "📄 Full Data Table"])
     with tab1:
         if selected_ticker:
-            display_stock_dashboard(selected_ticker, results_df, returns_dict, etf_histories)
+            display_stock_dashboard(selected_ticker, results_df, returns_dict, etf_histories, price_panel)
             display_deep_dive_data(selected_ticker)
     with tab2:
         st.subheader("Pure Factor Returns (Aggregated & Individual Horizons)")
@@ -2138,5 +5296,403 @@ def main():
         st.subheader("Full Processed Data Table")
         st.dataframe(results_df)
 
+# --- Benchmark Suite ---
+# End-to-end timing of the screening pipeline on offline FixtureProvider universes. Every
+# stage records wall time, peak RSS (sampled from /proc while the stage runs) and, with
+# `trace_allocations`, the tracemalloc peak. Runs are saved as JSON in BENCHMARK_DIR and
+# compared against the previous run (or, on a fresh checkout, the committed BENCHMARK_BASELINE)
+# to flag regressions. 10,000 names is left out of the defaults: the 1,500 run already spends
+# ~9 minutes in process_tickers on one core, so pass it explicitly on a many-core machine.
+BENCHMARK_DIR = os.environ.get("TRADFI_BENCHMARK_DIR", "benchmarks")
+BENCHMARK_BASELINE = os.environ.get("TRADFI_BENCHMARK_BASELINE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json"))
+BENCHMARK_SIZES = (100, 1500)
+BENCHMARK_REGRESSION_TOLERANCE = 0.20   # relative slowdown flagged as a regression
+BENCHMARK_MIN_SECONDS = 0.05            # ignore stages too fast to time reliably
+
+def _current_rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        # ru_maxrss is the lifetime peak (KB on Linux, bytes on macOS); the best available fallback
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+class StageProfiler:
+    """Collects per-stage wall time, peak RSS and allocation peaks: `with profiler.stage("name"): ...`."""
+    def __init__(self, trace_allocations=True, sample_interval=0.01):
+        self.trace_allocations, self.sample_interval = trace_allocations, sample_interval
+        self.stages = {}
+
+    def stage(self, name):
+        profiler = self
+        class _Stage:
+            def __enter__(self):
+                self.rss_start = self.rss_peak = _current_rss_mb()
+                self._stop = threading.Event()
+                def sample():
+                    while not self._stop.wait(profiler.sample_interval):
+                        self.rss_peak = max(self.rss_peak, _current_rss_mb())
+                self._sampler = threading.Thread(target=sample, daemon=True)
+                self._sampler.start()
+                if profiler.trace_allocations:
+                    if not tracemalloc.is_tracing(): tracemalloc.start()
+                    tracemalloc.reset_peak()
+                self.start = time.perf_counter()
+                return self
+
+            def __exit__(self, *exc_info):
+                wall = time.perf_counter() - self.start
+                alloc_peak = tracemalloc.get_traced_memory()[1] / 2**20 if profiler.trace_allocations else np.nan
+                self._stop.set(); self._sampler.join()
+                rss_end = _current_rss_mb()
+                metrics = {
+                    "wall_s": wall, "peak_rss_mb": max(self.rss_peak, rss_end),
+                    "rss_delta_mb": max(self.rss_peak, rss_end) - self.rss_start, "alloc_peak_mb": alloc_peak,
+                }
+                # Re-entering a name (e.g. several graph stages profiled as one) accumulates
+                # wall time and keeps the peaks
+                previous = profiler.stages.get(name)
+                if previous is not None:
+                    metrics = {"wall_s": previous["wall_s"] + wall, **{k: max(previous[k], metrics[k]) for k in ("peak_rss_mb", "rss_delta_mb", "alloc_peak_mb")}}
+                profiler.stages[name] = metrics
+                return False
+        return _Stage()
+
+def benchmark_pipeline(n_tickers=1500, seed=0, workers=None, trace_allocations=True, weighting_method="Log Log Sharpe Optimized", corr_window=90):
+    """
+    Runs `run_screening_pipeline` on a synthetic universe and profiles each stage, plus a
+    standalone `check_multicollinearity` pass on the full characteristic matrix.
+    Uses a throwaway market data store and a memory-only stage cache, so every run starts
+    from cold caches.
+
+    Returns:
+        dict: {"n_tickers", "stages": {stage: metrics}, "total_s", "n_processed"}.
+    """
+    profiler = StageProfiler(trace_allocations=trace_allocations)
+    previous_provider = get_data_provider()
+    st.cache_data.clear()
+    try:
+        with tempfile.TemporaryDirectory(prefix="tradfi_bench_") as store_root:
+            set_data_provider(FixtureProvider(n_tickers=n_tickers, seed=seed), store_root=store_root)
+            run = run_screening_pipeline(weighting_method=weighting_method, corr_window=corr_window, workers=workers, profiler=profiler,
+                                         stage_cache=StageCache(root=None))
+            results_df, failed_tickers = run["results_df"], run["failed_tickers"]
+            metric_cols = [c for c in results_df.columns if pd.api.types.is_numeric_dtype(results_df[c]) and 'Return' not in c and c not in ['Ticker', 'Name', 'Score']]
+            with profiler.stage("check_multicollinearity"):
+                X = results_df[metric_cols].replace([np.inf, -np.inf], np.nan)
+                check_multicollinearity(X.fillna(X.median()), metric_cols)
+    finally:
+        set_data_provider(previous_provider)
+        st.cache_data.clear()
+    return {
+        "n_tickers": n_tickers, "n_processed": len(results_df), "n_failed": len(failed_tickers),
+        "stages": profiler.stages, "total_s": sum(stage["wall_s"] for stage in profiler.stages.values()),
+    }
+
+def benchmark_vif_elimination(n_rows=1500, n_features=80, n_composites=4, seed=0, vif_threshold=5.0):
+    """
+    Times `check_multicollinearity` with the inverse-correlation engine against the statsmodels
+    loop on a synthetic characteristic matrix: a few latent factors plus noise, with
+    `n_composites` exact linear combinations (like Profitability_Factor in the real screen).
+
+    Returns:
+        dict: n_rows, n_features, inverse_s, statsmodels_s, speedup, n_kept and whether both
+              engines kept the same features.
+    """
+    rng = np.random.default_rng(seed)
+    latent = rng.normal(size=(n_rows, max(1, n_features // 8)))
+    values = latent @ rng.normal(size=(latent.shape[1], n_features)) + rng.normal(scale=0.5, size=(n_rows, n_features))
+    for i in range(min(n_composites, n_features // 3)):
+        values[:, n_features - 1 - i] = values[:, 2 * i] + 0.5 * values[:, 2 * i + 1]
+    X = pd.DataFrame(values, columns=[f"metric_{i}" for i in range(n_features)])
+    timings, kept = {}, {}
+    for method in ("inverse", "statsmodels"):
+        start = time.perf_counter()
+        kept[method] = check_multicollinearity(X, X.columns.tolist(), vif_threshold, method=method)
+        timings[method] = time.perf_counter() - start
+    return {
+        "n_rows": n_rows, "n_features": n_features, "inverse_s": timings["inverse"], "statsmodels_s": timings["statsmodels"],
+        "speedup": timings["statsmodels"] / timings["inverse"] if timings["inverse"] > 0 else np.nan,
+        "n_kept": len(kept["inverse"]), "identical": kept["inverse"] == kept["statsmodels"],
+    }
+
+def _benchmark_metadata():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "unknown"
+    except Exception:
+        revision = "unknown"
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"), "revision": revision,
+        "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+        "machine": platform.machine(), "cpu_count": os.cpu_count(),
+    }
+
+def load_benchmark_results(path=None, results_dir=BENCHMARK_DIR):
+    """
+    Loads a saved run; without `path`, the most recent one in `results_dir`, else BENCHMARK_BASELINE
+    (None if there is neither).
+    """
+    if path is None:
+        runs = sorted(f for f in os.listdir(results_dir) if f.startswith("bench_") and f.endswith(".json")) if os.path.isdir(results_dir) else []
+        path = os.path.join(results_dir, runs[-1]) if runs else BENCHMARK_BASELINE
+        if not os.path.exists(path): return None
+    with open(path) as f:
+        return json.load(f)
+
+def compare_benchmarks(current, baseline, tolerance=BENCHMARK_REGRESSION_TOLERANCE, min_seconds=BENCHMARK_MIN_SECONDS):
+    """
+    Stage-by-stage comparison of two saved runs.
+
+    Returns:
+        pd.DataFrame: One row per (n_tickers, stage) present in both runs, with baseline and current
+                      wall times, their ratio, the peak-RSS change and a 'Regression' flag.
+    """
+    rows = []
+    for size, run in current.get("runs", {}).items():
+        base_run = baseline.get("runs", {}).get(size)
+        if base_run is None: continue
+        for stage, metrics in run["stages"].items():
+            base = base_run["stages"].get(stage)
+            if base is None: continue
+            ratio = metrics["wall_s"] / base["wall_s"] if base["wall_s"] > 0 else np.nan
+            rows.append({
+                "n_tickers": int(size), "stage": stage, "baseline_s": base["wall_s"], "current_s": metrics["wall_s"], "ratio": ratio,
+                "rss_change_mb": metrics["peak_rss_mb"] - base["peak_rss_mb"],
+                "Regression": bool(ratio > 1 + tolerance and metrics["wall_s"] - base["wall_s"] > min_seconds),
+            })
+    return pd.DataFrame(rows)
+
+def run_benchmark_suite(sizes=BENCHMARK_SIZES, results_dir=BENCHMARK_DIR, baseline_path=None, seed=0, workers=None, trace_allocations=True):
+    """
+    Benchmarks the pipeline at each universe size (plus `benchmark_vif_elimination`), saves the
+    run as JSON in `results_dir` and compares it with `baseline_path` (default: the previous saved
+    run, see `load_benchmark_results`).
+
+    Returns:
+        tuple: (results dict, comparison DataFrame or None when there is no baseline).
+    """
+    baseline = load_benchmark_results(baseline_path, results_dir)
+    results = {"meta": _benchmark_metadata(), "runs": {}}
+    for size in sizes:
+        logging.info(f"Benchmarking pipeline with {size} tickers...")
+        results["runs"][str(size)] = benchmark_pipeline(size, seed=seed, workers=workers, trace_allocations=trace_allocations)
+    results["vif"] = benchmark_vif_elimination(seed=seed)
+    os.makedirs(results_dir, exist_ok=True)
+    stamp = results["meta"]["timestamp"].replace(":", "").replace("-", "")
+    with open(os.path.join(results_dir, f"bench_{stamp}_{results['meta']['revision']}.json"), "w") as f:
+        json.dump(results, f, indent=2, default=float)
+    comparison = compare_benchmarks(results, baseline) if baseline else None
+    if comparison is not None and comparison["Regression"].any():
+        logging.warning(f"Benchmark regressions:\n{comparison[comparison['Regression']].to_string(index=False)}")
+    return results, comparison
+
+def format_benchmark_report(results):
+    """Per-stage breakdown table (seconds, share of total, peak RSS, allocation peak) for every size."""
+    rows = []
+    for size, run in results["runs"].items():
+        for stage, metrics in run["stages"].items():
+            rows.append({"n_tickers": int(size), "stage": stage, "wall_s": metrics["wall_s"], "share": metrics["wall_s"] / run["total_s"] if run["total_s"] else np.nan,
+                         "peak_rss_mb": metrics["peak_rss_mb"], "alloc_peak_mb": metrics["alloc_peak_mb"]})
+    return pd.DataFrame(rows)
+
+# --- Headless CLI ---
+# `python tradfiIIresearch.py screen` runs the same pipeline as the dashboard without Streamlit
+# (e.g. from cron) and writes the artifacts into a timestamped run directory under
+# SCREENING_ARTIFACT_DIR; `benchmark` runs the benchmark suite. Under `streamlit run` the
+# dashboard starts as before.
+SCREENING_ARTIFACT_DIR = os.environ.get("TRADFI_ARTIFACT_DIR", "screening_artifacts")
+
+def _write_table(df, path_stem, fmt):
+    if fmt == "parquet":
+        df.to_parquet(f"{path_stem}.parquet")
+        return f"{path_stem}.parquet"
+    df.to_csv(f"{path_stem}.csv")
+    return f"{path_stem}.csv"
+
+def write_screening_artifacts(run, output_dir=SCREENING_ARTIFACT_DIR, fmt="parquet", timings=None, parameters=None):
+    """
+    Writes a screening run to `output_dir/run_<timestamp>/` and points `output_dir/LATEST` at it.
+
+    Tables (Parquet or CSV): results, stability_rationale, stability_by_horizon, top_portfolio,
+    weights, covariance, frontier, returns and one prices_<field> frame per PricePanel field. JSON:
+    portfolio_metrics (metrics + automatic factor weights) and a manifest with parameters,
+    failed tickers, file list, stage timings and the stage graph's hit/miss report. `load_screening_snapshot` reads a run back.
+
+    Returns:
+        str: The run directory.
+    """
+    created = datetime.now()
+    run_dir = os.path.join(output_dir, f"run_{created.strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(run_dir, exist_ok=False)
+    stability_by_horizon = pd.concat(
+        [df.assign(horizon=label) for label, df in run["stability_results"].items() if not df.empty] or [pd.DataFrame()]
+    )
+    results_df = run["results_df"].copy()
+    for col in results_df.select_dtypes(include="object").columns:
+        results_df[col] = results_df[col].astype("string")
+    tables = {
+        "results": results_df, "stability_rationale": run["rationale_df"], "stability_by_horizon": stability_by_horizon,
+        "top_portfolio": run["top_df"].astype({c: "string" for c in run["top_df"].select_dtypes(include="object").columns}),
+        "weights": run["portfolio"]["weights_df"], "covariance": run["portfolio"]["cov_matrix"], "returns": pd.DataFrame(run["returns_dict"]),
+        **({"frontier": run["frontier"]} if "frontier" in run else {}),
+        **{f"prices_{field}": frame for field, frame in run["price_panel"].frames.items()},
+    }
+    files = {name: os.path.basename(_write_table(df, os.path.join(run_dir, name), fmt)) for name, df in tables.items()}
+    with open(os.path.join(run_dir, "portfolio_metrics.json"), "w") as f:
+        json.dump({"metrics": run["metrics"], "auto_weights": run["auto_weights"]}, f, indent=2, default=float)
+    manifest = {
+        "created": created.isoformat(timespec="seconds"), "provider": get_data_provider().name, "format": fmt,
+        "n_tickers": len(run["results_df"]), "failed_tickers": run["failed_tickers"], "parameters": parameters or {},
+        "files": {**files, "portfolio_metrics": "portfolio_metrics.json"}, "timings": timings or {},
+        "stages": run["stage_report"].to_dict(orient="records") if "stage_report" in run else [],
+    }
+    with open(os.path.join(run_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, default=float)
+    with open(os.path.join(output_dir, "LATEST"), "w") as f:
+        f.write(os.path.basename(run_dir))
+    return run_dir
+
+def build_cli_parser():
+    parser = argparse.ArgumentParser(prog="tradfiIIresearch.py", description="Headless screening pipeline and benchmarks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    screen = subparsers.add_parser("screen", help="Run the full screen and write artifacts.")
+    screen.add_argument("--output-dir", default=SCREENING_ARTIFACT_DIR, help="Artifact root; each run gets its own sub-directory.")
+    screen.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    screen.add_argument("--weighting", choices=list(WEIGHTING_METHODS), default="Equal Weight")
+    screen.add_argument("--fmp-factor", choices=["None", *FMP_FACTORS], default="None")
+    screen.add_argument("--corr-window", type=int, default=90)
+    screen.add_argument("--workers", type=int, default=None, help="Compute-stage processes (default: TRADFI_WORKERS or CPU count).")
+    screen.add_argument("--provider", default=None, help="yfinance, fixture or fixture:<dir> (default: TRADFI_DATA_PROVIDER).")
+    screen.add_argument("--tickers", nargs="+", default=None, help="Screen these tickers instead of the configured universe.")
+
+    backfill = subparsers.add_parser("backfill", help="Backfill the pure-return history with point-in-time month-end runs.")
+    backfill.add_argument("--months", type=int, default=BACKFILL_MONTHS)
+    backfill.add_argument("--workers", type=int, default=None, help="Processes (default: TRADFI_WORKERS or CPU count).")
+    backfill.add_argument("--provider", default=None, help="yfinance, fixture or fixture:<dir> (default: TRADFI_DATA_PROVIDER).")
+    backfill.add_argument("--tickers", nargs="+", default=None, help="Backfill these tickers instead of the configured universe.")
+
+    bench = subparsers.add_parser("benchmark", help="Run the benchmark suite on synthetic universes.")
+    bench.add_argument("sizes", nargs="*", type=int, default=list(BENCHMARK_SIZES))
+    bench.add_argument("--results-dir", default=BENCHMARK_DIR)
+    bench.add_argument("--baseline", default=None, help="Saved run to compare against (default: the previous run).")
+    bench.add_argument("--workers", type=int, default=None)
+    bench.add_argument("--no-trace-allocations", action="store_true", help="Skip tracemalloc (lower overhead, no allocation peaks).")
+    return parser
+
+def run_cli(argv=None):
+    """Entry point for headless runs; returns a process exit code."""
+    args = build_cli_parser().parse_args(argv)
+    warnings.simplefilter("ignore")
+    enable_process_pools()
+    if args.command == "benchmark":
+        results, comparison = run_benchmark_suite(args.sizes, results_dir=args.results_dir, baseline_path=args.baseline,
+                                                  workers=args.workers, trace_allocations=not args.no_trace_allocations)
+        print(format_benchmark_report(results).to_string(index=False))
+        vif = results["vif"]
+        print(f"VIF elimination ({vif['n_rows']}x{vif['n_features']}): inverse {vif['inverse_s']:.3f}s, statsmodels {vif['statsmodels_s']:.2f}s "
+              f"({vif['speedup']:.0f}x), {vif['n_kept']} kept, identical selections: {vif['identical']}")
+        if comparison is not None:
+            print(comparison.to_string(index=False))
+            return 1 if comparison["Regression"].any() else 0
+        return 0
+
+    if args.provider: set_data_provider(provider_from_spec(args.provider))
+    if args.command == "backfill":
+        summary = backfill_pure_returns(universe=args.tickers, months=args.months, workers=args.workers)
+        print(summary.to_string(index=False, formatters={"seconds": "{:.2f}".format}) if not summary.empty else "Nothing to backfill.")
+        for label in TIME_HORIZONS: print(f"  {label}: {len(get_pure_return_history().run_dates(label, cadence=PURE_RETURN_CADENCE))} stored {PURE_RETURN_CADENCE} runs")
+        return 1 if not summary.empty and summary["error"].notna().all() else 0
+
+    profiler = StageProfiler(trace_allocations=False)
+    start = time.perf_counter()
+    try:
+        run = run_screening_pipeline(universe=args.tickers, weighting_method=args.weighting, new_factor=args.fmp_factor,
+                                     corr_window=args.corr_window, workers=args.workers, profiler=profiler)
+    except RuntimeError as e:
+        logging.error(f"Screening failed: {e}")
+        print(f"Screening failed: {e}", file=sys.stderr)
+        return 1
+    timings = {name: metrics["wall_s"] for name, metrics in profiler.stages.items()}
+    timings["total_s"] = time.perf_counter() - start
+    parameters = {"weighting": args.weighting, "fmp_factor": args.fmp_factor, "corr_window": args.corr_window, "workers": args.workers or PIPELINE_WORKERS}
+    run_dir = write_screening_artifacts(run, args.output_dir, args.format, timings=timings, parameters=parameters)
+    logging.info(f"Price history refresh: {get_market_data_store().refresh_report()}")
+    logging.info(f"GARCH estimation: {get_garch_estimator().report()}")
+    print(f"Screened {len(run['results_df'])} tickers ({len(run['failed_tickers'])} failed); artifacts in {run_dir}")
+    for name, seconds in timings.items(): print(f"  {name:<30} {seconds:9.2f}s")
+    print(format_stage_report(run["stage_report"], get_stage_cache()))
+    optimizers = optimizer_report()
+    if not optimizers.empty: print(optimizers.to_string(index=False, float_format="{:.4f}".format))
+    return 0
+
+# --- Screening Snapshots ---
+# The dashboard reads a run written by `screen` instead of recomputing it: everything up to the
+# top-15 names (results, returns, prices, stability tables, scores) is loaded once per snapshot
+# and shared across sessions; only the stages downstream of a changed control are re-run.
+LIVE_DATA_SOURCE = "Live (recompute)"
+
+def list_screening_snapshots(artifact_dir=SCREENING_ARTIFACT_DIR):
+    """Run directory names under `artifact_dir` that have a manifest, oldest first."""
+    if not os.path.isdir(artifact_dir): return []
+    return sorted(d for d in os.listdir(artifact_dir) if os.path.isfile(os.path.join(artifact_dir, d, "manifest.json")))
+
+def _read_table(run_dir, filename):
+    path = os.path.join(run_dir, filename)
+    if filename.endswith(".parquet"): return pd.read_parquet(path)
+    return pd.read_csv(path, index_col=0)
+
+def _date_indexed(df):
+    df.index = pd.to_datetime(df.index)
+    return df
+
+def load_screening_snapshot(run_dir):
+    """
+    Reads a run written by `write_screening_artifacts` back into the shape returned by
+    `run_screening_pipeline` (without the portfolio, which depends on the dashboard controls).
+
+    Returns:
+        dict: results_df, failed_tickers, returns_df (wide) and returns_dict, price_panel,
+              etf_histories, auto_weights, rationale_df, stability_results, top_df, cov_matrix
+              (for the run's corr_window), metrics and manifest.
+    """
+    with open(os.path.join(run_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    files = manifest["files"]
+    tables = {name: _read_table(run_dir, filename) for name, filename in files.items() if name != "portfolio_metrics"}
+    with open(os.path.join(run_dir, files["portfolio_metrics"])) as f:
+        portfolio_metrics = json.load(f)
+
+    results_df, top_df = tables["results"], tables["top_portfolio"]
+    for df in (results_df, top_df):
+        for col in df.select_dtypes(include=["string", "str"]).columns:
+            df[col] = df[col].astype(object).where(df[col].notna(), np.nan)
+    returns_df = _date_indexed(tables["returns"])
+    price_panel = PricePanel({field: _date_indexed(tables[f"prices_{field}"]) for field in PricePanel.FIELDS if f"prices_{field}" in tables})
+    by_horizon = tables["stability_by_horizon"]
+    stability_results = {
+        label: by_horizon[by_horizon["horizon"] == label].drop(columns="horizon") if "horizon" in by_horizon.columns else pd.DataFrame()
+        for label in TIME_HORIZONS
+    }
+    return {
+        "results_df": results_df, "failed_tickers": manifest.get("failed_tickers", []),
+        "returns_df": returns_df, "returns_dict": {t: returns_df[t].dropna() for t in returns_df.columns},
+        "price_panel": price_panel, "etf_histories": {etf: price_panel.history(etf) for etf in etf_list if etf in price_panel},
+        "auto_weights": portfolio_metrics["auto_weights"], "rationale_df": tables["stability_rationale"],
+        "stability_results": stability_results, "top_df": top_df, "cov_matrix": tables.get("covariance"),
+        "metrics": portfolio_metrics["metrics"], "manifest": manifest,
+    }
+
+@st.cache_resource(max_entries=4)
+def get_screening_snapshot(snapshot_id, artifact_dir=SCREENING_ARTIFACT_DIR):
+    """Loads a snapshot once per process; callers must treat the returned objects as read-only."""
+    return load_screening_snapshot(os.path.join(artifact_dir, snapshot_id))
+
 if __name__ == "__main__":
-    main()
+    if st.runtime.exists():
+        main()
+    else:
+        sys.exit(run_cli())